@@ -0,0 +1,159 @@
+"""Critical-path and workload analysis of journey graphs.
+
+Every pass is linear in the size of the graph: adjacency lists are built
+once, stages are ordered with Kahn's algorithm, and earliest/latest times
+come from one forward and one backward sweep over that order. Stages on a
+cycle cannot be scheduled; they are reported and left out of the timing.
+"""
+from collections import defaultdict, deque
+from typing import Dict, List, Optional, Tuple
+
+from durations import DurationRange, parse_duration
+from models import DurationSummary, JourneyAnalysis, StageLoad, StageSchedule
+
+# Floating point tolerance when deciding whether a stage has zero slack
+_EPSILON = 1e-6
+
+def _stage_duration(node: dict) -> Optional[DurationRange]:
+    return parse_duration((node.get("data") or {}).get("duration"))
+
+def _longest_path(order: List[str], predecessors: Dict[str, List[str]], durations: Dict[str, float]) -> float:
+    finish = {}
+    for node_id in order:
+        start = max((finish[p] for p in predecessors[node_id]), default=0.0)
+        finish[node_id] = start + durations[node_id]
+    return max(finish.values(), default=0.0)
+
+def _text(value) -> Optional[str]:
+    return None if value is None else str(value)
+
+def _loads(schedule: Dict[str, StageSchedule], field: str) -> List[StageLoad]:
+    loads: Dict[str, StageLoad] = {}
+    for stage in schedule.values():
+        key = getattr(stage, field)
+        if not key:
+            continue
+        load = loads.get(key)
+        if load is None:
+            load = loads[key] = StageLoad(name=key)
+        load.stage_count += 1
+        load.min_minutes += stage.duration_min
+        load.max_minutes += stage.duration_max
+        load.expected_minutes += stage.duration_expected
+        if stage.critical:
+            load.critical_stage_count += 1
+    return sorted(loads.values(), key=lambda load: load.expected_minutes, reverse=True)
+
+def topological_order(
+    node_ids: List[str], edges: List[dict]
+) -> Tuple[List[str], Dict[str, List[str]], Dict[str, List[str]]]:
+    """Kahn's algorithm over the edges between known nodes.
+
+    Returns the order plus successor and predecessor lists; nodes on a cycle
+    are never released and are missing from the order.
+    """
+    known = set(node_ids)
+    successors: Dict[str, List[str]] = defaultdict(list)
+    predecessors: Dict[str, List[str]] = defaultdict(list)
+    in_degree = dict.fromkeys(node_ids, 0)
+    for edge in edges:
+        source, target = edge.get("source"), edge.get("target")
+        if source in known and target in known:
+            successors[source].append(target)
+            predecessors[target].append(source)
+            in_degree[target] += 1
+
+    queue = deque(node_id for node_id in node_ids if in_degree[node_id] == 0)
+    order = []
+    while queue:
+        node_id = queue.popleft()
+        order.append(node_id)
+        for target in successors[node_id]:
+            in_degree[target] -= 1
+            if in_degree[target] == 0:
+                queue.append(target)
+    return order, successors, predecessors
+
+def analyze_journey(journey_id: str, version: int, nodes: List[dict], edges: List[dict]) -> JourneyAnalysis:
+    """Compute the critical path, stage slack and department/responsible load"""
+    node_ids = list(dict.fromkeys(node["id"] for node in nodes))
+    order, successors, predecessors = topological_order(node_ids, edges)
+    scheduled = set(order)
+    cycle_nodes = [node_id for node_id in node_ids if node_id not in scheduled]
+
+    nodes_by_id = {node["id"]: node for node in nodes}
+    ranges = {node_id: _stage_duration(nodes_by_id[node_id]) for node_id in order}
+    unparsed = [node_id for node_id in order if ranges[node_id] is None]
+    expected = {n: r.expected_minutes if r else 0.0 for n, r in ranges.items()}
+    minimum = {n: r.min_minutes if r else 0.0 for n, r in ranges.items()}
+    maximum = {n: r.max_minutes if r else 0.0 for n, r in ranges.items()}
+
+    # Forward sweep: earliest start/finish and the predecessor that bounds it.
+    # Starting below zero gives every non-root stage a bound, zero-length
+    # start events and decisions included.
+    earliest_start, earliest_finish, bounding = {}, {}, {}
+    for node_id in order:
+        start, bound = float("-inf"), None
+        for predecessor in predecessors[node_id]:
+            if earliest_finish[predecessor] > start:
+                start, bound = earliest_finish[predecessor], predecessor
+        start = max(start, 0.0)
+        earliest_start[node_id] = start
+        earliest_finish[node_id] = start + expected[node_id]
+        bounding[node_id] = bound
+    total = max(earliest_finish.values(), default=0.0)
+
+    # Backward sweep: latest times that do not delay the end of the journey
+    latest_finish, latest_start = {}, {}
+    for node_id in reversed(order):
+        finish = min((latest_start[s] for s in successors[node_id] if s in latest_start), default=total)
+        latest_finish[node_id] = finish
+        latest_start[node_id] = finish - expected[node_id]
+
+    critical_path = []
+    if order:
+        # Latest node in topological order among those finishing last, so zero-length end events are included
+        node_id = max(reversed(order), key=lambda n: earliest_finish[n])
+        while node_id is not None:
+            critical_path.append(node_id)
+            node_id = bounding[node_id]
+        critical_path.reverse()
+    on_critical_path = set(critical_path)
+
+    schedule = {}
+    for node_id in order:
+        data = nodes_by_id[node_id].get("data") or {}
+        slack = latest_start[node_id] - earliest_start[node_id]
+        schedule[node_id] = StageSchedule(
+            node_id=node_id,
+            label=_text(data.get("label")),
+            department=_text(data.get("department")),
+            responsible=_text(data.get("responsible")),
+            duration_text=_text(data.get("duration")),
+            duration_parsed=ranges[node_id] is not None,
+            duration_min=minimum[node_id],
+            duration_max=maximum[node_id],
+            duration_expected=expected[node_id],
+            earliest_start=earliest_start[node_id],
+            earliest_finish=earliest_finish[node_id],
+            latest_start=latest_start[node_id],
+            latest_finish=latest_finish[node_id],
+            slack=max(slack, 0.0),
+            critical=node_id in on_critical_path or abs(slack) < _EPSILON,
+        )
+
+    return JourneyAnalysis(
+        journey_id=journey_id,
+        version=version,
+        total_duration=DurationSummary(
+            min_minutes=_longest_path(order, predecessors, minimum),
+            max_minutes=_longest_path(order, predecessors, maximum),
+            expected_minutes=total,
+        ),
+        critical_path=critical_path,
+        stages=[schedule[node_id] for node_id in order],
+        departments=_loads(schedule, "department"),
+        responsibles=_loads(schedule, "responsible"),
+        unparsed_durations=unparsed,
+        cycle_nodes=cycle_nodes,
+    )
@@ -0,0 +1,115 @@
+"""In-process LRU cache for encoded API responses.
+
+Entries are keyed by ``(journey_id, version)`` so a stale entry can never be
+served: a newer version simply misses. Writes still invalidate every entry
+of the journey they touch so old versions do not occupy memory.
+"""
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Dict, Hashable, Optional, Set, Tuple
+import os
+
+CacheKey = Tuple[str, Hashable]
+
+class ResponseCache:
+    """Thread-safe LRU of response bodies bounded by entry count and total bytes"""
+
+    def __init__(self, max_bytes: int, max_entries: int):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[CacheKey, bytes]" = OrderedDict()
+        self._keys_by_owner: Dict[str, Set[CacheKey]] = {}
+        self._bytes = 0
+        self._lock = Lock()
+        self._builders: Dict[CacheKey, Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: CacheKey) -> Optional[bytes]:
+        with self._lock:
+            content = self._entries.get(key)
+            if content is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return content
+
+    def put(self, key: CacheKey, content: bytes):
+        if len(content) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._entries[key] = content
+            self._keys_by_owner.setdefault(key[0], set()).add(key)
+            self._bytes += len(content)
+            while self._bytes > self.max_bytes or len(self._entries) > self.max_entries:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self._forget(evicted_key, evicted)
+                self.evictions += 1
+
+    def get_or_build(self, key: CacheKey, build: Callable[[], bytes]) -> bytes:
+        """Return the cached entry, building it at most once for concurrent callers.
+
+        Requests that miss on the same key while it is being built wait for
+        that build instead of repeating it.
+        """
+        content = self.get(key)
+        if content is not None:
+            return content
+        with self._lock:
+            builder = self._builders.setdefault(key, Lock())
+        with builder:
+            with self._lock:
+                content = self._entries.get(key)
+            if content is None:
+                content = build()
+                self.put(key, content)
+        with self._lock:
+            self._builders.pop(key, None)
+        return content
+
+    def invalidate(self, owner: str):
+        """Drop every cached entry whose key starts with ``owner`` (a journey id)"""
+        with self._lock:
+            for key in self._keys_by_owner.pop(owner, ()):
+                content = self._entries.pop(key, None)
+                if content is not None:
+                    self._bytes -= len(content)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_owner.clear()
+            self._bytes = 0
+
+    def _forget(self, key: CacheKey, content: bytes):
+        self._bytes -= len(content)
+        keys = self._keys_by_owner.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_owner[key[0]]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+response_cache = ResponseCache(
+    max_bytes=int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    max_entries=int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "10000")),
+)
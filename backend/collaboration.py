@@ -0,0 +1,307 @@
+"""Collaborative editing of journeys over WebSocket (``/api/journeys/{id}/live``).
+
+The editors of a journey share a ``JourneyRoom`` holding the live graph.
+Incoming operations are checked against it, applied and broadcast to the
+other editors at once; persisting them is deferred. The room queues the
+operations, merges bursts (a node dragged across the canvas keeps only its
+last position) and writes the queue as one patch, in one transaction, every
+``COLLAB_FLUSH_INTERVAL`` seconds or as soon as ``COLLAB_MAX_PENDING``
+operations are waiting.
+
+Messages are JSON objects with a ``type``. Clients send
+``{"type": "operations", "operations": [...], "ref": ...}`` with the
+operations of ``PATCH /api/journeys/{id}``. The server sends ``snapshot``
+(the journey and its stored version, on join and whenever the live copy had
+to be rebuilt from the stored journey), ``operations`` (edits of another
+editor), ``ack``/``error`` (outcome of the sender's message, echoing
+``ref``), ``saved`` (new stored version after a flush) and ``deleted``.
+
+A flush patches the version the room holds. When a REST write got in first
+the patch is refused before anything is applied; the queued operations are
+then replayed on the stored journey and written again, or dropped when they
+no longer apply to it, and every editor gets a new snapshot.
+"""
+from typing import Dict, List, Optional
+import asyncio
+import json
+import logging
+import os
+import uuid
+
+from pydantic import TypeAdapter, ValidationError
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+import crud
+from database import AsyncDB
+from models import JourneyPatch, PatchOperation, UpdateNodeOperation
+
+logger = logging.getLogger(__name__)
+
+COLLAB_FLUSH_INTERVAL = float(os.environ.get("COLLAB_FLUSH_INTERVAL", "0.25"))
+COLLAB_MAX_PENDING = int(os.environ.get("COLLAB_MAX_PENDING", "500"))
+# Writes of one flush that may be refused by concurrent REST writes before
+# its operations wait for the next flush
+COLLAB_REBASE_ATTEMPTS = 3
+
+# Close code for a journey that does not exist (4000-4999 are application codes)
+CLOSE_NOT_FOUND = 4404
+
+_operations = TypeAdapter(List[PatchOperation])
+
+def _merge(previous, operation):
+    """One operation with the effect of ``previous`` followed by ``operation`` on the same element"""
+    if operation.op == "move_node":
+        return previous.model_copy(update={"position": operation.position})
+    if operation.op == "update_edge":
+        return previous.model_copy(update=operation.model_dump(exclude={"op", "id"}, exclude_none=True))
+    data = previous.data if previous.op == "update_node" else None
+    if operation.data is not None:
+        data = {**(data or {}), **operation.data}
+    return UpdateNodeOperation(
+        op="update_node",
+        id=operation.id,
+        type=operation.type if operation.type is not None else getattr(previous, "type", None),
+        position=operation.position if operation.position is not None else previous.position,
+        data=data,
+    )
+
+def _applied(journey: dict, operations: list):
+    """Nodes and edges of ``journey`` after ``operations``, leaving ``journey`` untouched.
+
+    Elements are copied one level deep, which is all apply_operations
+    modifies. Raises ``crud.PatchError`` when an operation does not apply.
+    """
+    nodes = [dict(node) for node in journey["nodes"]]
+    edges = [dict(edge) for edge in journey["edges"]]
+    crud.apply_operations(nodes, edges, operations)
+    return nodes, edges
+
+def coalesce(operations: list) -> list:
+    """Merge moves and updates of the same node (or edge) into one operation.
+
+    The merged operation takes the slot of the first one. That is safe as
+    long as the element was not added or removed in between, because the
+    operations in between do not depend on its position or data.
+    """
+    merged = []
+    mergeable: Dict[tuple, int] = {}  # (kind, id) -> index in merged
+    for operation in operations:
+        if operation.op in ("move_node", "update_node", "update_edge"):
+            key = ("edge" if operation.op == "update_edge" else "node", operation.id)
+            i = mergeable.get(key)
+            if i is not None:
+                merged[i] = _merge(merged[i], operation)
+                continue
+            mergeable[key] = len(merged)
+        elif operation.op in ("add_node", "remove_node"):
+            mergeable.pop(("node", operation.node.id if operation.op == "add_node" else operation.id), None)
+        else:
+            mergeable.pop(("edge", operation.edge.id if operation.op == "add_edge" else operation.id), None)
+        merged.append(operation)
+    return merged
+
+class JourneyRoom:
+    """Live state of one journey shared by its connected editors"""
+
+    def __init__(self, journey_id: str, journey: dict):
+        self.journey_id = journey_id
+        self.clients: Dict[WebSocket, str] = {}
+        self.pending: list = []
+        self._flush_lock = asyncio.Lock()
+        self._flush_timer: Optional[asyncio.Task] = None
+        self._load(journey)
+
+    def _load(self, journey: dict):
+        self.journey = journey
+        self.version = journey["version"]
+
+    def snapshot(self, client_id: str) -> str:
+        return json.dumps({"type": "snapshot", "client_id": client_id, "version": self.version, "journey": self.journey})
+
+    async def broadcast(self, message: dict, exclude: Optional[WebSocket] = None):
+        text = json.dumps(message)
+        clients = [client for client in self.clients if client is not exclude]
+        # A client that went away is dropped by its own receive loop
+        await asyncio.gather(*(client.send_text(text) for client in clients), return_exceptions=True)
+
+    async def apply(self, sender: WebSocket, operations: list, raw: list, ref=None):
+        """Apply an editor's operations to the live graph, share them and queue them for storage"""
+        try:
+            nodes, edges = _applied(self.journey, operations)
+        except crud.PatchError as error:
+            await sender.send_text(json.dumps({"type": "error", "ref": ref, "detail": str(error)}))
+            return
+        self.journey["nodes"], self.journey["edges"] = nodes, edges
+        self.pending.extend(operations)
+        await sender.send_text(json.dumps({"type": "ack", "ref": ref}))
+        await self.broadcast({"type": "operations", "client_id": self.clients[sender], "operations": raw}, exclude=sender)
+
+        if len(self.pending) >= COLLAB_MAX_PENDING:
+            await self.flush()
+        elif self._flush_timer is None:
+            self._flush_timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(COLLAB_FLUSH_INTERVAL)
+        self._flush_timer = None
+        await self.flush()
+
+    async def flush(self):
+        """Store the queued operations as a single patch"""
+        async with self._flush_lock:
+            if not self.pending:
+                return
+            operations, self.pending = coalesce(self.pending), []
+            db = AsyncDB()
+            try:
+                outcome = await self._store(db, operations)
+            finally:
+                await db.close()
+
+            if outcome == "saved":
+                await self.broadcast({"type": "saved", "version": self.version, "operations": len(operations)})
+            elif outcome == "deleted":
+                self.pending = []
+                await self.broadcast({"type": "deleted"})
+            else:
+                # The live graph now starts from another stored version
+                await asyncio.gather(
+                    *(client.send_text(self.snapshot(client_id)) for client, client_id in self.clients.items()),
+                    return_exceptions=True,
+                )
+            if self.pending and self._flush_timer is None and outcome != "deleted":
+                self._flush_timer = asyncio.create_task(self._flush_later())
+
+    async def _store(self, db: AsyncDB, operations: list) -> str:
+        """Write ``operations`` as a patch of ``self.version``.
+
+        Returns "saved", "rebased" (saved after replaying them on a journey
+        changed through the REST API), "rejected" (they no longer apply to it
+        and were dropped) or "deleted".
+        """
+        outcome = "saved"
+        for _ in range(COLLAB_REBASE_ATTEMPTS):
+            try:
+                patch = JourneyPatch(operations=operations)
+                result = await db.write(crud.patch_journey, self.journey_id, patch, self.version)
+            except (crud.VersionConflict, crud.PatchError) as error:
+                journey = await db.run(crud.get_journey, self.journey_id)
+                if journey is None:
+                    return "deleted"
+                if not self._rebase(json.loads(journey.content), operations):
+                    logger.warning("Discarding live edits of journey %s: %s", self.journey_id, error)
+                    return "rejected"
+                outcome = "rebased"
+                continue
+            if result is None:
+                return "deleted"
+            self.version = self.journey["version"] = result.version
+            self.journey["updated_at"] = result.updated_at.isoformat()
+            return outcome
+        # Still refused: the rebased operations wait for the next flush
+        self.pending[:0] = operations
+        return outcome
+
+    def _rebase(self, journey: dict, operations: list) -> bool:
+        """Rebuild the live graph as the stored ``journey`` plus ``operations`` and the queued edits.
+
+        Returns False when ``operations`` do not apply to it; queued edits
+        that do not apply are dropped as well.
+        """
+        self._load(journey)
+        rebased = True
+        try:
+            self.journey["nodes"], self.journey["edges"] = _applied(self.journey, operations)
+        except crud.PatchError:
+            rebased = False
+        try:
+            self.journey["nodes"], self.journey["edges"] = _applied(self.journey, self.pending)
+        except crud.PatchError:
+            self.pending = []
+        return rebased
+
+    async def close(self):
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        await self.flush()
+
+class CollaborationHub:
+    """The open rooms, created on the first join and closed after the last leave.
+
+    Rooms hold asyncio locks and flush timers of the event loop that opened
+    them, so every connection must be served on that loop. Connections on
+    another loop (a bare Starlette TestClient runs each WebSocket session on
+    its own) are refused while rooms are open instead of deadlocking on them.
+    """
+
+    def __init__(self):
+        self.rooms: Dict[str, JourneyRoom] = {}
+        self._lock = asyncio.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if loop is self._loop:
+            return
+        if self.rooms:
+            raise RuntimeError("CollaborationHub is serving rooms on another event loop")
+        self._loop = loop
+        self._lock = asyncio.Lock()
+
+    async def _join(self, journey_id: str, websocket: WebSocket) -> Optional[JourneyRoom]:
+        async with self._lock:
+            room = self.rooms.get(journey_id)
+            if room is None:
+                db = AsyncDB()
+                try:
+                    journey = await db.run(crud.get_journey, journey_id)
+                finally:
+                    await db.close()
+                if journey is None:
+                    return None
+                room = self.rooms[journey_id] = JourneyRoom(journey_id, json.loads(journey.content))
+            room.clients[websocket] = uuid.uuid4().hex
+            return room
+
+    async def _leave(self, room: JourneyRoom, websocket: WebSocket):
+        room.clients.pop(websocket, None)
+        if room.clients:
+            return
+        await room.close()
+        async with self._lock:
+            if not room.clients and self.rooms.get(room.journey_id) is room:
+                del self.rooms[room.journey_id]
+
+    async def serve(self, websocket: WebSocket, journey_id: str):
+        """Run one editor's connection until it disconnects"""
+        self._bind_loop()
+        await websocket.accept()
+        room = await self._join(journey_id, websocket)
+        if room is None:
+            await websocket.close(code=CLOSE_NOT_FOUND, reason="Journey not found")
+            return
+        try:
+            await websocket.send_text(room.snapshot(room.clients[websocket]))
+            while True:
+                try:
+                    message = json.loads(await websocket.receive_text())
+                except ValueError:
+                    message = None
+                ref = message.get("ref") if isinstance(message, dict) else None
+                if not isinstance(message, dict) or message.get("type") != "operations":
+                    detail = "Expected a JSON object of type operations"
+                    await websocket.send_text(json.dumps({"type": "error", "ref": ref, "detail": detail}))
+                    continue
+                try:
+                    operations = _operations.validate_python(message.get("operations"))
+                except ValidationError as error:
+                    await websocket.send_text(json.dumps({"type": "error", "ref": ref, "detail": str(error)}))
+                    continue
+                await room.apply(websocket, operations, message["operations"], ref)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            await self._leave(room, websocket)
+
+hub = CollaborationHub()
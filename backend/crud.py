@@ -0,0 +1,834 @@
+"""Blocking journey persistence.
+
+Every function takes a SQLAlchemy ``Session`` as its first argument and is
+meant to be called through ``AsyncDB.run`` so it executes on the database
+thread pool, together with the JSON encoding/decoding of the journey blobs.
+"""
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+import json
+import re
+import uuid
+
+from pydantic import ValidationError
+from sqlalchemy import and_, func, or_, select, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+
+import database
+import metrics
+from cache import response_cache
+from database import Journey, JourneyNode, JourneyEdge, SearchDocument, SEARCH_COLUMNS
+from revisions import capture_fields, delete_revisions, diff_elements, field_changes, record_revision, touched_elements
+from rollups import apply_rollups, journey_rollups
+from similarity import index_fingerprint, remove_fingerprint
+from validation import changes_structure, validate_graph
+from models import (
+    JourneyCreate, JourneyUpdate, JourneySummary, NodeMatch, JourneyPatch, JourneyPatchResult,
+    JourneyImport, ImportReport, ImportLineError, SearchHit
+)
+
+# Per-call cap on reported import errors; ImportReport.failed keeps the full count
+MAX_IMPORT_ERRORS = 1000
+
+class VersionConflict(Exception):
+    """The client edited an older version of the journey than the stored one."""
+
+    def __init__(self, current_version: int):
+        super().__init__(f"Journey is at version {current_version}")
+        self.current_version = current_version
+
+class PatchError(ValueError):
+    """A patch operation does not apply to the stored graph."""
+
+def naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Timestamps are stored and served as naive UTC"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def _check_version(journey: Journey, expected_version: Optional[int]):
+    if expected_version is not None and journey.version != expected_version:
+        raise VersionConflict(journey.version)
+
+def _commit(db: Session, journey: Journey, changes: Optional[dict] = None):
+    """Commit, turning a lost optimistic-locking race into a VersionConflict.
+
+    When the flush bumps the version, the write is recorded as a revision
+    holding ``changes`` (see revisions.record_revision).
+    """
+    previous_version = journey.version
+    try:
+        db.flush()
+        if journey.version != previous_version:
+            record_revision(db, journey, changes)
+        db.commit()
+    except StaleDataError:
+        db.rollback()
+        db.refresh(journey)
+        raise VersionConflict(journey.version)
+
+# Normalized graph storage (journey_nodes / journey_edges)
+def _revision_changes(fields: dict, nodes: Optional[dict] = None, edges: Optional[dict] = None) -> dict:
+    changes = {"fields": fields}
+    if nodes is not None:
+        changes["nodes"] = nodes
+    if edges is not None:
+        changes["edges"] = edges
+    return changes
+
+def _node_row(journey_id: str, ordinal: int, node: dict) -> dict:
+    data = node.get("data") or {}
+    position = node.get("position") or {}
+    return {
+        "journey_id": journey_id,
+        "ordinal": ordinal,
+        "node_id": node["id"],
+        "type": node.get("type") or "task",
+        "stage_type": data.get("stage_type"),
+        "department": data.get("department"),
+        "label": data.get("label"),
+        "position_x": position.get("x"),
+        "position_y": position.get("y"),
+        "data": json.dumps(data),
+    }
+
+def _edge_row(journey_id: str, ordinal: int, edge: dict) -> dict:
+    return {
+        "journey_id": journey_id,
+        "ordinal": ordinal,
+        "edge_id": edge["id"],
+        "source": edge["source"],
+        "target": edge["target"],
+        "type": edge.get("type"),
+        "animated": edge.get("animated"),
+        "label": edge.get("label"),
+    }
+
+def sync_graph(db: Session, journey_id: str, nodes: Optional[List[dict]] = None, edges: Optional[List[dict]] = None):
+    """Replace the normalized rows of a journey; ``None`` leaves that table alone"""
+    if nodes is not None:
+        db.query(JourneyNode).filter(JourneyNode.journey_id == journey_id).delete(synchronize_session=False)
+        if nodes:
+            db.execute(JourneyNode.__table__.insert(), [_node_row(journey_id, i, n) for i, n in enumerate(nodes)])
+    if edges is not None:
+        db.query(JourneyEdge).filter(JourneyEdge.journey_id == journey_id).delete(synchronize_session=False)
+        if edges:
+            db.execute(JourneyEdge.__table__.insert(), [_edge_row(journey_id, i, e) for i, e in enumerate(edges)])
+
+def load_graphs(db: Session, journey_ids: List[str]) -> Dict[str, Tuple[List[dict], List[dict]]]:
+    """Assemble node and edge dicts for several journeys from the normalized tables"""
+    graphs = {journey_id: ([], []) for journey_id in journey_ids}
+    if not journey_ids:
+        return graphs
+
+    node_rows = db.execute(
+        select(JourneyNode).where(JourneyNode.journey_id.in_(journey_ids))
+        .order_by(JourneyNode.journey_id, JourneyNode.ordinal)
+    ).scalars()
+    for row in node_rows:
+        position = {}
+        if row.position_x is not None:
+            position["x"] = row.position_x
+        if row.position_y is not None:
+            position["y"] = row.position_y
+        graphs[row.journey_id][0].append(
+            {"id": row.node_id, "type": row.type, "position": position, "data": json.loads(row.data)}
+        )
+
+    edge_rows = db.execute(
+        select(JourneyEdge).where(JourneyEdge.journey_id.in_(journey_ids))
+        .order_by(JourneyEdge.journey_id, JourneyEdge.ordinal)
+    ).scalars()
+    for row in edge_rows:
+        graphs[row.journey_id][1].append({
+            "id": row.edge_id, "source": row.source, "target": row.target,
+            "type": row.type, "animated": row.animated, "label": row.label,
+        })
+
+    return graphs
+
+def normalize_journeys(db: Session, only_missing: bool = False) -> int:
+    """Copy blob-stored graphs into the normalized tables; returns the journey count.
+
+    With ``only_missing`` only journeys that have nodes or edges but no
+    normalized rows yet are copied, which makes it cheap to run at startup.
+    """
+    query = db.query(Journey.id, Journey.nodes_data, Journey.edges_data)
+    if only_missing:
+        has_nodes = select(JourneyNode.journey_id).where(JourneyNode.journey_id == Journey.id).exists()
+        has_edges = select(JourneyEdge.journey_id).where(JourneyEdge.journey_id == Journey.id).exists()
+        query = query.filter(or_(
+            and_(Journey.node_count > 0, ~has_nodes),
+            and_(Journey.edge_count > 0, ~has_edges),
+        ))
+
+    count = 0
+    for row in query.all():
+        sync_graph(db, row.id, json.loads(row.nodes_data), json.loads(row.edges_data))
+        count += 1
+    db.commit()
+    return count
+
+def find_nodes(
+    db: Session,
+    type: Optional[str] = None,
+    stage_type: Optional[str] = None,
+    department: Optional[str] = None,
+    limit: int = 100,
+    offset: int = 0,
+) -> List[NodeMatch]:
+    """Cross-journey node lookup served from the normalized table indexes"""
+    query = db.query(
+        JourneyNode.journey_id, Journey.name.label("journey_name"), JourneyNode.node_id,
+        JourneyNode.type, JourneyNode.stage_type, JourneyNode.department, JourneyNode.label,
+    ).join(Journey, Journey.id == JourneyNode.journey_id)
+    if type is not None:
+        query = query.filter(JourneyNode.type == type)
+    if stage_type is not None:
+        query = query.filter(JourneyNode.stage_type == stage_type)
+    if department is not None:
+        query = query.filter(JourneyNode.department == department)
+
+    rows = query.order_by(JourneyNode.journey_id, JourneyNode.ordinal).offset(offset).limit(limit).all()
+    return [NodeMatch.model_validate(row) for row in rows]
+
+# Full-text search index (search_documents, mirrored into the node_search FTS5 table)
+def _search_text(value) -> Optional[str]:
+    if isinstance(value, str):
+        return value.strip() or None
+    if isinstance(value, list):
+        return " ".join(item for item in value if isinstance(item, str)).strip() or None
+    return None
+
+def _search_document(journey_id: str, node: dict) -> Optional[dict]:
+    row = dict.fromkeys(SEARCH_COLUMNS)
+    body = []
+    for key, value in (node.get("data") or {}).items():
+        value = _search_text(value)
+        if value is None:
+            continue
+        if key in row and key != "body":
+            row[key] = value
+        else:
+            body.append(value)
+    row["body"] = " ".join(body) or None
+    if not any(row.values()):
+        return None
+    row.update(journey_id=journey_id, node_id=node["id"])
+    return row
+
+def index_nodes(db: Session, journey_id: str, nodes: List[dict], node_ids: Optional[set] = None):
+    """Replace the search documents of a journey, or only those of ``node_ids``"""
+    if not database.SEARCH_ENABLED:
+        return
+    query = db.query(SearchDocument).filter(SearchDocument.journey_id == journey_id)
+    if node_ids is not None:
+        query = query.filter(SearchDocument.node_id.in_(node_ids))
+        nodes = [node for node in nodes if node["id"] in node_ids]
+    query.delete(synchronize_session=False)
+    rows = [row for row in (_search_document(journey_id, node) for node in nodes) if row is not None]
+    if rows:
+        db.execute(SearchDocument.__table__.insert(), rows)
+
+def reindex_journeys(db: Session, batch_size: int = 200) -> int:
+    """Rebuild the search index from the stored graphs; returns the journey count"""
+    db.query(SearchDocument).delete(synchronize_session=False)
+    count = 0
+    for row in db.query(Journey.id, Journey.nodes_data).yield_per(batch_size):
+        index_nodes(db, row.id, json.loads(row.nodes_data))
+        count += 1
+    db.execute(text("INSERT INTO node_search(node_search) VALUES ('optimize')"))
+    db.commit()
+    return count
+
+_SEARCH_TERM = re.compile(r'"([^"]*)"|(\S+)')
+
+def _match_expression(query: str, field: Optional[str] = None) -> Optional[str]:
+    """Turn user input into an FTS5 query: words are ANDed, "quoted text" is a
+    phrase and a trailing ``*`` makes a prefix search. FTS5 operators in the
+    input are matched literally instead of being interpreted.
+    """
+    terms = []
+    for phrase, word in _SEARCH_TERM.findall(query):
+        prefix = not phrase and word.endswith("*")
+        term = (phrase or word.rstrip("*")).replace('"', "").strip()
+        if term:
+            terms.append(f'"{term}"' + ("*" if prefix else ""))
+    if not terms:
+        return None
+    expression = " ".join(terms)
+    return f"{field} : ({expression})" if field else expression
+
+def search_nodes(
+    db: Session, query: str, field: Optional[str] = None, limit: int = 20, offset: int = 0
+) -> List[SearchHit]:
+    """Nodes of every journey matching ``query``, best bm25 rank first"""
+    expression = _match_expression(query, field)
+    if expression is None:
+        return []
+    rows = db.execute(text(
+        "SELECT d.journey_id, j.name AS journey_name, d.node_id, d.label, d.department, "
+        "snippet(node_search, -1, '<mark>', '</mark>', '…', 12) AS snippet, node_search.rank AS score "
+        "FROM node_search "
+        "JOIN search_documents d ON d.id = node_search.rowid "
+        "JOIN journeys j ON j.id = d.journey_id "
+        "WHERE node_search MATCH :expression "
+        "ORDER BY node_search.rank LIMIT :limit OFFSET :offset"
+    ), {"expression": expression, "limit": limit, "offset": offset})
+    return [SearchHit.model_validate(row) for row in rows]
+
+class EncodedJourney(NamedTuple):
+    """A journey already encoded as its JourneyResponse JSON body"""
+    id: str
+    version: int
+    content: bytes
+
+def _encode_journey(journey: Journey, graph: Optional[Tuple[List[dict], List[dict]]] = None) -> EncodedJourney:
+    """Encode a stored journey as a JourneyResponse body without re-validating it.
+
+    Everything in the ``*_data`` columns was validated by the Pydantic models
+    when it was written, so the stored JSON text is spliced into the body
+    verbatim instead of being decoded, validated and encoded again. ``graph``
+    carries nodes and edges read from the normalized tables instead.
+    """
+    with metrics.phase("serialization"):
+        return _splice_journey(journey, graph)
+
+def _splice_journey(journey: Journey, graph: Optional[Tuple[List[dict], List[dict]]]) -> EncodedJourney:
+    if graph is not None:
+        nodes_json, edges_json = json.dumps(graph[0]), json.dumps(graph[1])
+    else:
+        nodes_json, edges_json = journey.nodes_data, journey.edges_data
+    # Keys in JourneyResponse field order
+    body = "".join((
+        '{"id": ', json.dumps(journey.id),
+        ', "name": ', json.dumps(journey.name),
+        ', "description": ', json.dumps(journey.description),
+        ', "nodes": ', nodes_json,
+        ', "edges": ', edges_json,
+        ', "care_gaps": ', journey.care_gaps_data or "[]",
+        ', "metrics": ', journey.metrics_data or "[]",
+        ', "clinical_outcomes": ', journey.outcomes_data or "[]",
+        ', "bpmn_version": ', json.dumps(journey.bpmn_version or "2.0"),
+        ', "fhir_version": ', json.dumps(journey.fhir_version or "R4"),
+        ', "fhir_plan_definition_id": ', json.dumps(journey.fhir_plan_definition_id),
+        ', "version": ', str(journey.version),
+        ', "created_at": ', json.dumps(journey.created_at.isoformat()),
+        ', "updated_at": ', json.dumps(journey.updated_at.isoformat()),
+        '}',
+    ))
+    return EncodedJourney(journey.id, journey.version, body.encode())
+
+def _stored_journey_response(db: Session, journey: Journey) -> EncodedJourney:
+    if database.NORMALIZED_STORAGE:
+        return _encode_journey(journey, load_graphs(db, [journey.id])[journey.id])
+    return _encode_journey(journey)
+
+def create_journey(db: Session, journey: JourneyCreate) -> EncodedJourney:
+    nodes = [node.model_dump() for node in journey.nodes]
+    edges = [edge.model_dump() for edge in journey.edges]
+    db_journey = Journey(
+        id=str(uuid.uuid4()),
+        name=journey.name,
+        description=journey.description,
+        nodes_data=json.dumps(nodes),
+        edges_data=json.dumps(edges),
+        node_count=len(journey.nodes),
+        edge_count=len(journey.edges),
+        validation_data=json.dumps(validate_graph(nodes, edges)),
+        bpmn_version=journey.bpmn_version,
+        fhir_version=journey.fhir_version,
+        fhir_plan_definition_id=journey.fhir_plan_definition_id,
+        care_gaps_data=json.dumps([gap.model_dump() for gap in (journey.care_gaps or [])]),
+        metrics_data=json.dumps([metric.model_dump() for metric in (journey.metrics or [])]),
+        outcomes_data=json.dumps([outcome.model_dump() for outcome in (journey.clinical_outcomes or [])])
+    )
+
+    db.add(db_journey)
+    db.flush()
+    if database.NORMALIZED_STORAGE:
+        sync_graph(db, db_journey.id, nodes, edges)
+    index_nodes(db, db_journey.id, nodes)
+    index_fingerprint(db, db_journey.id, nodes, edges)
+    apply_rollups(db, {}, journey_rollups(db_journey))
+    record_revision(db, db_journey)
+    db.commit()
+    db.refresh(db_journey)
+
+    return _stored_journey_response(db, db_journey)
+
+def list_journeys(
+    db: Session,
+    fields: str = "full",
+    limit: Optional[int] = None,
+    cursor: Optional[Tuple[datetime, str]] = None,
+    name: Optional[str] = None,
+    updated_since: Optional[datetime] = None,
+) -> Tuple[list, Optional[Tuple[datetime, str]]]:
+    """Return one page of journeys, newest first, and the key of its last row.
+
+    The key is only returned when another page follows. ``fields="summary"``
+    selects the summary columns only, so the ``*_data`` blobs are never read.
+    """
+    if fields == "summary":
+        query = db.query(
+            Journey.id, Journey.name, Journey.description,
+            Journey.node_count, Journey.edge_count, Journey.version,
+            Journey.created_at, Journey.updated_at,
+        )
+    else:
+        query = db.query(Journey)
+
+    if name:
+        pattern = name.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        query = query.filter(Journey.name.ilike(f"%{pattern}%", escape="\\"))
+    if updated_since is not None:
+        query = query.filter(Journey.updated_at >= updated_since)
+    if cursor is not None:
+        cursor_updated_at, cursor_id = cursor
+        query = query.filter(or_(
+            Journey.updated_at < cursor_updated_at,
+            and_(Journey.updated_at == cursor_updated_at, Journey.id < cursor_id),
+        ))
+
+    query = query.order_by(Journey.updated_at.desc(), Journey.id.desc())
+    if limit is not None:
+        query = query.limit(limit + 1)
+    journeys = query.all()
+
+    next_key = None
+    if limit is not None and len(journeys) > limit:
+        journeys = journeys[:limit]
+        next_key = (journeys[-1].updated_at, journeys[-1].id)
+
+    if fields == "summary":
+        return [JourneySummary.model_validate(j) for j in journeys], next_key
+    if database.NORMALIZED_STORAGE:
+        graphs = load_graphs(db, [j.id for j in journeys])
+        return [_encode_journey(j, graphs[j.id]) for j in journeys], next_key
+    return [_encode_journey(j) for j in journeys], next_key
+
+def get_journey_version(db: Session, journey_id: str) -> Optional[int]:
+    """Current version of a journey, read without touching the blob columns"""
+    return db.query(Journey.version).filter(Journey.id == journey_id).scalar()
+
+def load_journey_graph(db: Session, journey_id: str) -> Optional[Tuple[int, List[dict], List[dict]]]:
+    """Version, nodes and edges of a journey as plain dicts, for graph algorithms"""
+    if database.NORMALIZED_STORAGE:
+        version = get_journey_version(db, journey_id)
+        if version is None:
+            return None
+        nodes, edges = load_graphs(db, [journey_id])[journey_id]
+        return version, nodes, edges
+
+    row = db.query(Journey.version, Journey.nodes_data, Journey.edges_data).filter(Journey.id == journey_id).first()
+    if row is None:
+        return None
+    with metrics.phase("decode"):
+        return row.version, json.loads(row.nodes_data), json.loads(row.edges_data)
+
+def get_journey_validation(db: Session, journey_id: str) -> Optional[bytes]:
+    """JourneyValidation body built around the stored report.
+
+    Journeys saved before reports were stored are validated on the fly.
+    """
+    row = db.query(Journey.version, Journey.validation_data).filter(Journey.id == journey_id).first()
+    if row is None:
+        return None
+    report = row.validation_data
+    if report is None:
+        graph = load_journey_graph(db, journey_id)
+        if graph is None:
+            return None
+        report = json.dumps(validate_graph(graph[1], graph[2]))
+    body = "".join(('{"journey_id": ', json.dumps(journey_id), ', "version": ', str(row.version), ', ', report[1:]))
+    return body.encode()
+
+def get_journey(db: Session, journey_id: str) -> Optional[EncodedJourney]:
+    journey = db.query(Journey).filter(Journey.id == journey_id).first()
+    if not journey:
+        return None
+    return _stored_journey_response(db, journey)
+
+def update_journey(
+    db: Session, journey_id: str, journey_update: JourneyUpdate, expected_version: Optional[int] = None
+) -> Optional[EncodedJourney]:
+    db_journey = db.query(Journey).filter(Journey.id == journey_id).first()
+    if not db_journey:
+        return None
+    _check_version(db_journey, expected_version)
+    rollups_changed = any(
+        value is not None
+        for value in (journey_update.care_gaps, journey_update.metrics, journey_update.clinical_outcomes)
+    )
+    rollups_before = journey_rollups(db_journey) if rollups_changed else None
+    fields_before = capture_fields(db_journey)
+    old_nodes = json.loads(db_journey.nodes_data) if journey_update.nodes is not None else None
+    old_edges = json.loads(db_journey.edges_data) if journey_update.edges is not None else None
+
+    if journey_update.name is not None:
+        db_journey.name = journey_update.name
+    if journey_update.description is not None:
+        db_journey.description = journey_update.description
+    nodes = edges = None
+    if journey_update.nodes is not None:
+        nodes = [node.model_dump() for node in journey_update.nodes]
+        db_journey.nodes_data = json.dumps(nodes)
+        db_journey.node_count = len(nodes)
+    if journey_update.edges is not None:
+        edges = [edge.model_dump() for edge in journey_update.edges]
+        db_journey.edges_data = json.dumps(edges)
+        db_journey.edge_count = len(edges)
+    if journey_update.care_gaps is not None:
+        db_journey.care_gaps_data = json.dumps([gap.model_dump() for gap in journey_update.care_gaps])
+    if journey_update.metrics is not None:
+        db_journey.metrics_data = json.dumps([metric.model_dump() for metric in journey_update.metrics])
+    if journey_update.clinical_outcomes is not None:
+        db_journey.outcomes_data = json.dumps([outcome.model_dump() for outcome in journey_update.clinical_outcomes])
+    if journey_update.fhir_plan_definition_id is not None:
+        db_journey.fhir_plan_definition_id = journey_update.fhir_plan_definition_id
+    if nodes is not None or edges is not None:
+        db_journey.validation_data = json.dumps(validate_graph(
+            nodes if nodes is not None else json.loads(db_journey.nodes_data),
+            edges if edges is not None else json.loads(db_journey.edges_data),
+        ))
+
+    if database.NORMALIZED_STORAGE:
+        sync_graph(db, journey_id, nodes, edges)
+    if nodes is not None:
+        index_nodes(db, journey_id, nodes)
+    if nodes is not None or edges is not None:
+        index_fingerprint(
+            db, journey_id,
+            nodes if nodes is not None else json.loads(db_journey.nodes_data),
+            edges if edges is not None else json.loads(db_journey.edges_data),
+        )
+    if rollups_changed:
+        apply_rollups(db, rollups_before, journey_rollups(db_journey))
+    _commit(db, db_journey, _revision_changes(
+        field_changes(fields_before, db_journey),
+        diff_elements(old_nodes, nodes) if nodes is not None else None,
+        diff_elements(old_edges, edges) if edges is not None else None,
+    ))
+    response_cache.invalidate(journey_id)
+    db.refresh(db_journey)
+
+    return _stored_journey_response(db, db_journey)
+
+def apply_operations(nodes: Optional[List[dict]], edges: Optional[List[dict]], operations) -> Tuple[set, set]:
+    """Apply patch operations in place; returns the ids of touched nodes and edges.
+
+    Only the addressed elements are validated and modified, everything else
+    stays the plain dicts decoded from storage.
+    """
+    node_index = {node["id"]: i for i, node in enumerate(nodes)} if nodes is not None else {}
+    edge_index = {edge["id"]: i for i, edge in enumerate(edges)} if edges is not None else {}
+    removed_nodes, removed_edges = set(), set()
+    touched_nodes, touched_edges = set(), set()
+
+    def node(node_id):
+        i = node_index.get(node_id)
+        if i is None or node_id in removed_nodes:
+            raise PatchError(f"Unknown node {node_id!r}")
+        return nodes[i]
+
+    def edge(edge_id):
+        i = edge_index.get(edge_id)
+        if i is None or edge_id in removed_edges:
+            raise PatchError(f"Unknown edge {edge_id!r}")
+        return edges[i]
+
+    for operation in operations:
+        if operation.op == "add_node":
+            new_node = operation.node.model_dump()
+            if new_node["id"] in removed_nodes:
+                # Re-added in the same patch: takes the place of the removed node
+                removed_nodes.discard(new_node["id"])
+                nodes[node_index[new_node["id"]]] = new_node
+            elif new_node["id"] in node_index:
+                raise PatchError(f"Node {new_node['id']!r} already exists")
+            else:
+                node_index[new_node["id"]] = len(nodes)
+                nodes.append(new_node)
+            touched_nodes.add(new_node["id"])
+        elif operation.op in ("update_node", "move_node"):
+            target = node(operation.id)
+            if operation.position is not None:
+                target["position"] = operation.position
+            if operation.op == "update_node":
+                if operation.type is not None:
+                    target["type"] = operation.type
+                if operation.data is not None:
+                    target["data"] = {**target.get("data", {}), **operation.data}
+            touched_nodes.add(operation.id)
+        elif operation.op == "remove_node":
+            node(operation.id)
+            removed_nodes.add(operation.id)
+            touched_nodes.add(operation.id)
+            for other in edges:
+                if other["id"] not in removed_edges and operation.id in (other["source"], other["target"]):
+                    removed_edges.add(other["id"])
+                    touched_edges.add(other["id"])
+        elif operation.op == "add_edge":
+            new_edge = operation.edge.model_dump()
+            if new_edge["id"] in removed_edges:
+                removed_edges.discard(new_edge["id"])
+                edges[edge_index[new_edge["id"]]] = new_edge
+            elif new_edge["id"] in edge_index:
+                raise PatchError(f"Edge {new_edge['id']!r} already exists")
+            else:
+                edge_index[new_edge["id"]] = len(edges)
+                edges.append(new_edge)
+            touched_edges.add(new_edge["id"])
+        elif operation.op == "update_edge":
+            target = edge(operation.id)
+            target.update(operation.model_dump(exclude={"op", "id"}, exclude_none=True))
+            touched_edges.add(operation.id)
+        elif operation.op == "remove_edge":
+            edge(operation.id)
+            removed_edges.add(operation.id)
+            touched_edges.add(operation.id)
+
+    if removed_nodes:
+        nodes[:] = [n for n in nodes if n["id"] not in removed_nodes]
+    if removed_edges:
+        edges[:] = [e for e in edges if e["id"] not in removed_edges]
+    return touched_nodes, touched_edges
+
+def _patch_graph_rows(db: Session, journey_id: str, table, id_column: str, elements: List[dict], touched: set, to_row):
+    """Rewrite only the touched rows of one normalized table.
+
+    Updated elements keep their ordinal, new ones are appended after the last.
+    """
+    id_attr = getattr(table, id_column)
+    in_journey = table.journey_id == journey_id
+    existing = {row_id for (row_id,) in db.query(id_attr).filter(in_journey, id_attr.in_(touched))}
+    current = {element["id"]: element for element in elements if element["id"] in touched}
+
+    removed = existing - current.keys()
+    if removed:
+        db.query(table).filter(in_journey, id_attr.in_(removed)).delete(synchronize_session=False)
+
+    added = []
+    for element_id, element in current.items():
+        if element_id in existing:
+            row = to_row(journey_id, 0, element)
+            del row["journey_id"], row["ordinal"]
+            db.query(table).filter(in_journey, id_attr == element_id).update(row, synchronize_session=False)
+        else:
+            added.append(element)
+    if added:
+        next_ordinal = db.query(func.coalesce(func.max(table.ordinal), -1)).filter(in_journey).scalar() + 1
+        db.execute(table.__table__.insert(), [
+            to_row(journey_id, next_ordinal + i, element) for i, element in enumerate(added)
+        ])
+
+def patch_journey(
+    db: Session, journey_id: str, patch: JourneyPatch, expected_version: Optional[int] = None
+) -> Optional[JourneyPatchResult]:
+    """Apply node/edge operations to the stored graph without revalidating it"""
+    db_journey = db.query(Journey).filter(Journey.id == journey_id).first()
+    if not db_journey:
+        return None
+    _check_version(db_journey, expected_version if expected_version is not None else patch.base_version)
+
+    ops = {operation.op for operation in patch.operations}
+    # Moves and data edits keep the stored validation report; only structural
+    # edits decode both lists and validate the graph again
+    structural = any(changes_structure(operation) for operation in patch.operations)
+    needs_nodes = structural or bool(ops & {"update_node", "move_node"})
+    needs_edges = structural or "update_edge" in ops
+    nodes = json.loads(db_journey.nodes_data) if needs_nodes else None
+    edges = json.loads(db_journey.edges_data) if needs_edges else None
+    touched_nodes, touched_edges = apply_operations(nodes, edges, patch.operations)
+    fields_before = capture_fields(db_journey)
+
+    if patch.name is not None:
+        db_journey.name = patch.name
+    if patch.description is not None:
+        db_journey.description = patch.description
+    if nodes is not None:
+        db_journey.nodes_data = json.dumps(nodes)
+        db_journey.node_count = len(nodes)
+    if edges is not None:
+        db_journey.edges_data = json.dumps(edges)
+        db_journey.edge_count = len(edges)
+    if structural:
+        db_journey.validation_data = json.dumps(validate_graph(nodes, edges))
+
+    if database.NORMALIZED_STORAGE:
+        if touched_nodes:
+            _patch_graph_rows(db, journey_id, JourneyNode, "node_id", nodes, touched_nodes, _node_row)
+        if touched_edges:
+            _patch_graph_rows(db, journey_id, JourneyEdge, "edge_id", edges, touched_edges, _edge_row)
+    if touched_nodes:
+        index_nodes(db, journey_id, nodes, touched_nodes)
+    # Moves and edge labels leave every shingle as it was
+    if structural or "update_node" in ops:
+        index_fingerprint(
+            db, journey_id,
+            nodes if nodes is not None else json.loads(db_journey.nodes_data),
+            edges if edges is not None else json.loads(db_journey.edges_data),
+        )
+    _commit(db, db_journey, _revision_changes(
+        field_changes(fields_before, db_journey),
+        touched_elements(nodes, touched_nodes),
+        touched_elements(edges, touched_edges),
+    ))
+    response_cache.invalidate(journey_id)
+
+    return JourneyPatchResult(id=db_journey.id, version=db_journey.version, updated_at=naive_utc(db_journey.updated_at))
+
+def delete_journey(db: Session, journey_id: str) -> bool:
+    db_journey = db.query(Journey).filter(Journey.id == journey_id).first()
+    if not db_journey:
+        return False
+
+    # SQLite does not enforce the ON DELETE CASCADE unless foreign keys are enabled
+    sync_graph(db, journey_id, [], [])
+    index_nodes(db, journey_id, [])
+    remove_fingerprint(db, journey_id)
+    apply_rollups(db, journey_rollups(db_journey), {})
+    delete_revisions(db, journey_id)
+    db.delete(db_journey)
+    db.commit()
+    response_cache.invalidate(journey_id)
+    return True
+
+def export_journeys(db: Session, batch_size: int = 200, updated_since: Optional[datetime] = None) -> Iterator[bytes]:
+    """Yield every journey as one NDJSON line, ``batch_size`` rows at a time.
+
+    Rows are fetched incrementally (``yield_per``) and the session's identity
+    map only holds them weakly, so memory stays bounded by the batch however
+    many journeys are exported.
+    """
+    statement = select(Journey).order_by(Journey.id).execution_options(yield_per=batch_size)
+    if updated_since is not None:
+        statement = statement.where(Journey.updated_at >= updated_since)
+
+    for batch in db.execute(statement).scalars().partitions():
+        graphs = load_graphs(db, [j.id for j in batch]) if database.NORMALIZED_STORAGE else {}
+        yield b"".join(_encode_journey(j, graphs.get(j.id)).content + b"\n" for j in batch)
+
+def _validation_message(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in detail['loc']) or 'line'}: {detail['msg']}"
+        for detail in error.errors()
+    )
+
+def import_journeys(db: Session, lines: List[Tuple[int, bytes]], upsert: bool = True) -> ImportReport:
+    """Validate and store one batch of NDJSON lines in a single transaction.
+
+    Each journey is written in its own savepoint, so a bad line is reported
+    with its line number instead of aborting the rest of the batch.
+    """
+    report = ImportReport()
+
+    def fail(line_number: int, message: str):
+        report.failed += 1
+        if len(report.errors) < MAX_IMPORT_ERRORS:
+            report.errors.append(ImportLineError(line=line_number, error=message))
+
+    records = []
+    for line_number, raw in lines:
+        try:
+            records.append((line_number, JourneyImport.model_validate_json(raw)))
+        except ValidationError as error:
+            fail(line_number, _validation_message(error))
+
+    ids = [record.id for _, record in records if record.id]
+    existing = {j.id: j for j in db.query(Journey).filter(Journey.id.in_(ids))} if ids else {}
+    updated_ids = set()
+
+    for line_number, record in records:
+        db_journey = existing.get(record.id) if record.id else None
+        if db_journey is not None and not upsert:
+            fail(line_number, f"Journey {record.id!r} already exists")
+            continue
+
+        nodes = [node.model_dump() for node in record.nodes]
+        edges = [edge.model_dump() for edge in record.edges]
+        values = dict(
+            name=record.name,
+            description=record.description,
+            nodes_data=json.dumps(nodes),
+            edges_data=json.dumps(edges),
+            node_count=len(nodes),
+            edge_count=len(edges),
+            validation_data=json.dumps(validate_graph(nodes, edges)),
+            bpmn_version=record.bpmn_version,
+            fhir_version=record.fhir_version,
+            fhir_plan_definition_id=record.fhir_plan_definition_id,
+            care_gaps_data=json.dumps([gap.model_dump() for gap in (record.care_gaps or [])]),
+            metrics_data=json.dumps([metric.model_dump() for metric in (record.metrics or [])]),
+            outcomes_data=json.dumps([outcome.model_dump() for outcome in (record.clinical_outcomes or [])]),
+        )
+        # Offsets in the input are converted, every stored timestamp is naive UTC
+        if record.created_at is not None:
+            values["created_at"] = naive_utc(record.created_at)
+        if record.updated_at is not None:
+            values["updated_at"] = naive_utc(record.updated_at)
+
+        created = db_journey is None
+        unchanged = False
+        try:
+            with db.begin_nested():
+                rollups_before = journey_rollups(db_journey)
+                if created:
+                    db_journey = Journey(id=record.id or str(uuid.uuid4()), **values)
+                    db.add(db_journey)
+                    changes = None
+                else:
+                    fields_before = capture_fields(db_journey)
+                    old_nodes, old_edges = json.loads(db_journey.nodes_data), json.loads(db_journey.edges_data)
+                    previous_version = db_journey.version
+                    for key, value in values.items():
+                        setattr(db_journey, key, value)
+                db.flush()
+                # Identical to the stored row: no UPDATE was issued, nothing to reindex
+                unchanged = not created and db_journey.version == previous_version
+                if not unchanged:
+                    if not created:
+                        changes = _revision_changes(
+                            field_changes(fields_before, db_journey),
+                            diff_elements(old_nodes, nodes), diff_elements(old_edges, edges),
+                        )
+                    record_revision(db, db_journey, changes)
+                    if database.NORMALIZED_STORAGE:
+                        sync_graph(db, db_journey.id, nodes, edges)
+                    index_nodes(db, db_journey.id, nodes)
+                    index_fingerprint(db, db_journey.id, nodes, edges)
+                    apply_rollups(db, rollups_before, journey_rollups(db_journey))
+        except SQLAlchemyError as error:
+            fail(line_number, str(getattr(error, "orig", None) or error))
+            continue
+
+        if created:
+            existing[db_journey.id] = db_journey
+            report.created += 1
+        elif unchanged:
+            report.unchanged += 1
+        else:
+            updated_ids.add(db_journey.id)
+            report.updated += 1
+
+    db.commit()
+    for journey_id in updated_ids:
+        response_cache.invalidate(journey_id)
+    db.expunge_all()
+    report.errors.sort(key=lambda error: error.line)
+    return report
+
+def encode_json(result) -> bytes:
+    """JSON-encode a model, an EncodedJourney or a list of them (on the DB thread, not the loop)"""
+    with metrics.phase("serialization"):
+        return _encode_json(result)
+
+def _encode_json(result) -> bytes:
+    if isinstance(result, list):
+        return b"[" + b",".join(_encode_json(item) for item in result) + b"]"
+    if isinstance(result, EncodedJourney):
+        return result.content
+    return result.model_dump_json().encode()
@@ -1,37 +1,709 @@
-from sqlalchemy import create_engine, Column, String, Text, DateTime
+from sqlalchemy import (
+    create_engine, event, Column, String, Text, Date, DateTime, Integer, BigInteger, Float, Boolean, ForeignKey,
+    Index, LargeBinary, inspect, select, bindparam
+)
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.types import TypeDecorator
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timezone
+import asyncio
+import contextvars
+import json
+import logging
 import os
+import queue
+import threading
+import zlib
 from pathlib import Path
+from typing import List
+import time
+
+import metrics
+from cache import response_cache
 
 ROOT_DIR = Path(__file__).parent
-DATABASE_URL = f"sqlite:///{ROOT_DIR}/patient_journeys.db"
+# A SQLite or PostgreSQL SQLAlchemy URL; full-text search, compression and the
+# CLI maintenance commands rely on SQLite, everything else runs on both
+DATABASE_URL = os.environ.get("DATABASE_URL", f"sqlite:///{ROOT_DIR}/patient_journeys.db")
+IS_SQLITE = make_url(DATABASE_URL).get_backend_name() == "sqlite"
+
+# Applied to every SQLite connection. WAL lets readers run while the writer
+# commits; with it synchronous=NORMAL only syncs at checkpoints. A negative
+# cache_size is in KiB.
+SQLITE_PRAGMAS = {
+    "journal_mode": os.environ.get("SQLITE_JOURNAL_MODE", "wal"),
+    "synchronous": os.environ.get("SQLITE_SYNCHRONOUS", "normal"),
+    "busy_timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "cache_size": int(os.environ.get("SQLITE_CACHE_SIZE", str(-64 * 1024))),
+    "mmap_size": int(os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+}
+
+# "blob" keeps each graph only in the journeys.*_data columns; "normalized" also
+# maintains the indexed journey_nodes/journey_edges tables and reads graphs from them
+JOURNEY_STORAGE = os.environ.get("JOURNEY_STORAGE", "blob")
+NORMALIZED_STORAGE = JOURNEY_STORAGE == "normalized"
+
+DB_THREADS = int(os.environ.get("DB_THREADS", "8"))
+
+# "zlib" stores the nodes/edges JSON columns compressed; "none" writes plain text.
+# Reads detect the format per value, so the setting can be changed at any time
+# and ``python database.py recompress`` converts the rows already written.
+JOURNEY_COMPRESSION = os.environ.get("JOURNEY_COMPRESSION", "none")
+if JOURNEY_COMPRESSION == "zlib" and not IS_SQLITE:
+    # Compressed values are BLOBs stored in a TEXT column, which only SQLite accepts
+    raise RuntimeError("JOURNEY_COMPRESSION=zlib requires a SQLite DATABASE_URL")
+COMPRESSION_LEVEL = int(os.environ.get("JOURNEY_COMPRESSION_LEVEL", "6"))
+# Below this many bytes a value fits in its b-tree page anyway
+COMPRESSION_MIN_BYTES = 256
+
+# Most write transactions the writer thread commits at once
+DB_WRITE_BATCH = int(os.environ.get("DB_WRITE_BATCH", "64"))
+
+engine = create_engine(
+    DATABASE_URL,
+    connect_args={"check_same_thread": False} if IS_SQLITE else {},
+    # One pooled connection per DB thread, plus the writer's, so workers never
+    # wait on each other for a connection
+    pool_size=DB_THREADS + 1,
+)
+
+if IS_SQLITE:
+    @event.listens_for(engine, "connect")
+    def _configure_sqlite(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {pragma} = {value}")
+        cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def _begin_sqlite(conn):
+        """Emit BEGIN ourselves: pysqlite defers it to the first write, so
+        SAVEPOINTs and reads would otherwise run outside the transaction"""
+        if conn.get_execution_options().get("isolation_level") == "AUTOCOMMIT":
+            return
+        conn.connection.dbapi_connection.isolation_level = None
+        conn.exec_driver_sql(f"BEGIN {conn.get_execution_options().get('sqlite_begin', 'DEFERRED')}")
+
+@event.listens_for(engine, "before_cursor_execute")
+def _start_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_started"] = time.perf_counter()
+
+@event.listens_for(engine, "after_cursor_execute")
+def _end_query(conn, cursor, statement, parameters, context, executemany):
+    metrics.DB_QUERIES.inc()
+    metrics.add_phase("db", time.perf_counter() - conn.info.pop("query_started"))
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# All blocking session work runs here, never on the event loop
+db_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix="db")
+
+# Compressed values are BLOBs starting with this marker, which JSON text never
+# does, followed by the id of the preset dictionary and a raw deflate stream
+_COMPRESSED_MAGIC = b"\x00PJZ"
+
+# Preset deflate dictionaries, by id. Keys and values that every journey
+# repeats (the NodeData/EdgeData layout and the stage vocabulary of the
+# templates); deflate favours the end of the dictionary, so the most frequent
+# strings come last. Never change a published dictionary: add a new id.
+COMPRESSION_DICTIONARIES = {
+    1: "".join((
+        '"gateway_exclusive", "gateway_parallel", "gateway_inclusive", "intermediate_event", "subprocess", ',
+        '"start_event", "end_event", "registration", "consultation", "diagnosis", "treatment", "followup", "discharge", ',
+        'Presencial/Online", "Presencial/Telef\\u00f3nico", "Telef\\u00f3nico", "Online", "Presencial", ',
+        '"Ansioso, esperanzado", "Nervioso, expectante", "Ansioso, preocupado", "Aliviado", "Tranquilo", ',
+        'Tiempos de espera prolongados", "Tiempo de espera", "Falta de comunicaci\\u00f3n", "Incertidumbre", ',
+        '"Admisiones", "Medicina General", "Laboratorio/Radiolog\\u00eda", "Enfermer\\u00eda", "Urgencias", ',
+        '"Personal administrativo", "M\\u00e9dico general", "Especialistas", "Enfermera", "M\\u00e9dico", ',
+        '"15 minutos", "30 minutos", "1-2 d\\u00edas", "2-6 horas", "1 hora", "Continuo", ',
+        '{"id": "e", "source": "", "target": "", "type": "smoothstep", "animated": true, "label": null}, ',
+        '{"id": "e", "source": "", "target": "", "type": "default", "animated": false, "label": null}, ',
+        '"bpmn_element": "task", "fhir_resource": "", "activity_definition": "", "clinical_guideline": "", ',
+        '"resources": "", "opportunities": "", "pain_points": "", "patient_emotion": "", "touchpoint": "", ',
+        '"responsible": "", "department": "", "duration": " minutos", "description": "", "stage_type": "", ',
+        '{"id": "", "type": "task", "position": {"x": .0, "y": .0}, "data": {"label": "',
+    )).encode(),
+}
+_DEFAULT_DICTIONARY = max(COMPRESSION_DICTIONARIES)
+
+def compress_json(text: str, dictionary_id: int = _DEFAULT_DICTIONARY):
+    """Compressed form of a JSON text, or the text itself when that is not smaller"""
+    raw = text.encode()
+    if len(raw) < COMPRESSION_MIN_BYTES:
+        return text
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -15, zdict=COMPRESSION_DICTIONARIES[dictionary_id])
+    packed = _COMPRESSED_MAGIC + bytes((dictionary_id,)) + compressor.compress(raw) + compressor.flush()
+    return packed if len(packed) < len(raw) else text
+
+def decompress_json(value):
+    """Inverse of ``compress_json``; plain text is returned unchanged"""
+    if not isinstance(value, bytes):
+        return value
+    if not value.startswith(_COMPRESSED_MAGIC):
+        return value.decode()
+    dictionary = COMPRESSION_DICTIONARIES[value[len(_COMPRESSED_MAGIC)]]
+    decompressor = zlib.decompressobj(-15, zdict=dictionary)
+    return (decompressor.decompress(value[len(_COMPRESSED_MAGIC) + 1:]) + decompressor.flush()).decode()
+
+class CompressedJSON(TypeDecorator):
+    """JSON text column, stored compressed when JOURNEY_COMPRESSION=zlib.
+
+    SQLite keeps BLOB and TEXT values in the same column, so compressed and
+    plain rows coexist and each value is decoded according to what it is.
+    """
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or JOURNEY_COMPRESSION != "zlib" or dialect.name != "sqlite":
+            return value
+        return compress_json(value)
+
+    def process_result_value(self, value, dialect):
+        with metrics.phase("decode"):
+            return decompress_json(value)
+
 class Journey(Base):
     __tablename__ = "journeys"
     
     id = Column(String, primary_key=True, index=True)
     name = Column(String, nullable=False)
     description = Column(Text, nullable=True)
-    nodes_data = Column(Text, nullable=False)  # JSON string
-    edges_data = Column(Text, nullable=False)  # JSON string
+    nodes_data = Column(CompressedJSON, nullable=False)  # JSON string
+    edges_data = Column(CompressedJSON, nullable=False)  # JSON string
     care_gaps_data = Column(Text, nullable=True, default="[]")  # JSON string
     metrics_data = Column(Text, nullable=True, default="[]")  # JSON string
     outcomes_data = Column(Text, nullable=True, default="[]")  # JSON string
+    node_count = Column(Integer, nullable=False, default=0)  # len(nodes_data), kept for listings
+    edge_count = Column(Integer, nullable=False, default=0)  # len(edges_data), kept for listings
+    bpmn_version = Column(String, nullable=False, default="2.0")
+    fhir_version = Column(String, nullable=False, default="R4")
+    fhir_plan_definition_id = Column(String, nullable=True)
+    validation_data = Column(Text, nullable=True)  # JSON validation report of the graph, see validation.py
+    version = Column(Integer, nullable=False, default=1)  # bumped on every UPDATE, served as the ETag
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
 
+    __table_args__ = (
+        # Keyset pagination order for GET /api/journeys
+        Index("ix_journeys_updated_at_id", "updated_at", "id"),
+    )
+    # UPDATEs are issued as "... WHERE id = ? AND version = ?" and raise StaleDataError on a lost race
+    __mapper_args__ = {"version_id_col": version}
+
+class JourneyNode(Base):
+    """One node of a journey graph, maintained when NORMALIZED_STORAGE is on."""
+    __tablename__ = "journey_nodes"
+
+    journey_id = Column(String, ForeignKey("journeys.id", ondelete="CASCADE"), primary_key=True)
+    ordinal = Column(Integer, primary_key=True)  # position in JourneyResponse.nodes
+    node_id = Column(String, nullable=False)
+    type = Column(String, nullable=False, index=True)
+    stage_type = Column(String, nullable=True, index=True)
+    department = Column(String, nullable=True, index=True)
+    label = Column(String, nullable=True)
+    position_x = Column(Float, nullable=True)
+    position_y = Column(Float, nullable=True)
+    data = Column(Text, nullable=False)  # JSON string of NodeData.data
+
+    __table_args__ = (
+        Index("ix_journey_nodes_journey_node", "journey_id", "node_id"),
+    )
+
+class JourneyEdge(Base):
+    """One edge of a journey graph, maintained when NORMALIZED_STORAGE is on."""
+    __tablename__ = "journey_edges"
+
+    journey_id = Column(String, ForeignKey("journeys.id", ondelete="CASCADE"), primary_key=True)
+    ordinal = Column(Integer, primary_key=True)  # position in JourneyResponse.edges
+    edge_id = Column(String, nullable=False)
+    source = Column(String, nullable=False)
+    target = Column(String, nullable=False)
+    type = Column(String, nullable=True)
+    animated = Column(Boolean, nullable=True)
+    label = Column(String, nullable=True)
+
+    __table_args__ = (
+        Index("ix_journey_edges_journey_source", "journey_id", "source"),
+        Index("ix_journey_edges_journey_target", "journey_id", "target"),
+    )
+
+class JourneyRevision(Base):
+    """One saved version of a journey: a full keyframe or a delta against the previous revision."""
+    __tablename__ = "journey_revisions"
+
+    journey_id = Column(String, ForeignKey("journeys.id", ondelete="CASCADE"), primary_key=True)
+    revision = Column(Integer, primary_key=True)  # Journey.version after the write
+    base_revision = Column(Integer, nullable=False)  # keyframe this revision is rebuilt from
+    keyframe = Column(Boolean, nullable=False, default=False)
+    data = Column(CompressedJSON, nullable=False)  # JSON snapshot (keyframe) or changes (delta)
+    changed_fields = Column(String, nullable=False, default="")  # comma separated, for listings
+    node_changes = Column(Integer, nullable=False, default=0)
+    edge_changes = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+class SearchDocument(Base):
+    """Searchable text of one node; the node_search FTS5 index is kept in sync by triggers."""
+    __tablename__ = "search_documents"
+
+    id = Column(Integer, primary_key=True)  # rowid in node_search
+    journey_id = Column(String, ForeignKey("journeys.id", ondelete="CASCADE"), nullable=False)
+    node_id = Column(String, nullable=False)
+    label = Column(Text, nullable=True)
+    department = Column(Text, nullable=True)
+    responsible = Column(Text, nullable=True)
+    pain_points = Column(Text, nullable=True)
+    opportunities = Column(Text, nullable=True)
+    resources = Column(Text, nullable=True)
+    body = Column(Text, nullable=True)  # every other text value of NodeData.data
+
+    __table_args__ = (
+        Index("ix_search_documents_journey_node", "journey_id", "node_id"),
+    )
+
+class AnalyticsRollup(Base):
+    """Additive totals of care gaps, metrics and outcomes per journey creation day.
+
+    Writes add the new contributions of a journey and subtract the old ones in
+    the same transaction, so portfolio summaries never read the journey blobs.
+    ``dimension`` is "journey", "care_gap" (key gap_type, subkey severity),
+    "metric" (metric_name, status) or "outcome" (outcome_type, trend).
+    """
+    __tablename__ = "analytics_rollups"
+
+    dimension = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    subkey = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)  # UTC day of Journey.created_at
+    count = Column(Integer, nullable=False, default=0)
+    value_sum = Column(Float, nullable=False, default=0.0)  # Metric.value / ClinicalOutcome.current_value
+    target_sum = Column(Float, nullable=False, default=0.0)
+    target_count = Column(Integer, nullable=False, default=0)  # Metric.target_value is optional
+
+    __table_args__ = (
+        Index("ix_analytics_rollups_day", "day"),
+    )
+
+class JourneyTemplate(Base):
+    """A user-supplied journey template, loaded into the template registry at startup."""
+    __tablename__ = "journey_templates"
+
+    id = Column(String, primary_key=True)  # replaces a built-in or file template with the same id
+    name = Column(String, nullable=False)
+    description = Column(Text, nullable=True)
+    nodes_data = Column(Text, nullable=False)  # JSON string, NodeData list
+    edges_data = Column(Text, nullable=False)  # JSON string, EdgeData list
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+class JourneyFingerprint(Base):
+    """MinHash signature of the stages and node text of a journey, see similarity.py."""
+    __tablename__ = "journey_fingerprints"
+
+    journey_id = Column(String, ForeignKey("journeys.id", ondelete="CASCADE"), primary_key=True)
+    signature = Column(LargeBinary, nullable=False)  # SIGNATURE_SIZE little-endian uint32 minima
+
+class SimilarityBucket(Base):
+    """One LSH band of a fingerprint; journeys sharing a (band, bucket) are similarity candidates."""
+    __tablename__ = "similarity_buckets"
+
+    band = Column(Integer, primary_key=True)
+    bucket = Column(BigInteger, primary_key=True)  # hash of the band's rows of the signature
+    journey_id = Column(String, ForeignKey("journeys.id", ondelete="CASCADE"), primary_key=True)
+
+    __table_args__ = (
+        Index("ix_similarity_buckets_journey", "journey_id"),
+    )
+
+SEARCH_COLUMNS = ("label", "department", "responsible", "pain_points", "opportunities", "resources", "body")
+
+# False when the database is not SQLite or lacks FTS5; GET /api/search then answers 501
+SEARCH_ENABLED = True
+
+def _create_search_index() -> bool:
+    """Create the external-content FTS5 table over search_documents and its triggers.
+
+    Returns whether the index had to be created, i.e. needs populating.
+    """
+    columns = ", ".join(SEARCH_COLUMNS)
+    new_values = ", ".join(f"new.{column}" for column in SEARCH_COLUMNS)
+    old_values = ", ".join(f"old.{column}" for column in SEARCH_COLUMNS)
+    delete_old = f"INSERT INTO node_search(node_search, rowid, {columns}) VALUES ('delete', old.id, {old_values});"
+    insert_new = f"INSERT INTO node_search(rowid, {columns}) VALUES (new.id, {new_values});"
+    with engine.begin() as conn:
+        created = not inspect(conn).has_table("node_search")
+        conn.exec_driver_sql(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS node_search USING fts5({columns}, "
+            "content='search_documents', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+        )
+        conn.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS search_documents_ai AFTER INSERT ON search_documents BEGIN {insert_new} END")
+        conn.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS search_documents_ad AFTER DELETE ON search_documents BEGIN {delete_old} END")
+        conn.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS search_documents_au AFTER UPDATE ON search_documents BEGIN {delete_old} {insert_new} END"
+        )
+    return created
+
+def _migrate_schema():
+    """Add columns and indexes introduced after a database file was created."""
+    table = Journey.__table__
+    existing = {column["name"] for column in inspect(engine).get_columns(table.name)}
+    added = [column for column in table.columns if column.name not in existing]
+
+    with engine.begin() as conn:
+        for column in added:
+            column_type = column.type.compile(dialect=engine.dialect)
+            default = column.default.arg if column.default is not None and column.default.is_scalar else None
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+            if default is not None:
+                ddl += f" DEFAULT {default!r}"
+            conn.exec_driver_sql(ddl)
+
+        if {"node_count", "edge_count"} & {column.name for column in added}:
+            rows = conn.execute(table.select().with_only_columns(table.c.id, table.c.nodes_data, table.c.edges_data))
+            for row in rows.fetchall():
+                conn.execute(
+                    table.update()
+                    .where(table.c.id == row.id)
+                    .values(
+                        node_count=len(json.loads(row.nodes_data or "[]")),
+                        edge_count=len(json.loads(row.edges_data or "[]")),
+                        updated_at=table.c.updated_at,  # backfill must not look like an edit
+                    )
+                )
+
+        for index in table.indexes:
+            index.create(bind=conn, checkfirst=True)
+
 def init_db():
+    global SEARCH_ENABLED
+    populate_rollups = not inspect(engine).has_table(AnalyticsRollup.__tablename__)
+    populate_fingerprints = not inspect(engine).has_table(JourneyFingerprint.__tablename__)
     Base.metadata.create_all(bind=engine)
+    _migrate_schema()
+    if populate_rollups:
+        from rollups import rebuild_rollups
+        db = SessionLocal()
+        try:
+            rebuild_rollups(db)
+        finally:
+            db.close()
+    if populate_fingerprints:
+        from similarity import rebuild_fingerprints
+        db = SessionLocal()
+        try:
+            rebuild_fingerprints(db)
+        finally:
+            db.close()
+    populate_search = False
+    if not IS_SQLITE:
+        SEARCH_ENABLED = False
+    else:
+        try:
+            populate_search = _create_search_index()
+        except OperationalError as error:
+            logging.getLogger(__name__).warning("Full-text search disabled: %s", error)
+            SEARCH_ENABLED = False
+    if populate_search:
+        from crud import reindex_journeys
+        db = SessionLocal()
+        try:
+            reindex_journeys(db)
+        finally:
+            db.close()
+    if NORMALIZED_STORAGE:
+        # Imported here because crud imports this module
+        from crud import normalize_journeys
+        db = SessionLocal()
+        try:
+            normalize_journeys(db, only_missing=True)
+        finally:
+            db.close()
+
+def recompress_journeys(batch_size: int = 200) -> int:
+    """Rewrite the nodes/edges columns in the current JOURNEY_COMPRESSION format, then VACUUM.
+
+    The content does not change, so versions and ``updated_at`` are left alone.
+    Returns the number of journeys rewritten.
+    """
+    table = Journey.__table__
+    with engine.connect() as conn:
+        ids = list(conn.execute(select(table.c.id).order_by(table.c.id)).scalars())
+
+    rewrite = (
+        table.update()
+        .where(table.c.id == bindparam("row_id"))
+        .values(nodes_data=bindparam("nodes"), edges_data=bindparam("edges"), updated_at=table.c.updated_at)
+    )
+    for start in range(0, len(ids), batch_size):
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(table.c.id, table.c.nodes_data, table.c.edges_data)
+                .where(table.c.id.in_(ids[start:start + batch_size]))
+            ).fetchall()
+            conn.execute(rewrite, [{"row_id": row.id, "nodes": row.nodes_data, "edges": row.edges_data} for row in rows])
+
+    # Give the freed pages back to the file system
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql("VACUUM")
+    return len(ids)
+
+def benchmark_compression(limit: int = 1000) -> List[dict]:
+    """Size, page and CPU cost of the stored nodes/edges JSON under each codec.
+
+    Pages are the b-tree plus overflow pages a row's two blobs occupy, which
+    is what a cold ``get_journey`` reads; timings are per journey.
+    """
+    table = Journey.__table__
+    with engine.connect() as conn:
+        page_size = conn.exec_driver_sql("PRAGMA page_size").scalar()
+        rows = conn.execute(select(table.c.nodes_data, table.c.edges_data).limit(limit)).fetchall()
+    texts = [(row.nodes_data.encode(), row.edges_data.encode()) for row in rows]
+    if not texts:
+        return []
+
+    def deflate(zdict):
+        def encode(raw):
+            compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -15, **zdict)
+            return compressor.compress(raw) + compressor.flush()
+        def decode(packed):
+            decompressor = zlib.decompressobj(-15, **zdict)
+            return decompressor.decompress(packed) + decompressor.flush()
+        return encode, decode
+
+    codecs = {
+        "none": (lambda raw: raw, lambda raw: raw),
+        "zlib": deflate({}),
+        "zlib+dictionary": deflate({"zdict": COMPRESSION_DICTIONARIES[_DEFAULT_DICTIONARY]}),
+    }
+    results = []
+    for name, (encode, decode) in codecs.items():
+        started = time.perf_counter()
+        packed = [(encode(nodes), encode(edges)) for nodes, edges in texts]
+        encoded = time.perf_counter()
+        for nodes, edges in packed:
+            decode(nodes)
+            decode(edges)
+        decoded = time.perf_counter()
+        total = sum(len(nodes) + len(edges) for nodes, edges in packed)
+        results.append({
+            "codec": name,
+            "journeys": len(texts),
+            "bytes": total,
+            "ratio": total / sum(len(nodes) + len(edges) for nodes, edges in texts),
+            "pages_per_journey": sum(-(-(len(nodes) + len(edges)) // (page_size - 4)) for nodes, edges in packed) / len(texts),
+            "encode_us": (encoded - started) / len(texts) * 1e6,
+            "decode_us": (decoded - encoded) / len(texts) * 1e6,
+        })
+    return results
+
+class _GroupSession(Session):
+    """Session of the writer thread, shared by every job of a group commit.
+
+    Each job runs in its own SAVEPOINT: ``commit()`` from crud code only
+    flushes, and ``rollback()`` undoes the current job alone and lets it go on.
+    """
+
+    def commit(self):
+        self.flush()
+
+    def rollback(self):
+        self.get_nested_transaction().rollback()
+        self.begin_nested()
+
+_WriterSession = sessionmaker(
+    class_=_GroupSession, autoflush=False,
+    # Take the write lock up front instead of failing to upgrade a read lock
+    bind=engine.execution_options(sqlite_begin="IMMEDIATE"),
+)
+
+class WriteQueue:
+    """Single writer thread that commits queued write jobs in groups.
+
+    Jobs that arrive while a transaction commits are run together in the next
+    one, up to ``DB_WRITE_BATCH`` per transaction, so a burst of saves costs
+    one commit (and one sync) instead of one each and writers never contend
+    for the database lock. A failing job is rolled back to its savepoint and
+    only its caller sees the error; every caller gets its result once the
+    group is committed.
+    """
 
-def get_db():
-    db = SessionLocal()
+    def __init__(self, max_batch: int = DB_WRITE_BATCH):
+        self.max_batch = max_batch
+        self._jobs = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.groups = 0
+        self.jobs = 0
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """Queue ``fn(session, *args)``; the future resolves after its group commits"""
+        future = Future()
+        # The job runs in the caller's context so its timings reach the request
+        self._jobs.put((future, contextvars.copy_context(), fn, args, kwargs))
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                    self._thread.start()
+        return future
+
+    def pending(self) -> int:
+        return self._jobs.qsize()
+
+    def _run(self):
+        while True:
+            group = [self._jobs.get()]
+            while len(group) < self.max_batch:
+                try:
+                    group.append(self._jobs.get_nowait())
+                except queue.Empty:
+                    break
+            self._commit_group(group)
+
+    def _commit_group(self, group):
+        outcomes = []
+        session = _WriterSession()
+        metrics.SESSIONS_OPENED.inc()
+        try:
+            for future, context, fn, args, kwargs in group:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                session.begin_nested()
+                try:
+                    result = context.run(metrics.in_thread, fn, session, *args, **kwargs)
+                except BaseException as error:
+                    session.get_nested_transaction().rollback()
+                    outcomes.append((future, None, error))
+                else:
+                    session.get_nested_transaction().commit()
+                    outcomes.append((future, result, None))
+            Session.commit(session)
+        except BaseException as error:
+            logging.getLogger(__name__).exception("Group commit of %d writes failed", len(group))
+            # Jobs already cached responses for versions that were never stored
+            response_cache.clear()
+            outcomes = [(future, None, job_error or error) for future, _, job_error in outcomes]
+        finally:
+            session.close()
+            metrics.SESSIONS_CLOSED.inc()
+        self.groups += 1
+        self.jobs += len(outcomes)
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+write_queue = WriteQueue()
+
+class AsyncDB:
+    """Request-scoped handle that runs session work on ``db_executor``.
+
+    ``await db.run(fn, *args)`` calls ``fn(session, *args)`` on a DB thread and
+    returns its result. The session is opened lazily on first use. Calls on the
+    same handle must be awaited one at a time, like the session itself.
+    ``await db.write(fn, *args)`` runs ``fn`` on the writer thread instead,
+    with the writer's session, and returns once it is committed.
+    """
+
+    def __init__(self):
+        self._session = None
+
+    def _call(self, fn, args, kwargs):
+        if self._session is None:
+            self._session = SessionLocal()
+            metrics.SESSIONS_OPENED.inc()
+        return fn(self._session, *args, **kwargs)
+
+    async def run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        # In a copy of the caller's context, so timings reach the request
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(db_executor, context.run, metrics.in_thread, self._call, fn, args, kwargs)
+
+    async def write(self, fn, *args, **kwargs):
+        return await asyncio.wrap_future(write_queue.submit(fn, *args, **kwargs))
+
+    async def close(self):
+        if self._session is not None:
+            session, self._session = self._session, None
+            await asyncio.get_running_loop().run_in_executor(db_executor, session.close)
+            metrics.SESSIONS_CLOSED.inc()
+
+async def iterate_in_db_thread(fn, *args, **kwargs):
+    """Drive the sync generator ``fn(session, *args)`` on ``db_executor``.
+
+    Uses its own session so a streaming response can outlive the request's
+    ``get_db`` handle, and closes both generator and session when done.
+    """
+    loop = asyncio.get_running_loop()
+    # Steps run one at a time, so they can all enter the same context copy
+    context = contextvars.copy_context()
+    session = SessionLocal()
+    metrics.SESSIONS_OPENED.inc()
+    iterator = None
+    done = object()
+    try:
+        iterator = await loop.run_in_executor(
+            db_executor, context.run, metrics.in_thread, lambda: iter(fn(session, *args, **kwargs))
+        )
+        while True:
+            item = await loop.run_in_executor(db_executor, context.run, metrics.in_thread, next, iterator, done)
+            if item is done:
+                break
+            yield item
+    finally:
+        def close():
+            if iterator is not None and hasattr(iterator, "close"):
+                iterator.close()
+            session.close()
+        await loop.run_in_executor(db_executor, close)
+        metrics.SESSIONS_CLOSED.inc()
+
+async def get_db():
+    db = AsyncDB()
     try:
         yield db
+    finally:
+        await db.close()
+
+if __name__ == "__main__":
+    import sys
+
+    commands = ("normalize", "reindex", "rollups", "fingerprints", "recompress", "benchmark-compression")
+    if len(sys.argv) != 2 or sys.argv[1] not in commands:
+        sys.exit(f"usage: python database.py {'|'.join(commands)}")
+
+    # Go through the importable module so crud and this script share one engine
+    import database
+    from crud import normalize_journeys, reindex_journeys
+    from rollups import rebuild_rollups
+    from similarity import rebuild_fingerprints
+
+    database.init_db()
+    db = database.SessionLocal()
+    try:
+        if sys.argv[1] == "normalize":
+            print(f"Normalized {normalize_journeys(db)} journeys")
+        elif sys.argv[1] == "recompress":
+            print(f"Rewrote {database.recompress_journeys()} journeys as {database.JOURNEY_COMPRESSION!r}")
+        elif sys.argv[1] == "benchmark-compression":
+            print(f"{'codec':<16}{'journeys':>9}{'bytes':>12}{'ratio':>8}{'pages':>8}{'encode us':>11}{'decode us':>11}")
+            for result in database.benchmark_compression():
+                print(
+                    f"{result['codec']:<16}{result['journeys']:>9}{result['bytes']:>12}{result['ratio']:>8.3f}"
+                    f"{result['pages_per_journey']:>8.2f}{result['encode_us']:>11.1f}{result['decode_us']:>11.1f}"
+                )
+        elif sys.argv[1] == "rollups":
+            print(f"Rolled up {rebuild_rollups(db)} journeys")
+        elif sys.argv[1] == "fingerprints":
+            print(f"Fingerprinted {rebuild_fingerprints(db)} journeys")
+        elif not database.SEARCH_ENABLED:
+            sys.exit("This SQLite build has no FTS5 support")
+        else:
+            print(f"Indexed {reindex_journeys(db)} journeys")
     finally:
         db.close()
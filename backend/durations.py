@@ -0,0 +1,96 @@
+"""Parsing of the free-text ``duration`` field of journey stages.
+
+Stages carry values such as "15 minutos", "1-2 días", "2-6 horas" or
+"Continuo". ``parse_duration`` turns the quantitative ones into a
+``DurationRange`` in minutes and returns ``None`` for everything else.
+Quantities joined by a range separator are the two ends of a range
+("1-2 días", "entre 1 y 2 horas"); any other quantities add up to one
+compound duration ("1 hora 30 minutos", "1h 30min").
+"""
+from typing import NamedTuple, Optional
+import re
+import unicodedata
+
+class DurationRange(NamedTuple):
+    min_minutes: float
+    max_minutes: float
+
+    @property
+    def expected_minutes(self) -> float:
+        return (self.min_minutes + self.max_minutes) / 2
+
+_MINUTE = 1.0
+_HOUR = 60.0
+_DAY = 24 * _HOUR
+_WEEK = 7 * _DAY
+_MONTH = 30 * _DAY
+_YEAR = 365 * _DAY
+
+# Spanish and English spellings, compared without accents and in lower case
+UNIT_MINUTES = {
+    "m": _MINUTE, "min": _MINUTE, "mins": _MINUTE, "minuto": _MINUTE, "minutos": _MINUTE,
+    "minute": _MINUTE, "minutes": _MINUTE,
+    "h": _HOUR, "hr": _HOUR, "hrs": _HOUR, "hora": _HOUR, "horas": _HOUR, "hour": _HOUR, "hours": _HOUR,
+    "d": _DAY, "dia": _DAY, "dias": _DAY, "day": _DAY, "days": _DAY,
+    "sem": _WEEK, "semana": _WEEK, "semanas": _WEEK, "w": _WEEK, "week": _WEEK, "weeks": _WEEK,
+    "mes": _MONTH, "meses": _MONTH, "month": _MONTH, "months": _MONTH,
+    "ano": _YEAR, "anos": _YEAR, "year": _YEAR, "years": _YEAR,
+}
+
+# Prefixes meaning "anything up to", e.g. "< 24 horas", "hasta 2 días"
+_UPPER_BOUND = re.compile(r"^(<|(hasta|menos de|maximo|max|up to|less than|under)\b)")
+_QUANTITY = re.compile(r"(\d+(?:[.,]\d+)?)\s*([a-z]+)?")
+# Text between two quantities that makes them the ends of a range; "y"/"and"
+# only in "entre 1 y 2 horas", elsewhere it joins a compound duration
+_RANGE_SEPARATOR = re.compile(r"^(-|–|—|a|to|hasta)$")
+_BETWEEN = re.compile(r"^(entre|between)\b")
+
+def _normalize(text: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).strip()
+
+def parse_duration(text) -> Optional[DurationRange]:
+    """Parse "15 minutos", "1-2 días", "30 min - 1 hora", "1 h 30 min", "< 24 h" into minutes.
+
+    A number without a unit borrows the unit of the other end of its range
+    ("1-2 días"). Non-quantitative values ("Continuo", "Variable") and values
+    with a quantity of unknown unit return ``None``.
+    """
+    if not isinstance(text, str):
+        return None
+    normalized = _normalize(text)
+    between = bool(_BETWEEN.match(normalized))
+
+    # [value, unit, starts a new end of the range]
+    quantities = []
+    end = None
+    for match in _QUANTITY.finditer(normalized):
+        value, unit = match.groups()
+        if unit not in UNIT_MINUTES:
+            unit = None  # a word such as "a" or "y", part of the separator
+        separator = normalized[end:match.start()].strip() if end is not None else ""
+        ranged = bool(_RANGE_SEPARATOR.match(separator)) or (between and separator in ("y", "and"))
+        quantities.append([float(value.replace(",", ".")), unit, ranged])
+        end = match.end(2) if unit else match.end(1)
+    if not quantities:
+        return None
+
+    # Fill missing units from the right across range separators: "1-2 días" -> 1 día, 2 días
+    next_unit = None
+    for quantity in reversed(quantities):
+        if quantity[1] is None:
+            quantity[1] = next_unit
+        next_unit = quantity[1] if quantity[2] else None
+    if any(unit is None for _, unit, _ in quantities):
+        return None
+
+    # Compound durations add up; the range separators split them into the ends
+    ends = []
+    for value, unit, ranged in quantities:
+        if ranged or not ends:
+            ends.append(0.0)
+        ends[-1] += value * UNIT_MINUTES[unit]
+    low, high = min(ends), max(ends)
+    if _UPPER_BOUND.match(normalized):
+        low = 0.0
+    return DurationRange(low, high)
@@ -0,0 +1,355 @@
+"""BPMN 2.0 XML and FHIR R4 exports of stored journeys.
+
+Documents are produced as iterators of small text pieces that ``_chunked``
+groups into bytes chunks, so a response streams while it is generated and
+never holds more than the decoded graph and one chunk. The rendered output
+of a journey version is cached (see ``cached_chunks``); the portfolio FHIR
+bundle reuses the cached entries of every unchanged journey.
+"""
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional
+from xml.sax.saxutils import escape, quoteattr
+import json
+import os
+import re
+import uuid
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import database
+from cache import response_cache
+from crud import load_graphs
+from database import Journey
+from durations import parse_duration
+
+CHUNK_SIZE = 64 * 1024
+# Rendered documents larger than this are streamed but not cached
+EXPORT_CACHE_MAX_BYTES = int(os.environ.get("EXPORT_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+
+class JourneyDocument(NamedTuple):
+    """What the exporters need of a stored journey"""
+    id: str
+    version: int
+    name: str
+    description: Optional[str]
+    updated_at: datetime
+    fhir_plan_definition_id: Optional[str]
+    nodes: List[dict]
+    edges: List[dict]
+
+def load_documents(db: Session, journey_ids: List[str]) -> Dict[str, JourneyDocument]:
+    journeys = db.query(Journey).filter(Journey.id.in_(journey_ids)).all()
+    graphs = load_graphs(db, journey_ids) if database.NORMALIZED_STORAGE else {}
+    documents = {}
+    for journey in journeys:
+        nodes, edges = graphs.get(journey.id) or (json.loads(journey.nodes_data), json.loads(journey.edges_data))
+        documents[journey.id] = JourneyDocument(
+            journey.id, journey.version, journey.name, journey.description, journey.updated_at,
+            journey.fhir_plan_definition_id, nodes, edges,
+        )
+    return documents
+
+def _chunked(pieces: Iterable[str], size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    buffer, length = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield "".join(buffer).encode()
+            buffer, length = [], 0
+    if buffer:
+        yield "".join(buffer).encode()
+
+def cached_chunks(key, chunks: Iterator[bytes]) -> Iterator[bytes]:
+    """Pass ``chunks`` through and cache their concatenation under ``key`` once complete.
+
+    Output beyond EXPORT_CACHE_MAX_BYTES is not kept, so memory stays bounded.
+    """
+    kept, size = [], 0
+    for chunk in chunks:
+        if kept is not None:
+            size += len(chunk)
+            kept = kept + [chunk] if size <= EXPORT_CACHE_MAX_BYTES else None
+        yield chunk
+    if kept is not None:
+        response_cache.put(key, b"".join(kept))
+
+# BPMN 2.0 XML
+_BPMN_ELEMENTS = {
+    "start_event": "startEvent",
+    "end_event": "endEvent",
+    "intermediate_event": "intermediateThrowEvent",
+    "gateway_exclusive": "exclusiveGateway",
+    "gateway_parallel": "parallelGateway",
+    "gateway_inclusive": "inclusiveGateway",
+    "subprocess": "subProcess",
+}
+# Width and height of the diagram shapes, as drawn by common BPMN modelers
+_SHAPE_SIZES = {"startEvent": (36, 36), "endEvent": (36, 36), "intermediateThrowEvent": (36, 36),
+                "exclusiveGateway": (50, 50), "parallelGateway": (50, 50), "inclusiveGateway": (50, 50)}
+_TASK_SIZE = (100, 80)
+_NOT_NCNAME = re.compile(r"[^A-Za-z0-9_.-]")
+
+def _xml_id(prefix: str, value) -> str:
+    """Node and edge ids may start with a digit, XML ids may not"""
+    return f"{prefix}_{_NOT_NCNAME.sub('_', str(value))}"
+
+class _XmlIds:
+    """Distinct XML ids for one document.
+
+    Sanitising maps different ids ("a b", "a_b") to the same XML id; the
+    later ones get a counter. The ``_di`` id of each element's diagram shape
+    is reserved with it.
+    """
+
+    def __init__(self):
+        self._taken = set()
+
+    def new(self, prefix: str, value) -> str:
+        base = candidate = _xml_id(prefix, value)
+        counter = 1
+        while candidate in self._taken or candidate + "_di" in self._taken:
+            counter += 1
+            candidate = f"{base}_{counter}"
+        self._taken.update((candidate, candidate + "_di"))
+        return candidate
+
+def _number(value) -> str:
+    return f"{float(value or 0):g}"
+
+def bpmn_document(document: JourneyDocument) -> Iterator[str]:
+    """BPMN 2.0 definitions with one process and its diagram.
+
+    Node types that are not BPMN elements (registration, consultation...)
+    become tasks; edges whose source or target is missing are left out.
+    """
+    ids = _XmlIds()
+    process_id = ids.new("Process", document.id)
+    node_ids = {node["id"] for node in document.nodes}
+    flows = [edge for edge in document.edges if edge.get("source") in node_ids and edge.get("target") in node_ids]
+    flow_ids = [ids.new("Flow", edge["id"]) for edge in flows]
+    incoming, outgoing = defaultdict(list), defaultdict(list)
+    for edge, flow_id in zip(flows, flow_ids):
+        outgoing[edge["source"]].append(flow_id)
+        incoming[edge["target"]].append(flow_id)
+
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield (
+        '<bpmn:definitions xmlns:bpmn="http://www.omg.org/spec/BPMN/20100524/MODEL"'
+        ' xmlns:bpmndi="http://www.omg.org/spec/BPMN/20100524/DI"'
+        ' xmlns:dc="http://www.omg.org/spec/DD/20100524/DC"'
+        ' xmlns:di="http://www.omg.org/spec/DD/20100524/DI"'
+        f' id={quoteattr(ids.new("Definitions", document.id))}'
+        ' targetNamespace="http://bpmn.io/schema/bpmn" exporter="Patient Journey Designer">\n'
+    )
+    yield f'  <bpmn:process id={quoteattr(process_id)} name={quoteattr(document.name)} isExecutable="false">\n'
+    if document.description:
+        yield f"    <bpmn:documentation>{escape(document.description)}</bpmn:documentation>\n"
+
+    shapes = []
+    flow_ends = {}  # node id -> element id; flows attach to the first node of a duplicated id
+    for node in document.nodes:
+        element = _BPMN_ELEMENTS.get(node.get("type"), "task")
+        data = node.get("data") or {}
+        element_id = ids.new("Node", node["id"])
+        shapes.append((element_id, element))
+        flow_ends.setdefault(node["id"], element_id)
+        label = data.get("label")
+        name = f" name={quoteattr(str(label))}" if label else ""
+        yield f"    <bpmn:{element} id={quoteattr(element_id)}{name}>\n"
+        if data.get("description"):
+            yield f"      <bpmn:documentation>{escape(str(data['description']))}</bpmn:documentation>\n"
+        for flow_id in incoming[node["id"]]:
+            yield f"      <bpmn:incoming>{flow_id}</bpmn:incoming>\n"
+        for flow_id in outgoing[node["id"]]:
+            yield f"      <bpmn:outgoing>{flow_id}</bpmn:outgoing>\n"
+        yield f"    </bpmn:{element}>\n"
+
+    for edge, flow_id in zip(flows, flow_ids):
+        name = f" name={quoteattr(edge['label'])}" if edge.get("label") else ""
+        yield (
+            f"    <bpmn:sequenceFlow id={quoteattr(flow_id)}"
+            f" sourceRef={quoteattr(flow_ends[edge['source']])} targetRef={quoteattr(flow_ends[edge['target']])}{name} />\n"
+        )
+    yield "  </bpmn:process>\n"
+
+    yield f'  <bpmndi:BPMNDiagram id={quoteattr(ids.new("Diagram", document.id))}>\n'
+    yield f"    <bpmndi:BPMNPlane id={quoteattr(ids.new('Plane', document.id))} bpmnElement={quoteattr(process_id)}>\n"
+    bounds = {}
+    for node, (element_id, element) in zip(document.nodes, shapes):
+        position = node.get("position") or {}
+        width, height = _SHAPE_SIZES.get(element, _TASK_SIZE)
+        x, y = float(position.get("x") or 0), float(position.get("y") or 0)
+        bounds.setdefault(node["id"], (x, y, width, height))
+        yield (
+            f"      <bpmndi:BPMNShape id={quoteattr(element_id + '_di')} bpmnElement={quoteattr(element_id)}>"
+            f'<dc:Bounds x="{_number(x)}" y="{_number(y)}" width="{width}" height="{height}" /></bpmndi:BPMNShape>\n'
+        )
+    for edge, flow_id in zip(flows, flow_ids):
+        sx, sy, sw, sh = bounds[edge["source"]]
+        tx, ty, _, th = bounds[edge["target"]]
+        yield (
+            f"      <bpmndi:BPMNEdge id={quoteattr(flow_id + '_di')} bpmnElement={quoteattr(flow_id)}>"
+            f'<di:waypoint x="{_number(sx + sw)}" y="{_number(sy + sh / 2)}" />'
+            f'<di:waypoint x="{_number(tx)}" y="{_number(ty + th / 2)}" /></bpmndi:BPMNEdge>\n'
+        )
+    yield "    </bpmndi:BPMNPlane>\n  </bpmndi:BPMNDiagram>\n</bpmn:definitions>\n"
+
+# FHIR R4 PlanDefinition / ActivityDefinition
+_FHIR_ID = re.compile(r"[^A-Za-z0-9.-]")
+_UCUM = "http://unitsofmeasure.org"
+_EVENT_TYPES = {"start_event", "end_event", "intermediate_event"}
+_SELECTION_BEHAVIOR = {"gateway_exclusive": "exactly-one", "gateway_inclusive": "any", "gateway_parallel": "all"}
+
+def _fhir_id(value: str) -> str:
+    return _FHIR_ID.sub("-", value)[:64]
+
+def _urn(*parts: str) -> str:
+    """Stable urn:uuid for a resource, so repeated exports reference the same ids"""
+    return f"urn:uuid:{uuid.uuid5(uuid.NAMESPACE_URL, '/'.join(parts))}"
+
+def _compact(values: dict) -> dict:
+    """FHIR forbids nulls and empty arrays"""
+    return {key: value for key, value in values.items() if value not in (None, "", [], {})}
+
+def _minutes(value: float) -> dict:
+    return {"value": round(value, 2), "unit": "min", "system": _UCUM, "code": "min"}
+
+def _timing(duration_text) -> dict:
+    duration = parse_duration(duration_text)
+    if duration is None:
+        return {}
+    if duration.min_minutes == duration.max_minutes:
+        return {"timingDuration": _minutes(duration.max_minutes)}
+    return {"timingRange": {"low": _minutes(duration.min_minutes), "high": _minutes(duration.max_minutes)}}
+
+def _text(value) -> Optional[str]:
+    return None if value is None else str(value)
+
+def _participants(data: dict) -> list:
+    responsible = _text(data.get("responsible"))
+    return [{"type": "practitioner", "role": {"text": responsible}}] if responsible else []
+
+def fhir_entries(document: JourneyDocument) -> Iterator[str]:
+    """Comma separated Bundle entries: the PlanDefinition, then one ActivityDefinition per task.
+
+    Each node becomes a PlanDefinition action ordered after its predecessors
+    (``relatedAction``); gateways carry the matching ``selectionBehavior``.
+    """
+    plan_id = _fhir_id(document.fhir_plan_definition_id or document.id)
+    predecessors = defaultdict(list)
+    for edge in document.edges:
+        predecessors[edge.get("target")].append(edge.get("source"))
+    node_ids = {node["id"] for node in document.nodes}
+    activities = {
+        node["id"]: _urn(document.id, node["id"])
+        for node in document.nodes
+        if node.get("type") not in _EVENT_TYPES and node.get("type") not in _SELECTION_BEHAVIOR
+    }
+
+    plan = _compact({
+        "resourceType": "PlanDefinition",
+        "id": plan_id,
+        "url": _urn(document.id),
+        "version": str(document.version),
+        "title": document.name,
+        "type": {"coding": [{
+            "system": "http://terminology.hl7.org/CodeSystem/plan-definition-type",
+            "code": "clinical-protocol",
+            "display": "Clinical Protocol",
+        }]},
+        "status": "draft",
+        "date": document.updated_at.replace(tzinfo=timezone.utc).isoformat(),
+        "description": document.description,
+    })
+    plan_json = json.dumps(plan)
+    yield f'{{"fullUrl": {json.dumps(_urn(document.id))}, "resource": {plan_json[:-1]}'
+    if document.nodes:
+        yield ', "action": ['
+        for i, node in enumerate(document.nodes):
+            data = node.get("data") or {}
+            action = _compact({
+                "id": node["id"],
+                "title": _text(data.get("label")),
+                "description": _text(data.get("description")),
+                "code": [{"text": data["stage_type"]}] if data.get("stage_type") else None,
+                **_timing(data.get("duration")),
+                "participant": _participants(data),
+                "definitionCanonical": activities.get(node["id"]),
+                "relatedAction": [
+                    {"actionId": source, "relationship": "after-end"}
+                    for source in predecessors[node["id"]] if source in node_ids
+                ],
+                "selectionBehavior": _SELECTION_BEHAVIOR.get(node.get("type")),
+            })
+            yield ("," if i else "") + json.dumps(action)
+        yield "]"
+    yield "}}"
+
+    for node in document.nodes:
+        url = activities.get(node["id"])
+        if url is None:
+            continue
+        data = node.get("data") or {}
+        activity = _compact({
+            "resourceType": "ActivityDefinition",
+            "id": url.rsplit(":", 1)[1],
+            "url": url,
+            "status": "draft",
+            "title": _text(data.get("label")) or node["id"],
+            "description": _text(data.get("description")),
+            "kind": "Task",
+            "code": {"text": data["stage_type"]} if data.get("stage_type") else None,
+            "topic": [{"text": str(data["department"])}] if data.get("department") else None,
+            **_timing(data.get("duration")),
+            "participant": _participants(data),
+        })
+        yield f',{{"fullUrl": {json.dumps(url)}, "resource": {json.dumps(activity)}}}'
+
+def fhir_bundle(fragments: Iterable[Iterable[bytes]]) -> Iterator[bytes]:
+    """Wrap entry fragments (each the chunks of ``fhir_entries``) into a collection Bundle"""
+    timestamp = datetime.now(timezone.utc).isoformat()
+    yield f'{{"resourceType": "Bundle", "type": "collection", "timestamp": {json.dumps(timestamp)}'.encode()
+    opened = False
+    for fragment in fragments:
+        # An empty entry array is not valid FHIR, so it is only opened once there is an entry
+        yield b"," if opened else b', "entry": ['
+        opened = True
+        yield from fragment
+    yield b"]}" if opened else b"}"
+
+def stream_bpmn(document: JourneyDocument) -> Iterator[bytes]:
+    return cached_chunks((document.id, ("bpmn", document.version)), _chunked(bpmn_document(document)))
+
+def stream_fhir(document: JourneyDocument) -> Iterator[bytes]:
+    """Bundle of one journey; its entries are cached for the portfolio bundle too"""
+    return fhir_bundle([cached_chunks((document.id, ("fhir", document.version)), _chunked(fhir_entries(document)))])
+
+def export_fhir_bundle(db: Session, batch_size: int = 200) -> Iterator[bytes]:
+    """FHIR Bundle of every journey, streamed ``batch_size`` journeys at a time.
+
+    Only ids and versions are read up front; journeys whose entries for the
+    current version are cached are neither loaded nor rendered again.
+    """
+    def batches():
+        statement = select(Journey.id, Journey.version).order_by(Journey.id).execution_options(yield_per=batch_size)
+        for batch in db.execute(statement).partitions():
+            cached = {row.id: response_cache.get((row.id, ("fhir", row.version))) for row in batch}
+            missing = [journey_id for journey_id, fragment in cached.items() if fragment is None]
+            documents = load_documents(db, missing) if missing else {}
+            fragments = []
+            for row in batch:
+                fragment = cached[row.id]
+                if fragment is None:
+                    document = documents.get(row.id)
+                    if document is None:
+                        continue  # deleted meanwhile
+                    fragment = b"".join(_chunked(fhir_entries(document)))
+                    response_cache.put((row.id, ("fhir", document.version)), fragment)
+                fragments.append(fragment)
+            if fragments:
+                yield [b",".join(fragments)]
+
+    return fhir_bundle(batches())
@@ -0,0 +1,276 @@
+"""Request instrumentation: latency and size histograms, per-request phase
+timings and an opt-in sampling profiler, exposed as Prometheus text.
+
+``InstrumentationMiddleware`` binds a ``RequestTimings`` to the request's
+context; code on the hot paths wraps its work in ``phase("db")``,
+``phase("decode")``... and the time lands in that request, including work
+done on DB threads (``AsyncDB`` runs it in a copy of the caller's context).
+Outside a request ``phase`` does nothing. Each response carries its phase
+breakdown in a ``Server-Timing`` header.
+
+With ``PROFILING_ENABLED`` a request sent with ``X-Profile: 1`` is sampled
+every ``PROFILE_INTERVAL_MS`` on the event loop thread and on the DB threads
+while they work for it; the folded stacks (flamegraph.pl / speedscope
+format) are kept under the ``X-Profile-Id`` of the response.
+"""
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional, Tuple
+import os
+import sys
+import threading
+import time
+import uuid
+
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "0") == "1"
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "5"))
+# Finished profiles kept for GET /api/metrics/profiles/{id}
+PROFILES_KEPT = 32
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names: Tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Histogram:
+    """Cumulative-bucket histogram per label combination"""
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...], buckets: Tuple[float, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [count per bucket (last is +Inf)..., sum]
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values: tuple, value: float):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for label_values, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_labels(self.labels, label_values, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, label_values)} {values[-1]}"
+            yield f"{self.name}_count{_labels(self.labels, label_values)} {cumulative}"
+
+class Counter:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        yield f"{self.name} {self.value}"
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time from request start to the last body byte sent",
+    ("method", "route", "status"), LATENCY_BUCKETS,
+)
+REQUEST_SIZE = Histogram("http_request_size_bytes", "Request body size (Content-Length)", ("method", "route"), SIZE_BUCKETS)
+RESPONSE_SIZE = Histogram("http_response_size_bytes", "Response body size", ("method", "route"), SIZE_BUCKETS)
+PHASE_DURATION = Histogram(
+    "http_request_phase_seconds", "Time per request spent in each instrumented phase",
+    ("route", "phase"), LATENCY_BUCKETS,
+)
+DB_QUERIES = Counter("db_queries_total", "SQL statements executed")
+SESSIONS_OPENED = Counter("db_sessions_opened_total", "Database sessions opened")
+SESSIONS_CLOSED = Counter("db_sessions_closed_total", "Database sessions closed")
+
+class Profile:
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.threads = set()
+        self.samples: Dict[str, int] = defaultdict(int)
+
+    def folded(self) -> str:
+        """One ``frame;frame;frame count`` line per distinct stack, root first"""
+        lines = sorted(self.samples.items(), key=lambda item: -item[1])
+        return "".join(f"{stack} {count}\n" for stack, count in lines)
+
+class RequestTimings:
+    __slots__ = ("phases", "profile")
+
+    def __init__(self, profile: Optional[Profile] = None):
+        self.phases: Dict[str, float] = defaultdict(float)
+        self.profile = profile
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+def add_phase(name: str, seconds: float):
+    timings = _current.get()
+    if timings is not None:
+        timings.phases[name] += seconds
+
+@contextmanager
+def phase(name: str):
+    """Add the time spent in the block to phase ``name`` of the current request"""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.phases[name] += time.perf_counter() - started
+
+def in_thread(fn, *args, **kwargs):
+    """Call ``fn`` on a worker thread for the current request, so a profile samples that thread"""
+    timings = _current.get()
+    if timings is None or timings.profile is None:
+        return fn(*args, **kwargs)
+    ident = threading.get_ident()
+    timings.profile.threads.add(ident)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        timings.profile.threads.discard(ident)
+
+class _Sampler:
+    """One thread sampling the stacks of every active profile; runs only while there is one"""
+
+    def __init__(self):
+        self.active = set()
+        self.finished: "OrderedDict[str, Profile]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, profile: Profile):
+        with self._lock:
+            self.active.add(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self._thread.start()
+
+    def stop(self, profile: Profile):
+        with self._lock:
+            self.active.discard(profile)
+            self.finished[profile.id] = profile
+            while len(self.finished) > PROFILES_KEPT:
+                self.finished.popitem(last=False)
+
+    def _run(self):
+        interval = PROFILE_INTERVAL_MS / 1000
+        while True:
+            with self._lock:
+                if not self.active:
+                    self._thread = None
+                    return
+                active = list(self.active)
+            frames = sys._current_frames()
+            for profile in active:
+                for ident in list(profile.threads):
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        profile.samples[_fold(frame)] += 1
+            del frames
+            time.sleep(interval)
+
+def _fold(frame) -> str:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    stack.reverse()
+    return ";".join(stack)
+
+sampler = _Sampler()
+
+def get_profile(profile_id: str) -> Optional[Profile]:
+    return sampler.finished.get(profile_id)
+
+class InstrumentationMiddleware:
+    """ASGI middleware recording latency, sizes and phases of every HTTP request"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        profile = Profile() if PROFILING_ENABLED and headers.get(b"x-profile", b"0") not in (b"", b"0") else None
+        timings = RequestTimings(profile)
+        token = _current.set(timings)
+        if profile is not None:
+            profile.threads.add(threading.get_ident())
+            sampler.start(profile)
+        started = time.perf_counter()
+        status, sent = 500, 0
+
+        async def instrumented_send(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                server_timing = ", ".join(
+                    f"{name};dur={seconds * 1000:.3f}" for name, seconds in timings.phases.items()
+                )
+                extra = [(b"server-timing", server_timing.encode())] if server_timing else []
+                if profile is not None:
+                    extra.append((b"x-profile-id", profile.id.encode()))
+                if extra:
+                    message = {**message, "headers": list(message.get("headers", [])) + extra}
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, instrumented_send)
+        finally:
+            elapsed = time.perf_counter() - started
+            if profile is not None:
+                sampler.stop(profile)
+            _current.reset(token)
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            method = scope["method"]
+            REQUEST_DURATION.observe((method, path, str(status)), elapsed)
+            RESPONSE_SIZE.observe((method, path), sent)
+            length = headers.get(b"content-length")
+            if length is not None and length.isdigit():
+                REQUEST_SIZE.observe((method, path), int(length))
+            for name, seconds in timings.phases.items():
+                PHASE_DURATION.observe((path, name), seconds)
+
+def render(gauges: Dict[str, Tuple[str, float]], counters: Dict[str, Tuple[str, float]]) -> str:
+    """Prometheus text exposition of every metric plus ``gauges`` and ``counters`` (name -> (help, value))"""
+    lines = []
+    for metric in (REQUEST_DURATION, REQUEST_SIZE, RESPONSE_SIZE, PHASE_DURATION, DB_QUERIES, SESSIONS_OPENED, SESSIONS_CLOSED):
+        lines.extend(metric.render())
+    for kind, values in (("gauge", gauges), ("counter", counters)):
+        for name, (documentation, value) in values.items():
+            lines.extend((f"# HELP {name} {documentation}", f"# TYPE {name} {kind}", f"{name} {value}"))
+    return "\n".join(lines) + "\n"
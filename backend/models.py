@@ -1,6 +1,7 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
-from datetime import datetime
+from typing import List, Optional, Dict, Any, Literal, Union
+from typing_extensions import Annotated
+from datetime import date, datetime
 import uuid
 
 class NodeData(BaseModel):
@@ -66,6 +67,23 @@ class JourneyCreate(BaseModel):
     fhir_version: str = "R4"
     fhir_plan_definition_id: Optional[str] = None
 
+class JourneyImport(JourneyCreate):
+    """One NDJSON line of POST /api/journeys/import; lines from the export also qualify"""
+    id: Optional[str] = None  # upsert key; a new id is generated when missing
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+class ImportLineError(BaseModel):
+    line: int
+    error: str
+
+class ImportReport(BaseModel):
+    created: int = 0
+    updated: int = 0
+    unchanged: int = 0  # upserts identical to the stored journey
+    failed: int = 0
+    errors: List[ImportLineError] = []  # capped, see ``failed`` for the full count
+
 class JourneyUpdate(BaseModel):
     name: Optional[str] = None
     description: Optional[str] = None
@@ -88,12 +106,293 @@ class JourneyResponse(BaseModel):
     bpmn_version: str = "2.0"
     fhir_version: str = "R4"
     fhir_plan_definition_id: Optional[str] = None
+    version: int = 1
     created_at: datetime
     updated_at: datetime
     
     class Config:
         from_attributes = True
 
+# Incremental graph edits for PATCH /api/journeys/{id}
+class AddNodeOperation(BaseModel):
+    op: Literal["add_node"]
+    node: NodeData
+
+class UpdateNodeOperation(BaseModel):
+    op: Literal["update_node"]
+    id: str
+    type: Optional[str] = None
+    position: Optional[Dict[str, float]] = None
+    data: Optional[Dict[str, Any]] = None  # merged key by key into the node's data
+
+class MoveNodeOperation(BaseModel):
+    op: Literal["move_node"]
+    id: str
+    position: Dict[str, float]
+
+class RemoveNodeOperation(BaseModel):
+    op: Literal["remove_node"]
+    id: str  # edges attached to the node are removed too
+
+class AddEdgeOperation(BaseModel):
+    op: Literal["add_edge"]
+    edge: EdgeData
+
+class UpdateEdgeOperation(BaseModel):
+    op: Literal["update_edge"]
+    id: str
+    source: Optional[str] = None
+    target: Optional[str] = None
+    type: Optional[str] = None
+    animated: Optional[bool] = None
+    label: Optional[str] = None
+
+class RemoveEdgeOperation(BaseModel):
+    op: Literal["remove_edge"]
+    id: str
+
+PatchOperation = Annotated[
+    Union[
+        AddNodeOperation, UpdateNodeOperation, MoveNodeOperation, RemoveNodeOperation,
+        AddEdgeOperation, UpdateEdgeOperation, RemoveEdgeOperation,
+    ],
+    Field(discriminator="op"),
+]
+
+class JourneyPatch(BaseModel):
+    base_version: Optional[int] = None  # alternative to the If-Match header
+    name: Optional[str] = None
+    description: Optional[str] = None
+    operations: List[PatchOperation] = []
+
+class JourneyPatchResult(BaseModel):
+    id: str
+    version: int
+    updated_at: datetime
+
+class JourneySummary(BaseModel):
+    id: str
+    name: str
+    description: Optional[str]
+    node_count: int
+    edge_count: int
+    version: int
+    created_at: datetime
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class NodeMatch(BaseModel):
+    journey_id: str
+    journey_name: str
+    node_id: str
+    type: str
+    stage_type: Optional[str] = None
+    department: Optional[str] = None
+    label: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+# Structural BPMN validation (GET /api/journeys/{id}/validation, POST /api/validate)
+class JourneyGraph(BaseModel):
+    nodes: List[NodeData] = []
+    edges: List[EdgeData] = []
+
+class ValidationIssue(BaseModel):
+    code: str  # missing_start_event, unreachable_node, dead_end, dangling_edge, cycle_without_exit...
+    severity: str  # error, warning
+    message: str
+    node_id: Optional[str] = None
+    edge_id: Optional[str] = None
+    related: List[str] = []  # other node ids involved, e.g. the members of a cycle
+
+class ValidationReport(BaseModel):
+    valid: bool  # no errors; warnings are allowed
+    error_count: int
+    warning_count: int
+    issues: List[ValidationIssue]
+
+class JourneyValidation(BaseModel):
+    journey_id: str
+    version: int
+    valid: bool
+    error_count: int
+    warning_count: int
+    issues: List[ValidationIssue]
+
+class SearchHit(BaseModel):
+    journey_id: str
+    journey_name: str
+    node_id: str
+    label: Optional[str] = None
+    department: Optional[str] = None
+    snippet: str  # best matching fragment, matches wrapped in <mark></mark>
+    score: float  # bm25 rank, lower is better
+
+    class Config:
+        from_attributes = True
+
+# Similar journeys (GET /api/journeys/{id}/similar)
+class SimilarJourney(BaseModel):
+    id: str
+    name: str
+    node_count: int
+    updated_at: datetime
+    similarity: float  # estimated Jaccard similarity of stage sequences, stage/department pairs and node text
+
+# Revision history (GET /api/journeys/{id}/revisions...)
+class RevisionSummary(BaseModel):
+    revision: int
+    keyframe: bool
+    created_at: datetime
+    changed_fields: List[str] = []  # name, description, care_gaps, metrics, clinical_outcomes, fhir_plan_definition_id
+    node_changes: int = 0  # nodes added, modified or removed
+    edge_changes: int = 0
+
+class JourneyRevisionResponse(BaseModel):
+    journey_id: str
+    revision: int
+    created_at: datetime
+    name: str
+    description: Optional[str]
+    nodes: List[NodeData]
+    edges: List[EdgeData]
+    care_gaps: Optional[List[CareGap]] = []
+    metrics: Optional[List[Metric]] = []
+    clinical_outcomes: Optional[List[ClinicalOutcome]] = []
+    fhir_plan_definition_id: Optional[str] = None
+
+class FieldChange(BaseModel):
+    field: str
+    before: Any = None
+    after: Any = None
+
+class ElementDiff(BaseModel):
+    added: List[str] = []
+    removed: List[str] = []
+    changed: List[str] = []
+
+class RevisionDiff(BaseModel):
+    journey_id: str
+    from_revision: int
+    to_revision: int
+    fields: List[FieldChange]
+    nodes: ElementDiff
+    edges: ElementDiff
+
+# Critical-path analysis (GET /api/journeys/{id}/analysis); times are in minutes
+class DurationSummary(BaseModel):
+    min_minutes: float
+    max_minutes: float
+    expected_minutes: float
+
+class StageSchedule(BaseModel):
+    node_id: str
+    label: Optional[str] = None
+    department: Optional[str] = None
+    responsible: Optional[str] = None
+    duration_text: Optional[str] = None
+    duration_parsed: bool
+    duration_min: float
+    duration_max: float
+    duration_expected: float
+    earliest_start: float
+    earliest_finish: float
+    latest_start: float
+    latest_finish: float
+    slack: float
+    critical: bool
+
+class StageLoad(BaseModel):
+    name: str
+    stage_count: int = 0
+    critical_stage_count: int = 0
+    min_minutes: float = 0.0
+    max_minutes: float = 0.0
+    expected_minutes: float = 0.0
+
+class JourneyAnalysis(BaseModel):
+    journey_id: str
+    version: int
+    total_duration: DurationSummary
+    critical_path: List[str]
+    stages: List[StageSchedule]
+    departments: List[StageLoad]
+    responsibles: List[StageLoad]
+    unparsed_durations: List[str] = []  # node ids whose duration is not quantitative
+    cycle_nodes: List[str] = []  # node ids on cycles, left out of the schedule
+
+# Monte Carlo patient-flow simulation (POST /api/journeys/{id}/simulate)
+class SimulationRequest(BaseModel):
+    patients: int = Field(10000, ge=1, le=2_000_000)
+    seed: Optional[int] = Field(None, ge=0)
+    arrival_rate_per_hour: Optional[float] = Field(None, gt=0)  # None: everyone enters at t=0, no queues form
+    branch_probabilities: Dict[str, float] = {}  # edge id -> probability, overrides edge labels
+    percentiles: List[Annotated[float, Field(ge=0, le=100)]] = [50, 90, 95, 99]
+
+class PercentileTable(BaseModel):
+    count: int
+    mean: float
+    percentiles: Dict[str, float]  # "p50" -> minutes
+
+class StageSimulation(BaseModel):
+    node_id: str
+    label: Optional[str] = None
+    visits: int
+    visit_rate: float
+    mean_service_minutes: float
+    capacity: Optional[int] = None
+    queue_wait: Optional[PercentileTable] = None  # only for stages with a capacity
+
+class SimulationResult(BaseModel):
+    journey_id: str
+    version: int
+    patients: int
+    completed: int
+    shards: int
+    seed: int
+    end_to_end: PercentileTable
+    stages: List[StageSimulation]
+    unparsed_durations: List[str] = []
+    cycle_nodes: List[str] = []
+    elapsed_seconds: float
+
+# Portfolio analytics rollups (GET /api/analytics/summary)
+class CareGapRollup(BaseModel):
+    gap_type: str
+    severity: str
+    count: int
+
+class MetricRollup(BaseModel):
+    metric_name: str
+    count: int
+    status_counts: Dict[str, int]
+    critical_share: float  # share of these metrics with status "critical"
+    mean_value: float
+    mean_target: Optional[float] = None
+
+class OutcomeRollup(BaseModel):
+    outcome_type: str
+    count: int
+    trend_counts: Dict[str, int]
+    mean_current_value: float
+    mean_target_value: Optional[float] = None
+
+class AnalyticsPeriod(BaseModel):
+    period: Optional[str] = None  # "2024-05-01" (day, or Monday of the week), "2024-05" (month); None when not grouped
+    journeys: int
+    care_gaps: List[CareGapRollup]
+    metrics: List[MetricRollup]
+    outcomes: List[OutcomeRollup]
+
+class AnalyticsSummary(BaseModel):
+    since: Optional[date] = None
+    until: Optional[date] = None
+    group_by: str
+    periods: List[AnalyticsPeriod]
+
 class TemplateResponse(BaseModel):
     id: str
     name: str
@@ -102,3 +401,8 @@ class TemplateResponse(BaseModel):
     edges: List[EdgeData]
     bpmn_compliant: bool = True
     fhir_compliant: bool = True
+
+class TemplateInstantiate(BaseModel):
+    """Body of POST /api/templates/{id}/instantiate; the template's name and description by default"""
+    name: Optional[str] = None
+    description: Optional[str] = None
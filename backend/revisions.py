@@ -0,0 +1,233 @@
+"""Revision history of journeys as keyframes plus node/edge-level deltas.
+
+Every write stores what changed against the previous revision: the replaced
+top-level fields and, for nodes and edges, the elements that were added or
+modified and the ids that were removed. Every ``KEYFRAME_INTERVAL``
+revisions a full snapshot is stored instead, so rebuilding any revision
+applies fewer than ``KEYFRAME_INTERVAL`` deltas to one keyframe, and storage
+grows with the size of the edits plus one snapshot per interval.
+"""
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import json
+import os
+
+from sqlalchemy.orm import Session
+
+from database import Journey, JourneyRevision
+from models import ElementDiff, FieldChange, JourneyRevisionResponse, RevisionDiff, RevisionSummary
+
+KEYFRAME_INTERVAL = int(os.environ.get("JOURNEY_KEYFRAME_INTERVAL", "20"))
+
+# JourneyResponse field -> Journey column, for everything except nodes/edges
+_FIELD_COLUMNS = {
+    "name": "name",
+    "description": "description",
+    "care_gaps": "care_gaps_data",
+    "metrics": "metrics_data",
+    "clinical_outcomes": "outcomes_data",
+    "fhir_plan_definition_id": "fhir_plan_definition_id",
+}
+_JSON_FIELDS = {"care_gaps", "metrics", "clinical_outcomes"}
+
+def _field_value(journey: Journey, field: str):
+    value = getattr(journey, _FIELD_COLUMNS[field])
+    return json.loads(value or "[]") if field in _JSON_FIELDS else value
+
+def journey_state(journey: Journey) -> dict:
+    """Full snapshot of the stored journey, as kept in a keyframe"""
+    state = {field: _field_value(journey, field) for field in _FIELD_COLUMNS}
+    state["nodes"] = json.loads(journey.nodes_data)
+    state["edges"] = json.loads(journey.edges_data)
+    return state
+
+def capture_fields(journey: Journey) -> Dict[str, Optional[str]]:
+    """Raw column values of the non-graph fields, taken before a write"""
+    return {field: getattr(journey, column) for field, column in _FIELD_COLUMNS.items()}
+
+def field_changes(before: Dict[str, Optional[str]], journey: Journey) -> dict:
+    """The non-graph fields whose stored value differs from ``before``"""
+    return {
+        field: _field_value(journey, field)
+        for field, column in _FIELD_COLUMNS.items()
+        if getattr(journey, column) != before[field]
+    }
+
+def diff_elements(old: List[dict], new: List[dict]) -> Optional[dict]:
+    """Changes turning the node (or edge) list ``old`` into ``new``, or None if equal"""
+    old_by_id = {element["id"]: element for element in old}
+    new_ids = {element["id"] for element in new}
+    changes = {
+        "upsert": [element for element in new if old_by_id.get(element["id"]) != element],
+        "remove": [element["id"] for element in old if element["id"] not in new_ids],
+    }
+    # Replaying keeps survivors in place and appends new elements; record the
+    # order only when the new list was rearranged in some other way
+    replayed = [element_id for element_id in old_by_id if element_id in new_ids]
+    replayed += [element["id"] for element in new if element["id"] not in old_by_id]
+    if replayed != [element["id"] for element in new]:
+        changes["order"] = [element["id"] for element in new]
+    elif not changes["upsert"] and not changes["remove"]:
+        return None
+    return changes
+
+def touched_elements(elements: List[dict], touched: set) -> Optional[dict]:
+    """Changes of a patch that touched the ids in ``touched`` of the final list ``elements``"""
+    if not touched:
+        return None
+    upsert = [element for element in elements if element["id"] in touched]
+    present = {element["id"] for element in upsert}
+    return {"upsert": upsert, "remove": sorted(touched - present)}
+
+def _apply_elements(elements: List[dict], changes: dict) -> List[dict]:
+    index = {element["id"]: i for i, element in enumerate(elements)}
+    for element in changes.get("upsert", []):
+        i = index.get(element["id"])
+        if i is None:
+            index[element["id"]] = len(elements)
+            elements.append(element)
+        else:
+            elements[i] = element
+    removed = set(changes.get("remove", []))
+    if removed:
+        elements = [element for element in elements if element["id"] not in removed]
+    if "order" in changes:
+        by_id = {element["id"]: element for element in elements}
+        elements = [by_id[element_id] for element_id in changes["order"]]
+    return elements
+
+def _apply_delta(state: dict, delta: dict):
+    state.update(delta.get("fields", {}))
+    for kind in ("nodes", "edges"):
+        if kind in delta:
+            state[kind] = _apply_elements(state[kind], delta[kind])
+
+def record_revision(db: Session, journey: Journey, changes: Optional[dict] = None):
+    """Store revision ``journey.version``; call after the flush that assigned the version.
+
+    ``changes`` holds ``fields``/``nodes``/``edges`` against the previous
+    version; ``None`` means the previous state is unknown and forces a keyframe.
+    A keyframe is also written when the previous revision is missing (history
+    started after the journey) or the chain reached ``KEYFRAME_INTERVAL``.
+    """
+    last = (
+        db.query(JourneyRevision.revision, JourneyRevision.base_revision)
+        .filter(JourneyRevision.journey_id == journey.id)
+        .order_by(JourneyRevision.revision.desc())
+        .first()
+    )
+    keyframe = (
+        changes is None
+        or last is None
+        or last.revision != journey.version - 1
+        or journey.version - last.base_revision >= KEYFRAME_INTERVAL
+    )
+    state = journey_state(journey) if keyframe else None
+    if changes is None:
+        changes = {"nodes": {"upsert": state["nodes"]}, "edges": {"upsert": state["edges"]}}
+    data = state if keyframe else changes
+
+    def count(kind):
+        element_changes = changes.get(kind) or {}
+        return len(element_changes.get("upsert", [])) + len(element_changes.get("remove", []))
+
+    db.add(JourneyRevision(
+        journey_id=journey.id,
+        revision=journey.version,
+        base_revision=journey.version if keyframe else last.base_revision,
+        keyframe=keyframe,
+        data=json.dumps(data),
+        changed_fields=",".join(changes.get("fields", {})),
+        node_changes=count("nodes"),
+        edge_changes=count("edges"),
+    ))
+
+def delete_revisions(db: Session, journey_id: str):
+    db.query(JourneyRevision).filter(JourneyRevision.journey_id == journey_id).delete(synchronize_session=False)
+
+def list_revisions(
+    db: Session, journey_id: str, limit: int = 100, before: Optional[int] = None
+) -> List[RevisionSummary]:
+    """Newest first, without reading the stored snapshots or deltas"""
+    query = db.query(
+        JourneyRevision.revision, JourneyRevision.keyframe, JourneyRevision.created_at,
+        JourneyRevision.changed_fields, JourneyRevision.node_changes, JourneyRevision.edge_changes,
+    ).filter(JourneyRevision.journey_id == journey_id)
+    if before is not None:
+        query = query.filter(JourneyRevision.revision < before)
+    rows = query.order_by(JourneyRevision.revision.desc()).limit(limit).all()
+    return [
+        RevisionSummary(
+            revision=row.revision,
+            keyframe=row.keyframe,
+            created_at=row.created_at,
+            changed_fields=row.changed_fields.split(",") if row.changed_fields else [],
+            node_changes=row.node_changes,
+            edge_changes=row.edge_changes,
+        )
+        for row in rows
+    ]
+
+def _reconstruct(db: Session, journey_id: str, revision: int) -> Optional[Tuple[dict, datetime]]:
+    target = (
+        db.query(JourneyRevision.base_revision, JourneyRevision.created_at)
+        .filter(JourneyRevision.journey_id == journey_id, JourneyRevision.revision == revision)
+        .first()
+    )
+    if target is None:
+        return None
+    rows = (
+        db.query(JourneyRevision.data)
+        .filter(
+            JourneyRevision.journey_id == journey_id,
+            JourneyRevision.revision >= target.base_revision,
+            JourneyRevision.revision <= revision,
+        )
+        .order_by(JourneyRevision.revision)
+        .all()
+    )
+    state = json.loads(rows[0].data)
+    for row in rows[1:]:
+        _apply_delta(state, json.loads(row.data))
+    return state, target.created_at
+
+def get_revision(db: Session, journey_id: str, revision: int) -> Optional[JourneyRevisionResponse]:
+    """The journey as it was saved in ``revision``"""
+    reconstructed = _reconstruct(db, journey_id, revision)
+    if reconstructed is None:
+        return None
+    state, created_at = reconstructed
+    return JourneyRevisionResponse(journey_id=journey_id, revision=revision, created_at=created_at, **state)
+
+def _element_diff(old: List[dict], new: List[dict]) -> ElementDiff:
+    old_by_id = {element["id"]: element for element in old}
+    new_ids = {element["id"] for element in new}
+    return ElementDiff(
+        added=[element["id"] for element in new if element["id"] not in old_by_id],
+        removed=[element["id"] for element in old if element["id"] not in new_ids],
+        changed=[
+            element["id"] for element in new
+            if element["id"] in old_by_id and old_by_id[element["id"]] != element
+        ],
+    )
+
+def diff_revisions(db: Session, journey_id: str, from_revision: int, to_revision: int) -> Optional[RevisionDiff]:
+    """Fields, nodes and edges that differ between two revisions"""
+    old = _reconstruct(db, journey_id, from_revision)
+    new = _reconstruct(db, journey_id, to_revision)
+    if old is None or new is None:
+        return None
+    old_state, new_state = old[0], new[0]
+    return RevisionDiff(
+        journey_id=journey_id,
+        from_revision=from_revision,
+        to_revision=to_revision,
+        fields=[
+            # .get: keyframes written before a field existed lack it
+            FieldChange(field=field, before=old_state.get(field), after=new_state.get(field))
+            for field in _FIELD_COLUMNS
+            if old_state.get(field) != new_state.get(field)
+        ],
+        nodes=_element_diff(old_state["nodes"], new_state["nodes"]),
+        edges=_element_diff(old_state["edges"], new_state["edges"]),
+    )
@@ -0,0 +1,178 @@
+"""Incrementally maintained portfolio analytics (the analytics_rollups table).
+
+Each journey contributes additive totals (counts, value and target sums) to
+the rows of its creation day. Writes compute the contributions of the row
+before and after the change and apply only the difference, in the same
+transaction, so ``summarize`` reads a table whose size depends on the number
+of days and categories, not on the number of journeys.
+"""
+from collections import defaultdict
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+import json
+
+from sqlalchemy import func, literal
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from database import AnalyticsRollup, Journey
+from models import AnalyticsPeriod, AnalyticsSummary, CareGapRollup, MetricRollup, OutcomeRollup
+
+RollupKey = Tuple[str, str, str, date]
+# count, value_sum, target_sum, target_count
+Contributions = Dict[RollupKey, List[float]]
+
+GROUP_BY = ("none", "day", "week", "month")
+
+def journey_rollups(journey: Optional[Journey]) -> Contributions:
+    """What one stored journey (or a row with the same columns) adds to the rollups; empty for ``None``"""
+    totals: Contributions = defaultdict(lambda: [0, 0.0, 0.0, 0])
+    if journey is None:
+        return totals
+    day = journey.created_at.date()
+    totals[("journey", "", "", day)][0] += 1
+    for gap in json.loads(journey.care_gaps_data or "[]"):
+        totals[("care_gap", gap["gap_type"], gap["severity"], day)][0] += 1
+    for metric in json.loads(journey.metrics_data or "[]"):
+        row = totals[("metric", metric["metric_name"], metric["status"], day)]
+        row[0] += 1
+        row[1] += metric["value"]
+        if metric.get("target_value") is not None:
+            row[2] += metric["target_value"]
+            row[3] += 1
+    for outcome in json.loads(journey.outcomes_data or "[]"):
+        row = totals[("outcome", outcome["outcome_type"], outcome["trend"], day)]
+        row[0] += 1
+        row[1] += outcome["current_value"]
+        row[2] += outcome["target_value"]
+        row[3] += 1
+    return totals
+
+def apply_rollups(db: Session, before: Contributions, after: Contributions):
+    """Add ``after - before`` to the stored rollups with one upsert per changed row"""
+    delta: Contributions = defaultdict(lambda: [0, 0.0, 0.0, 0])
+    for sign, contributions in ((1, after), (-1, before)):
+        for key, values in contributions.items():
+            row = delta[key]
+            for i, value in enumerate(values):
+                row[i] += sign * value
+
+    rows = [
+        {
+            "dimension": dimension, "key": key, "subkey": subkey, "day": day,
+            "count": count, "value_sum": value_sum, "target_sum": target_sum, "target_count": target_count,
+        }
+        for (dimension, key, subkey, day), (count, value_sum, target_sum, target_count) in delta.items()
+        if count or value_sum or target_sum or target_count
+    ]
+    if not rows:
+        return
+    table = AnalyticsRollup.__table__
+    # Both dialects spell the upsert the same way
+    insert = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+    statement = insert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.dimension, table.c.key, table.c.subkey, table.c.day],
+        set_={
+            column: table.c[column] + statement.excluded[column]
+            for column in ("count", "value_sum", "target_sum", "target_count")
+        },
+    )
+    db.execute(statement, rows)
+
+def rebuild_rollups(db: Session, batch_size: int = 200) -> int:
+    """Recompute every rollup from the journey rows; returns the journey count"""
+    db.query(AnalyticsRollup).delete(synchronize_session=False)
+    totals: Contributions = defaultdict(lambda: [0, 0.0, 0.0, 0])
+    count = 0
+    query = db.query(Journey.created_at, Journey.care_gaps_data, Journey.metrics_data, Journey.outcomes_data)
+    for journey in query.yield_per(batch_size):
+        for key, values in journey_rollups(journey).items():
+            row = totals[key]
+            for i, value in enumerate(values):
+                row[i] += value
+        count += 1
+    apply_rollups(db, {}, totals)
+    db.commit()
+    return count
+
+def _period(group_by: str, dialect: str):
+    """Label of the day, week (its Monday) or month of a rollup row, in SQL of ``dialect``"""
+    day = AnalyticsRollup.day
+    if group_by == "none":
+        return literal(None)
+    if dialect == "postgresql":
+        if group_by == "week":
+            # date_trunc weeks start on Monday (ISO 8601)
+            return func.to_char(func.date_trunc("week", day), "YYYY-MM-DD")
+        return func.to_char(day, "YYYY-MM" if group_by == "month" else "YYYY-MM-DD")
+    if group_by == "week":
+        return func.date(day, "-6 days", "weekday 1")
+    return func.strftime("%Y-%m" if group_by == "month" else "%Y-%m-%d", day)
+
+def summarize(
+    db: Session, since: Optional[date] = None, until: Optional[date] = None, group_by: str = "none"
+) -> AnalyticsSummary:
+    """Portfolio totals of journeys created between ``since`` and ``until`` (inclusive)"""
+    period = _period(group_by, db.get_bind().dialect.name).label("period")
+    query = db.query(
+        period, AnalyticsRollup.dimension, AnalyticsRollup.key, AnalyticsRollup.subkey,
+        func.sum(AnalyticsRollup.count), func.sum(AnalyticsRollup.value_sum),
+        func.sum(AnalyticsRollup.target_sum), func.sum(AnalyticsRollup.target_count),
+    )
+    if since is not None:
+        query = query.filter(AnalyticsRollup.day >= since)
+    if until is not None:
+        query = query.filter(AnalyticsRollup.day <= until)
+    rows = (
+        query.group_by(period, AnalyticsRollup.dimension, AnalyticsRollup.key, AnalyticsRollup.subkey)
+        .order_by(period, AnalyticsRollup.dimension, AnalyticsRollup.key, AnalyticsRollup.subkey)
+        .all()
+    )
+
+    periods: Dict[Optional[str], dict] = {}
+    for period_key, dimension, key, subkey, count, value_sum, target_sum, target_count in rows:
+        if count <= 0:
+            continue
+        current = periods.setdefault(period_key, {"journeys": 0, "care_gaps": [], "metrics": {}, "outcomes": {}})
+        if dimension == "journey":
+            current["journeys"] += count
+        elif dimension == "care_gap":
+            current["care_gaps"].append(CareGapRollup(gap_type=key, severity=subkey, count=count))
+        else:
+            # metric and outcome rows are split by status/trend; merge them per name/type
+            total = current[dimension + "s"].setdefault(key, {"count": 0, "by": {}, "value": 0.0, "target": 0.0, "targets": 0})
+            total["count"] += count
+            total["by"][subkey] = count
+            total["value"] += value_sum
+            total["target"] += target_sum
+            total["targets"] += target_count
+
+    result = []
+    for period_key, current in periods.items():
+        metrics = [
+            MetricRollup(
+                metric_name=name,
+                count=total["count"],
+                status_counts=total["by"],
+                critical_share=total["by"].get("critical", 0) / total["count"],
+                mean_value=total["value"] / total["count"],
+                mean_target=total["target"] / total["targets"] if total["targets"] else None,
+            )
+            for name, total in current["metrics"].items()
+        ]
+        outcomes = [
+            OutcomeRollup(
+                outcome_type=outcome_type,
+                count=total["count"],
+                trend_counts=total["by"],
+                mean_current_value=total["value"] / total["count"],
+                mean_target_value=total["target"] / total["targets"] if total["targets"] else None,
+            )
+            for outcome_type, total in current["outcomes"].items()
+        ]
+        result.append(AnalyticsPeriod(
+            period=period_key, journeys=current["journeys"],
+            care_gaps=current["care_gaps"], metrics=metrics, outcomes=outcomes,
+        ))
+    return AnalyticsSummary(since=since, until=until, group_by=group_by, periods=result)
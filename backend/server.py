@@ -1,31 +1,82 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException
+from fastapi import FastAPI, APIRouter, Depends, Header, HTTPException, Query, Request, Response, WebSocket
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.routing import APIRoute
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 import os
 import logging
 from pathlib import Path
-from typing import List
-import uuid
+from datetime import date, datetime
+from typing import List, Literal, Optional, Union
+from contextvars import ContextVar
+import base64
+import binascii
+import functools
 import json
+import time
+import zlib
 
-from database import init_db, get_db, Journey
+import crud
+import database
+import metrics
+from analysis import analyze_journey
+from simulation import run_simulation
+from validation import validate_graph
+from rollups import GROUP_BY, summarize
+import revisions
+import exports
+import similarity
+import templates
+from collaboration import hub
+from cache import response_cache
+from database import init_db, get_db, iterate_in_db_thread, AsyncDB
 from models import (
-    JourneyCreate, JourneyUpdate, JourneyResponse, TemplateResponse, 
-    NodeData, EdgeData, CareGap, Metric, ClinicalOutcome
+    JourneyCreate, JourneyUpdate, JourneyResponse, JourneySummary, NodeMatch, TemplateResponse,
+    JourneyPatch, JourneyPatchResult, ImportReport, JourneyAnalysis, SimulationRequest, SimulationResult,
+    JourneyGraph, JourneyValidation, ValidationReport, SearchHit, AnalyticsSummary,
+    RevisionSummary, JourneyRevisionResponse, RevisionDiff, SimilarJourney, TemplateInstantiate
 )
-from sqlalchemy.orm import Session
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # Initialize database
 init_db()
+# Templates are read once; GET /api/templates serves the registry's encoded body
+template_registry = templates.load_templates()
 
 # Create the main app without a prefix
 app = FastAPI()
 
+# Reading and validating the request, up to the endpoint call, is its ``validation`` phase
+_handler_started: ContextVar[Optional[float]] = ContextVar("handler_started", default=None)
+
+class TimedRoute(APIRoute):
+    """APIRoute that times body parsing, parameter and dependency resolution
+    and the Pydantic validation FastAPI runs before calling the endpoint"""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        @functools.wraps(endpoint)
+        async def timed_endpoint(*args, **values):
+            started = _handler_started.get()
+            if started is not None:
+                metrics.add_phase("validation", time.perf_counter() - started)
+            return await endpoint(*args, **values)
+
+        super().__init__(path, timed_endpoint, **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def timed_handler(request: Request) -> Response:
+            _handler_started.set(time.perf_counter())
+            return await handler(request)
+
+        return timed_handler
+
 # Create a router with the /api prefix
-api_router = APIRouter(prefix="/api")
+api_router = APIRouter(prefix="/api", route_class=TimedRoute)
 
 # Add your routes to the router instead of directly to app
 @api_router.get("/")
@@ -33,346 +84,545 @@ async def root():
     return {"message": "Patient Journey Designer API"}
 
 # Journey CRUD endpoints
+async def _run_json(db: AsyncDB, fn, *args, write: bool = False) -> Optional[Response]:
+    """Run a crud function and JSON-encode its result, both on the DB thread.
+
+    ``write`` sends it through the group-commit write queue instead. Returns
+    ``None`` when the crud function found nothing.
+    """
+    def call(session):
+        result = fn(session, *args)
+        if result is None:
+            return None
+        version = getattr(result, "version", None)
+        content = crud.encode_json(result)
+        if isinstance(result, crud.EncodedJourney):
+            # Write-through: the next GET of this version is a cache hit
+            response_cache.put((result.id, version), content)
+        return content, version
+
+    result = await (db.write(call) if write else db.run(call))
+    if result is None:
+        return None
+    content, version = result
+    response = Response(content=content, media_type="application/json")
+    if version is not None:
+        response.headers["ETag"] = _etag(version)
+    return response
+
+# Optimistic concurrency: the journey version is the entity tag
+def _etag(version: int) -> str:
+    return f'"{version}"'
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison as RFC 9110 prescribes for If-None-Match"""
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = (tag.strip() for tag in if_none_match.split(","))
+    return etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+def _not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
+
+def _parse_if_match(if_match: Optional[str]) -> Optional[int]:
+    """Return the version a client expects, or None for no precondition"""
+    if if_match is None or if_match.strip() == "*":
+        return None
+    tag = if_match.split(",")[0].strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    try:
+        return int(tag.strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="If-Match must be a journey version ETag")
+
+async def _run_versioned(db: AsyncDB, fn, *args) -> Optional[Response]:
+    try:
+        return await _run_json(db, fn, *args, write=True)
+    except crud.VersionConflict as conflict:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Journey was modified concurrently (current version {conflict.current_version})",
+            headers={"ETag": _etag(conflict.current_version)},
+        )
+    except crud.PatchError as error:
+        raise HTTPException(status_code=422, detail=str(error))
+
 @api_router.post("/journeys", response_model=JourneyResponse)
-async def create_journey(journey: JourneyCreate, db: Session = Depends(get_db)):
+async def create_journey(journey: JourneyCreate, db: AsyncDB = Depends(get_db)):
     """Create a new patient journey"""
-    journey_id = str(uuid.uuid4())
-    
-    db_journey = Journey(
-        id=journey_id,
-        name=journey.name,
-        description=journey.description,
-        nodes_data=json.dumps([node.model_dump() for node in journey.nodes]),
-        edges_data=json.dumps([edge.model_dump() for edge in journey.edges]),
-        care_gaps_data=json.dumps([gap.model_dump() for gap in (journey.care_gaps or [])]),
-        metrics_data=json.dumps([metric.model_dump() for metric in (journey.metrics or [])]),
-        outcomes_data=json.dumps([outcome.model_dump() for outcome in (journey.clinical_outcomes or [])])
+    return await _run_json(db, crud.create_journey, journey, write=True)
+
+# Listing pagination helpers
+def _encode_cursor(updated_at: datetime, journey_id: str) -> str:
+    raw = json.dumps([updated_at.isoformat(), journey_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        updated_at, journey_id = json.loads(raw)
+        return datetime.fromisoformat(updated_at), str(journey_id)
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@api_router.get("/journeys", response_model=Union[List[JourneySummary], List[JourneyResponse]])
+async def get_all_journeys(
+    request: Request,
+    fields: str = Query("full", pattern="^(full|summary)$"),
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None,
+    name: Optional[str] = None,
+    updated_since: Optional[datetime] = None,
+    db: AsyncDB = Depends(get_db),
+):
+    """Get patient journeys, newest first.
+
+    ``fields=summary`` returns counts instead of the graph and never reads the
+    ``*_data`` columns. With ``limit`` the page is keyset-paginated on
+    ``(updated_at, id)``; the next page's cursor is sent in ``X-Next-Cursor``.
+    """
+    updated_since = crud.naive_utc(updated_since)
+    cursor_key = _decode_cursor(cursor) if cursor else None
+
+    def call(session):
+        items, next_key = crud.list_journeys(session, fields, limit, cursor_key, name, updated_since)
+        return crud.encode_json(items), next_key
+
+    content, next_key = await db.run(call)
+    response = Response(content=content, media_type="application/json")
+    if next_key is not None:
+        next_cursor = _encode_cursor(*next_key)
+        response.headers["X-Next-Cursor"] = next_cursor
+        next_url = request.url.include_query_params(cursor=next_cursor)
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+    return response
+
+# Bulk NDJSON export/import; declared before /journeys/{journey_id} so the paths win
+@api_router.get("/journeys/export")
+async def export_journeys(
+    gzip: bool = False,
+    batch_size: int = Query(200, ge=1, le=5000),
+    updated_since: Optional[datetime] = None,
+):
+    """Stream every journey as NDJSON (one JourneyResponse per line), optionally gzipped"""
+    lines = iterate_in_db_thread(crud.export_journeys, batch_size, crud.naive_utc(updated_since))
+    if not gzip:
+        return StreamingResponse(lines, media_type="application/x-ndjson")
+
+    async def compressed():
+        compressor = zlib.compressobj(wbits=31)  # gzip container
+        async for chunk in lines:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+
+    return StreamingResponse(
+        compressed(),
+        media_type="application/gzip",
+        headers={"Content-Disposition": 'attachment; filename="journeys.ndjson.gz"'},
     )
-    
-    db.add(db_journey)
-    db.commit()
-    db.refresh(db_journey)
-    
-    return JourneyResponse(
-        id=db_journey.id,
-        name=db_journey.name,
-        description=db_journey.description,
-        nodes=[NodeData(**node) for node in json.loads(db_journey.nodes_data)],
-        edges=[EdgeData(**edge) for edge in json.loads(db_journey.edges_data)],
-        care_gaps=[CareGap(**gap) for gap in json.loads(db_journey.care_gaps_data or "[]")],
-        metrics=[Metric(**metric) for metric in json.loads(db_journey.metrics_data or "[]")],
-        clinical_outcomes=[ClinicalOutcome(**outcome) for outcome in json.loads(db_journey.outcomes_data or "[]")],
-        created_at=db_journey.created_at,
-        updated_at=db_journey.updated_at
+
+_EXPORT_MEDIA_TYPES = {"bpmn": "application/xml", "fhir": "application/fhir+json"}
+
+@api_router.get("/journeys/export/fhir")
+async def export_fhir_bundle(batch_size: int = Query(200, ge=1, le=5000)):
+    """Stream a FHIR R4 Bundle with the PlanDefinition and ActivityDefinitions of every journey"""
+    return StreamingResponse(
+        iterate_in_db_thread(exports.export_fhir_bundle, batch_size),
+        media_type=_EXPORT_MEDIA_TYPES["fhir"],
+        headers={"Content-Disposition": 'attachment; filename="journeys.fhir.json"'},
     )
 
-@api_router.get("/journeys", response_model=List[JourneyResponse])
-async def get_all_journeys(db: Session = Depends(get_db)):
-    """Get all patient journeys"""
-    journeys = db.query(Journey).all()
-    
-    return [
-        JourneyResponse(
-            id=j.id,
-            name=j.name,
-            description=j.description,
-            nodes=[NodeData(**node) for node in json.loads(j.nodes_data)],
-            edges=[EdgeData(**edge) for edge in json.loads(j.edges_data)],
-            care_gaps=[CareGap(**gap) for gap in json.loads(j.care_gaps_data or "[]")],
-            metrics=[Metric(**metric) for metric in json.loads(j.metrics_data or "[]")],
-            clinical_outcomes=[ClinicalOutcome(**outcome) for outcome in json.loads(j.outcomes_data or "[]")],
-            created_at=j.created_at,
-            updated_at=j.updated_at
-        )
-        for j in journeys
-    ]
+@api_router.post("/journeys/import", response_model=ImportReport)
+async def import_journeys(
+    request: Request,
+    batch_size: int = Query(500, ge=1, le=10000),
+    upsert: bool = True,
+    db: AsyncDB = Depends(get_db),
+):
+    """Load an NDJSON stream of journeys, committing every ``batch_size`` lines.
+
+    Lines are upserted by ``id``; invalid lines are reported by line number
+    and do not stop the import. Gzip bodies are detected automatically.
+    """
+    report = ImportReport()
+
+    async def flush(batch):
+        result = await db.write(crud.import_journeys, batch, upsert)
+        report.created += result.created
+        report.updated += result.updated
+        report.unchanged += result.unchanged
+        report.failed += result.failed
+        room = crud.MAX_IMPORT_ERRORS - len(report.errors)
+        report.errors.extend(result.errors[:max(room, 0)])
+
+    decompressor = None
+    pending = b""
+    line_number = 0
+    batch = []
+    async for chunk in request.stream():
+        if decompressor is None:
+            gzipped = chunk[:2] == b"\x1f\x8b" or request.headers.get("content-encoding") == "gzip"
+            decompressor = zlib.decompressobj(wbits=31) if gzipped else False
+        if decompressor:
+            try:
+                chunk = decompressor.decompress(chunk)
+            except zlib.error:
+                raise HTTPException(status_code=400, detail="Invalid gzip body")
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                batch.append((line_number, line))
+            if len(batch) >= batch_size:
+                await flush(batch)
+                batch = []
+    if pending.strip():
+        batch.append((line_number + 1, pending))
+    if batch:
+        await flush(batch)
+
+    return report
 
 @api_router.get("/journeys/{journey_id}", response_model=JourneyResponse)
-async def get_journey(journey_id: str, db: Session = Depends(get_db)):
-    """Get a specific patient journey"""
-    journey = db.query(Journey).filter(Journey.id == journey_id).first()
-    
-    if not journey:
+async def get_journey(
+    journey_id: str,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncDB = Depends(get_db),
+):
+    """Get a specific patient journey, served from the response cache when possible"""
+    def call(session):
+        version = crud.get_journey_version(session, journey_id)
+        if version is None or _etag_matches(if_none_match, _etag(version)):
+            return version, None
+        content = response_cache.get((journey_id, version))
+        if content is None:
+            journey = crud.get_journey(session, journey_id)
+            if journey is None:
+                return None, None
+            version, content = journey.version, journey.content
+            response_cache.put((journey_id, version), content)
+        return version, content
+
+    version, content = await db.run(call)
+    if version is None:
         raise HTTPException(status_code=404, detail="Journey not found")
-    
-    return JourneyResponse(
-        id=journey.id,
-        name=journey.name,
-        description=journey.description,
-        nodes=[NodeData(**node) for node in json.loads(journey.nodes_data)],
-        edges=[EdgeData(**edge) for edge in json.loads(journey.edges_data)],
-        care_gaps=[CareGap(**gap) for gap in json.loads(journey.care_gaps_data or "[]")],
-        metrics=[Metric(**metric) for metric in json.loads(journey.metrics_data or "[]")],
-        clinical_outcomes=[ClinicalOutcome(**outcome) for outcome in json.loads(journey.outcomes_data or "[]")],
-        created_at=journey.created_at,
-        updated_at=journey.updated_at
-    )
+    if content is None:
+        return _not_modified(_etag(version))
+    return Response(content=content, media_type="application/json", headers={"ETag": _etag(version)})
 
 @api_router.put("/journeys/{journey_id}", response_model=JourneyResponse)
-async def update_journey(journey_id: str, journey_update: JourneyUpdate, db: Session = Depends(get_db)):
-    """Update a patient journey"""
-    db_journey = db.query(Journey).filter(Journey.id == journey_id).first()
-    
-    if not db_journey:
+async def update_journey(
+    journey_id: str,
+    journey_update: JourneyUpdate,
+    if_match: Optional[str] = Header(None),
+    db: AsyncDB = Depends(get_db),
+):
+    """Update a patient journey; with If-Match the update fails with 409 on a stale version"""
+    response = await _run_versioned(db, crud.update_journey, journey_id, journey_update, _parse_if_match(if_match))
+    if response is None:
         raise HTTPException(status_code=404, detail="Journey not found")
-    
-    if journey_update.name is not None:
-        db_journey.name = journey_update.name
-    if journey_update.description is not None:
-        db_journey.description = journey_update.description
-    if journey_update.nodes is not None:
-        db_journey.nodes_data = json.dumps([node.model_dump() for node in journey_update.nodes])
-    if journey_update.edges is not None:
-        db_journey.edges_data = json.dumps([edge.model_dump() for edge in journey_update.edges])
-    if journey_update.care_gaps is not None:
-        db_journey.care_gaps_data = json.dumps([gap.model_dump() for gap in journey_update.care_gaps])
-    if journey_update.metrics is not None:
-        db_journey.metrics_data = json.dumps([metric.model_dump() for metric in journey_update.metrics])
-    if journey_update.clinical_outcomes is not None:
-        db_journey.outcomes_data = json.dumps([outcome.model_dump() for outcome in journey_update.clinical_outcomes])
-    
-    db.commit()
-    db.refresh(db_journey)
-    
-    return JourneyResponse(
-        id=db_journey.id,
-        name=db_journey.name,
-        description=db_journey.description,
-        nodes=[NodeData(**node) for node in json.loads(db_journey.nodes_data)],
-        edges=[EdgeData(**edge) for edge in json.loads(db_journey.edges_data)],
-        care_gaps=[CareGap(**gap) for gap in json.loads(db_journey.care_gaps_data or "[]")],
-        metrics=[Metric(**metric) for metric in json.loads(db_journey.metrics_data or "[]")],
-        clinical_outcomes=[ClinicalOutcome(**outcome) for outcome in json.loads(db_journey.outcomes_data or "[]")],
-        created_at=db_journey.created_at,
-        updated_at=db_journey.updated_at
-    )
+    return response
+
+@api_router.patch("/journeys/{journey_id}", response_model=JourneyPatchResult)
+async def patch_journey(
+    journey_id: str,
+    patch: JourneyPatch,
+    if_match: Optional[str] = Header(None),
+    db: AsyncDB = Depends(get_db),
+):
+    """Apply node/edge operations to a patient journey.
+
+    The expected version comes from If-Match or ``base_version``; a stale one
+    is rejected with 409 and the current version in the ETag header.
+    """
+    response = await _run_versioned(db, crud.patch_journey, journey_id, patch, _parse_if_match(if_match))
+    if response is None:
+        raise HTTPException(status_code=404, detail="Journey not found")
+    return response
+
+@api_router.websocket("/journeys/{journey_id}/live")
+async def journey_live(websocket: WebSocket, journey_id: str):
+    """Live editing session: snapshot on join, then operations shared with every editor
+    and stored in batches (message format in collaboration.py)"""
+    await hub.serve(websocket, journey_id)
 
 @api_router.delete("/journeys/{journey_id}")
-async def delete_journey(journey_id: str, db: Session = Depends(get_db)):
+async def delete_journey(journey_id: str, db: AsyncDB = Depends(get_db)):
     """Delete a patient journey"""
-    db_journey = db.query(Journey).filter(Journey.id == journey_id).first()
-    
-    if not db_journey:
+    if not await db.write(crud.delete_journey, journey_id):
         raise HTTPException(status_code=404, detail="Journey not found")
     
-    db.delete(db_journey)
-    db.commit()
-    
     return {"message": "Journey deleted successfully"}
 
+@api_router.get("/journeys/{journey_id}/revisions", response_model=List[RevisionSummary])
+async def list_journey_revisions(
+    journey_id: str,
+    limit: int = Query(100, ge=1, le=1000),
+    before: Optional[int] = Query(None, ge=1),
+    db: AsyncDB = Depends(get_db),
+):
+    """Saved revisions of a journey, newest first; page with ``before`` = the last revision seen"""
+    if await db.run(crud.get_journey_version, journey_id) is None:
+        raise HTTPException(status_code=404, detail="Journey not found")
+    return await _run_json(db, revisions.list_revisions, journey_id, limit, before)
+
+@api_router.get("/journeys/{journey_id}/revisions/{revision}", response_model=JourneyRevisionResponse)
+async def get_journey_revision(journey_id: str, revision: int, db: AsyncDB = Depends(get_db)):
+    """The journey as it was saved in a given revision"""
+    response = await _run_json(db, revisions.get_revision, journey_id, revision)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Revision not found")
+    return response
+
+@api_router.get("/journeys/{journey_id}/revisions/{from_revision}/diff/{to_revision}", response_model=RevisionDiff)
+async def diff_journey_revisions(journey_id: str, from_revision: int, to_revision: int, db: AsyncDB = Depends(get_db)):
+    """Fields, nodes and edges that changed between two revisions"""
+    response = await _run_json(db, revisions.diff_revisions, journey_id, from_revision, to_revision)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Revision not found")
+    return response
+
+@api_router.get("/journeys/{journey_id}/analysis", response_model=JourneyAnalysis)
+async def get_journey_analysis(
+    journey_id: str,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncDB = Depends(get_db),
+):
+    """Critical path, stage slack and department load, cached per journey version"""
+    def call(session):
+        version = crud.get_journey_version(session, journey_id)
+        if version is None or _etag_matches(if_none_match, _analysis_etag(version)):
+            return version, None
+
+        def build():
+            graph = crud.load_journey_graph(session, journey_id)
+            if graph is None:
+                raise LookupError(journey_id)  # deleted since the version check
+            return crud.encode_json(analyze_journey(journey_id, *graph))
+
+        try:
+            return version, response_cache.get_or_build((journey_id, ("analysis", version)), build)
+        except LookupError:
+            return None, None
+
+    version, content = await db.run(call)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Journey not found")
+    if content is None:
+        return _not_modified(_analysis_etag(version))
+    return Response(content=content, media_type="application/json", headers={"ETag": _analysis_etag(version)})
+
+def _analysis_etag(version: int) -> str:
+    return f'"analysis-{version}"'
+
+@api_router.get("/journeys/{journey_id}/validation", response_model=JourneyValidation)
+async def get_journey_validation(
+    journey_id: str,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncDB = Depends(get_db),
+):
+    """Structural BPMN validation report, kept up to date on every save"""
+    def call(session):
+        version = crud.get_journey_version(session, journey_id)
+        if version is None or _etag_matches(if_none_match, _validation_etag(version)):
+            return version, None
+
+        def build():
+            content = crud.get_journey_validation(session, journey_id)
+            if content is None:
+                raise LookupError(journey_id)  # deleted since the version check
+            return content
+
+        try:
+            return version, response_cache.get_or_build((journey_id, ("validation", version)), build)
+        except LookupError:
+            return None, None
+
+    version, content = await db.run(call)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Journey not found")
+    if content is None:
+        return _not_modified(_validation_etag(version))
+    return Response(content=content, media_type="application/json", headers={"ETag": _validation_etag(version)})
+
+def _validation_etag(version: int) -> str:
+    return f'"validation-{version}"'
+
+@api_router.get("/journeys/{journey_id}/similar", response_model=List[SimilarJourney])
+async def get_similar_journeys(
+    journey_id: str,
+    limit: int = Query(10, ge=1, le=100),
+    min_similarity: float = Query(0.0, ge=0, le=1),
+    db: AsyncDB = Depends(get_db),
+):
+    """Journeys with the most similar stages and node text, most similar first (see similarity.py)"""
+    response = await _run_json(db, similarity.similar_journeys, journey_id, limit, min_similarity)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Journey not found")
+    return response
+
+@api_router.get("/journeys/{journey_id}/export/{export_format}")
+async def export_journey(
+    journey_id: str,
+    export_format: Literal["bpmn", "fhir"],
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncDB = Depends(get_db),
+):
+    """BPMN 2.0 XML or FHIR R4 Bundle of a journey, streamed and cached per version"""
+    def call(session):
+        version = crud.get_journey_version(session, journey_id)
+        if version is None or _etag_matches(if_none_match, _export_etag(export_format, version)):
+            return version, None, None
+        cached = response_cache.get((journey_id, (export_format, version)))
+        if cached is not None:
+            return version, cached, None
+        document = exports.load_documents(session, [journey_id]).get(journey_id)
+        return (None, None, None) if document is None else (document.version, None, document)
+
+    version, cached, document = await db.run(call)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Journey not found")
+    headers = {"ETag": _export_etag(export_format, version)}
+    media_type = _EXPORT_MEDIA_TYPES[export_format]
+    if document is not None:
+        stream = exports.stream_bpmn(document) if export_format == "bpmn" else exports.stream_fhir(document)
+        # Rendering is CPU work without the session, so it stays off the DB thread
+        return StreamingResponse(iterate_in_threadpool(stream), media_type=media_type, headers=headers)
+    if cached is None:
+        return _not_modified(headers["ETag"])
+    if export_format == "fhir":
+        cached = b"".join(exports.fhir_bundle([[cached]]))
+    return Response(content=cached, media_type=media_type, headers=headers)
+
+def _export_etag(export_format: str, version: int) -> str:
+    return f'"{export_format}-{version}"'
+
+@api_router.post("/validate", response_model=ValidationReport)
+async def validate_journey_graph(graph: JourneyGraph):
+    """Validate an unsaved graph, e.g. before creating a journey from it"""
+    nodes = [node.model_dump() for node in graph.nodes]
+    edges = [edge.model_dump() for edge in graph.edges]
+    return await run_in_threadpool(validate_graph, nodes, edges)
+
+@api_router.post("/journeys/{journey_id}/simulate", response_model=SimulationResult)
+async def simulate_journey(journey_id: str, simulation: SimulationRequest, db: AsyncDB = Depends(get_db)):
+    """Monte Carlo simulation of patients flowing through a journey"""
+    graph = await db.run(crud.load_journey_graph, journey_id)
+    if graph is None:
+        raise HTTPException(status_code=404, detail="Journey not found")
+    version, nodes, edges = graph
+    return await run_simulation(journey_id, version, nodes, edges, simulation)
+
+@api_router.get("/nodes", response_model=List[NodeMatch])
+async def find_nodes(
+    type: Optional[str] = None,
+    stage_type: Optional[str] = None,
+    department: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    db: AsyncDB = Depends(get_db),
+):
+    """Find nodes across all journeys by type, stage type or department"""
+    if not database.NORMALIZED_STORAGE:
+        raise HTTPException(status_code=501, detail="Node queries require JOURNEY_STORAGE=normalized")
+    return await _run_json(db, crud.find_nodes, type, stage_type, department, limit, offset)
+
+@api_router.get("/search", response_model=List[SearchHit])
+async def search_nodes(
+    q: str = Query(..., min_length=1, max_length=500),
+    field: Optional[Literal[database.SEARCH_COLUMNS]] = None,
+    limit: int = Query(20, ge=1, le=200),
+    offset: int = Query(0, ge=0),
+    db: AsyncDB = Depends(get_db),
+):
+    """Full-text search over node content of every journey, ranked by relevance.
+
+    Words are ANDed, "quoted text" matches a phrase, ``word*`` a prefix;
+    accents and case are ignored. ``field`` restricts the match to one field.
+    """
+    if not database.SEARCH_ENABLED:
+        raise HTTPException(status_code=501, detail="Full-text search requires SQLite with FTS5")
+    return await _run_json(db, crud.search_nodes, q, field, limit, offset)
+
+@api_router.get("/analytics/summary", response_model=AnalyticsSummary)
+async def get_analytics_summary(
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    group_by: Literal[GROUP_BY] = "none",
+    db: AsyncDB = Depends(get_db),
+):
+    """Care gaps, metrics and outcomes of every journey created in [since, until], read from the rollups"""
+    return await _run_json(db, summarize, since, until, group_by)
+
+@api_router.get("/cache/stats")
+async def get_cache_stats():
+    """Hit/miss/eviction counters of the journey response cache"""
+    return response_cache.stats()
+
+# ResponseCache.stats() keys that only ever grow
+_CACHE_COUNTERS = ("hits", "misses", "evictions", "invalidations")
+
+@api_router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus text exposition of request, phase, database and cache metrics"""
+    pool = database.engine.pool
+    cache_stats = response_cache.stats()
+    gauges = {
+        "db_pool_connections_checked_out": ("Pooled connections in use", pool.checkedout()),
+        "db_pool_connections_idle": ("Pooled connections available", pool.checkedin()),
+        "db_sessions_open": (
+            "Sessions opened and not yet closed",
+            metrics.SESSIONS_OPENED.value - metrics.SESSIONS_CLOSED.value,
+        ),
+        "db_write_queue_depth": ("Write jobs waiting for the writer", database.write_queue.pending()),
+    }
+    counters = {
+        "db_write_groups_total": ("Group commits done by the writer", database.write_queue.groups),
+        "db_write_jobs_total": ("Write jobs committed by the writer", database.write_queue.jobs),
+    }
+    for key, value in cache_stats.items():
+        if key in _CACHE_COUNTERS:
+            counters[f"response_cache_{key}_total"] = (f"Response cache {key}", value)
+        else:
+            gauges[f"response_cache_{key}"] = (f"Response cache {key.replace('_', ' ')}", value)
+    return PlainTextResponse(metrics.render(gauges, counters), media_type="text/plain; version=0.0.4")
+
+@api_router.get("/metrics/profiles/{profile_id}", response_class=PlainTextResponse)
+async def get_profile(profile_id: str):
+    """Folded stacks sampled for a request sent with ``X-Profile: 1`` (PROFILING_ENABLED=1)"""
+    profile = metrics.get_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(profile.folded())
+
 @api_router.get("/templates", response_model=List[TemplateResponse])
-async def get_templates():
-    """Get predefined patient journey templates"""
-    templates = [
-        {
-            "id": "template-1",
-            "name": "Journey Básico de Paciente Ambulatorio",
-            "description": "Flujo estándar para pacientes ambulatorios",
-            "nodes": [
-                {
-                    "id": "1",
-                    "type": "registration",
-                    "position": {"x": 100, "y": 100},
-                    "data": {
-                        "label": "Registro/Admisión",
-                        "stage_type": "registration",
-                        "description": "Primera toma de contacto y registro del paciente",
-                        "duration": "15 minutos",
-                        "department": "Admisiones",
-                        "responsible": "Personal administrativo",
-                        "touchpoint": "Presencial/Online",
-                        "patient_emotion": "Ansioso, esperanzado",
-                        "pain_points": "Tiempo de espera, formularios complejos",
-                        "opportunities": "Digitalización del proceso, check-in online",
-                        "resources": "Sistema de gestión, personal capacitado"
-                    }
-                },
-                {
-                    "id": "2",
-                    "type": "consultation",
-                    "position": {"x": 400, "y": 100},
-                    "data": {
-                        "label": "Consulta Médica",
-                        "stage_type": "consultation",
-                        "description": "Evaluación inicial con el médico",
-                        "duration": "30 minutos",
-                        "department": "Medicina General",
-                        "responsible": "Médico general",
-                        "touchpoint": "Presencial",
-                        "patient_emotion": "Nervioso, expectante",
-                        "pain_points": "Tiempos de espera prolongados",
-                        "opportunities": "Recordatorios automáticos, historiales digitales",
-                        "resources": "Consultorio equipado, historia clínica electrónica"
-                    }
-                },
-                {
-                    "id": "3",
-                    "type": "diagnosis",
-                    "position": {"x": 700, "y": 100},
-                    "data": {
-                        "label": "Diagnóstico",
-                        "stage_type": "diagnosis",
-                        "description": "Análisis de síntomas y determinación del diagnóstico",
-                        "duration": "1-2 días",
-                        "department": "Laboratorio/Radiología",
-                        "responsible": "Especialistas",
-                        "touchpoint": "Presencial/Telefónico",
-                        "patient_emotion": "Ansioso, preocupado",
-                        "pain_points": "Incertidumbre, falta de comunicación",
-                        "opportunities": "Notificaciones de resultados, portal del paciente",
-                        "resources": "Equipamiento diagnóstico, laboratorio"
-                    }
-                },
-                {
-                    "id": "4",
-                    "type": "treatment",
-                    "position": {"x": 1000, "y": 100},
-                    "data": {
-                        "label": "Tratamiento",
-                        "stage_type": "treatment",
-                        "description": "Implementación del plan de tratamiento",
-                        "duration": "Variable",
-                        "department": "Especialidad correspondiente",
-                        "responsible": "Médico tratante",
-                        "touchpoint": "Presencial/Telemedicina",
-                        "patient_emotion": "Esperanzado, comprometido",
-                        "pain_points": "Adherencia al tratamiento, efectos secundarios",
-                        "opportunities": "Seguimiento digital, educación del paciente",
-                        "resources": "Medicamentos, equipamiento médico"
-                    }
-                },
-                {
-                    "id": "5",
-                    "type": "followup",
-                    "position": {"x": 1300, "y": 100},
-                    "data": {
-                        "label": "Seguimiento",
-                        "stage_type": "followup",
-                        "description": "Monitoreo post-tratamiento",
-                        "duration": "Continuo",
-                        "department": "Atención primaria",
-                        "responsible": "Médico de cabecera",
-                        "touchpoint": "Telemedicina/Presencial",
-                        "patient_emotion": "Recuperándose, optimista",
-                        "pain_points": "Falta de recordatorios, acceso limitado",
-                        "opportunities": "Monitoreo remoto, apps de salud",
-                        "resources": "Sistema de seguimiento, telemedicina"
-                    }
-                }
-            ],
-            "edges": [
-                {"id": "e1-2", "source": "1", "target": "2", "animated": True},
-                {"id": "e2-3", "source": "2", "target": "3", "animated": True},
-                {"id": "e3-4", "source": "3", "target": "4", "animated": True},
-                {"id": "e4-5", "source": "4", "target": "5", "animated": True}
-            ]
-        },
-        {
-            "id": "template-2",
-            "name": "Journey de Cirugía Programada",
-            "description": "Flujo para procedimientos quirúrgicos programados",
-            "nodes": [
-                {
-                    "id": "1",
-                    "type": "registration",
-                    "position": {"x": 100, "y": 100},
-                    "data": {
-                        "label": "Consulta Inicial",
-                        "stage_type": "consultation",
-                        "description": "Evaluación pre-quirúrgica",
-                        "duration": "45 minutos",
-                        "department": "Cirugía",
-                        "responsible": "Cirujano",
-                        "touchpoint": "Presencial",
-                        "patient_emotion": "Ansioso",
-                        "pain_points": "Desconocimiento del proceso",
-                        "opportunities": "Material educativo previo",
-                        "resources": "Consultorio especializado"
-                    }
-                },
-                {
-                    "id": "2",
-                    "type": "diagnosis",
-                    "position": {"x": 400, "y": 100},
-                    "data": {
-                        "label": "Estudios Pre-operatorios",
-                        "stage_type": "diagnosis",
-                        "description": "Análisis y estudios necesarios",
-                        "duration": "1-2 semanas",
-                        "department": "Laboratorio/Cardiología",
-                        "responsible": "Especialistas",
-                        "touchpoint": "Presencial",
-                        "patient_emotion": "Preocupado",
-                        "pain_points": "Múltiples visitas",
-                        "opportunities": "Centralizar estudios",
-                        "resources": "Laboratorio completo"
-                    }
-                },
-                {
-                    "id": "3",
-                    "type": "treatment",
-                    "position": {"x": 700, "y": 100},
-                    "data": {
-                        "label": "Cirugía",
-                        "stage_type": "treatment",
-                        "description": "Procedimiento quirúrgico",
-                        "duration": "2-6 horas",
-                        "department": "Quirófano",
-                        "responsible": "Equipo quirúrgico",
-                        "touchpoint": "Presencial",
-                        "patient_emotion": "Nervioso, confiado",
-                        "pain_points": "Ansiedad pre-operatoria",
-                        "opportunities": "Comunicación con familia en tiempo real",
-                        "resources": "Quirófano equipado, equipo médico"
-                    }
-                },
-                {
-                    "id": "4",
-                    "type": "followup",
-                    "position": {"x": 1000, "y": 100},
-                    "data": {
-                        "label": "Recuperación Post-operatoria",
-                        "stage_type": "followup",
-                        "description": "Monitoreo inmediato post-cirugía",
-                        "duration": "1-3 días",
-                        "department": "Hospitalización",
-                        "responsible": "Equipo de enfermería",
-                        "touchpoint": "Presencial",
-                        "patient_emotion": "Vulnerable, recuperándose",
-                        "pain_points": "Dolor, incomodidad",
-                        "opportunities": "Control del dolor mejorado",
-                        "resources": "Camas hospitalarias, monitoreo"
-                    }
-                },
-                {
-                    "id": "5",
-                    "type": "discharge",
-                    "position": {"x": 1300, "y": 100},
-                    "data": {
-                        "label": "Alta y Seguimiento",
-                        "stage_type": "discharge",
-                        "description": "Alta hospitalaria y plan de seguimiento",
-                        "duration": "Continuo",
-                        "department": "Atención primaria",
-                        "responsible": "Médico de cabecera",
-                        "touchpoint": "Presencial/Telemedicina",
-                        "patient_emotion": "Aliviado, expectante",
-                        "pain_points": "Instrucciones poco claras",
-                        "opportunities": "App de seguimiento post-alta",
-                        "resources": "Línea de consulta 24/7"
-                    }
-                }
-            ],
-            "edges": [
-                {"id": "e1-2", "source": "1", "target": "2", "animated": True},
-                {"id": "e2-3", "source": "2", "target": "3", "animated": True},
-                {"id": "e3-4", "source": "3", "target": "4", "animated": True},
-                {"id": "e4-5", "source": "4", "target": "5", "animated": True}
-            ]
-        }
-    ]
-    
-    return [TemplateResponse(**template) for template in templates]
+async def get_templates(if_none_match: Optional[str] = Header(None)):
+    """Get the journey templates: built-in, from TEMPLATES_DIR files and from the journey_templates table"""
+    etag = template_registry.etag
+    if _etag_matches(if_none_match, etag):
+        return _not_modified(etag)
+    return Response(content=template_registry.content, media_type="application/json", headers={"ETag": etag})
+
+@api_router.post("/templates/{template_id}/instantiate", response_model=JourneyResponse)
+async def instantiate_template(
+    template_id: str,
+    options: Optional[TemplateInstantiate] = None,
+    db: AsyncDB = Depends(get_db),
+):
+    """Create a journey from a template (fresh node and edge ids) without sending the graph"""
+    template = template_registry.get(template_id)
+    if template is None:
+        raise HTTPException(status_code=404, detail="Template not found")
+    try:
+        return await _run_json(db, templates.instantiate, template, options or TemplateInstantiate(), write=True)
+    except templates.TemplateError as error:
+        raise HTTPException(status_code=422, detail=str(error))
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -383,7 +633,10 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Link", "ETag", "Server-Timing", "X-Profile-Id"],
 )
+# Outermost, so latencies include every other middleware
+app.add_middleware(metrics.InstrumentationMiddleware)
 
 # Configure logging
 logging.basicConfig(
@@ -0,0 +1,186 @@
+"""Similar-journey lookup through MinHash fingerprints and an LSH index.
+
+A journey is described by a set of shingles: the sequences of two and three
+stage types along its flows, the ``stage_type``/``department`` pair of each
+node and word pairs of its node text. A MinHash signature of that set
+estimates the Jaccard similarity of two journeys as the share of equal
+positions. Signatures are cut into ``LSH_BANDS`` bands; journeys with an
+identical band land in the same bucket of ``similarity_buckets``, so the
+candidates for a lookup are read from the index instead of comparing the
+journey with every other one. With 32 bands of 4 rows a pair with 0.5
+similarity shares a bucket with 87% probability, one with 0.3 with 23% and
+one with 0.2 with 5%.
+
+Fingerprints are rewritten in the transaction of every write that changes
+nodes or edges, like the search index and the rollups.
+"""
+from collections import defaultdict
+from functools import lru_cache
+from typing import Iterable, List, Optional, Set, Tuple
+import hashlib
+import json
+import re
+import unicodedata
+
+import numpy as np
+from sqlalchemy import and_, func, select
+from sqlalchemy.orm import Session
+
+from database import Journey, JourneyFingerprint, SimilarityBucket
+from models import SimilarJourney
+
+LSH_BANDS = 32
+LSH_ROWS = 4
+SIGNATURE_SIZE = LSH_BANDS * LSH_ROWS
+
+# Candidates read from the index per requested match; the ones sharing most bands come first
+CANDIDATES_PER_RESULT = 20
+MIN_CANDIDATES = 200
+
+# Node text that is shingled; stage_type and department are shingled as a pair
+TEXT_FIELDS = ("label", "description", "pain_points", "opportunities", "resources")
+
+# Permutations h(x) = ((x ^ xor) * mul) >> 32 over the 64-bit shingle hashes.
+# Fixed seed: stored signatures must stay comparable across processes.
+_permutations = np.random.default_rng(20240131)
+_XOR = _permutations.integers(0, 2**64, size=(SIGNATURE_SIZE, 1), dtype=np.uint64)
+_MUL = _permutations.integers(0, 2**63, size=(SIGNATURE_SIZE, 1), dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+_CHUNK = 4096  # shingles hashed at once, bounds the (SIGNATURE_SIZE, chunk) temporary
+
+_WORD = re.compile(r"\w{3,}")
+
+@lru_cache(maxsize=8192)  # copied pathways repeat the same texts over and over
+def _text_shingles(value: str) -> Tuple[str, ...]:
+    """Pairs of consecutive words (the word itself for one-word texts), lower case and
+    without accents, ignoring the short words ("de", "y"...)"""
+    words = _WORD.findall(unicodedata.normalize("NFKD", value.lower()).encode("ascii", "ignore").decode())
+    if len(words) == 1:
+        return (f"txt:{words[0]}",)
+    return tuple(f"txt:{a} {b}" for a, b in zip(words, words[1:]))
+
+def _stage_key(node: dict) -> str:
+    data = node.get("data") or {}
+    return str(data.get("stage_type") or node.get("type") or "task")
+
+def shingles(nodes: List[dict], edges: List[dict]) -> Set[str]:
+    """The features compared between journeys, each prefixed with its kind"""
+    features = set()
+    stage = {node["id"]: _stage_key(node) for node in nodes}
+    successors = defaultdict(list)
+    for edge in edges:
+        if edge["source"] in stage and edge["target"] in stage:
+            successors[edge["source"]].append(edge["target"])
+    for source, targets in successors.items():
+        for middle in targets:
+            features.add(f"seq:{stage[source]}>{stage[middle]}")
+            for target in successors.get(middle, ()):
+                features.add(f"seq:{stage[source]}>{stage[middle]}>{stage[target]}")
+
+    for node in nodes:
+        data = node.get("data") or {}
+        features.add(f"dept:{stage[node['id']]}|{data.get('department') or ''}")
+        for field in TEXT_FIELDS:
+            value = data.get(field)
+            if isinstance(value, str):
+                features.update(_text_shingles(value))
+    return features
+
+def minhash(features: Iterable[str]) -> Optional[np.ndarray]:
+    """SIGNATURE_SIZE uint32 minima over the hashed features; None for an empty set"""
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little") for feature in features),
+        dtype=np.uint64,
+    )
+    if not len(hashes):
+        return None
+    signature = np.full(SIGNATURE_SIZE, np.iinfo(np.uint32).max, dtype=np.uint64)
+    for start in range(0, len(hashes), _CHUNK):
+        # uint64 products wrap around, which is the multiply-shift hash
+        permuted = ((hashes[start:start + _CHUNK] ^ _XOR) * _MUL) >> np.uint64(32)
+        np.minimum(signature, permuted.min(axis=1), out=signature)
+    return signature.astype(np.uint32)
+
+def _buckets(signature: np.ndarray) -> List[int]:
+    """One bucket per band: 63 bits of a hash of the band's rows (fits a signed BIGINT)"""
+    raw = signature.astype("<u4").tobytes()
+    size = LSH_ROWS * 4
+    return [
+        int.from_bytes(hashlib.blake2b(raw[i:i + size], digest_size=8).digest(), "little") >> 1
+        for i in range(0, len(raw), size)
+    ]
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of the feature sets behind two signatures"""
+    return float(np.count_nonzero(a == b)) / SIGNATURE_SIZE
+
+def remove_fingerprint(db: Session, journey_id: str):
+    db.query(SimilarityBucket).filter(SimilarityBucket.journey_id == journey_id).delete(synchronize_session=False)
+    db.query(JourneyFingerprint).filter(JourneyFingerprint.journey_id == journey_id).delete(synchronize_session=False)
+
+def index_fingerprint(db: Session, journey_id: str, nodes: List[dict], edges: List[dict]):
+    """Replace the fingerprint and LSH buckets of a journey"""
+    remove_fingerprint(db, journey_id)
+    signature = minhash(shingles(nodes, edges))
+    if signature is None:
+        return  # no nodes: nothing to compare, never a candidate
+    db.execute(JourneyFingerprint.__table__.insert(), {
+        "journey_id": journey_id, "signature": signature.astype("<u4").tobytes(),
+    })
+    db.execute(SimilarityBucket.__table__.insert(), [
+        {"band": band, "bucket": bucket, "journey_id": journey_id}
+        for band, bucket in enumerate(_buckets(signature))
+    ])
+
+def rebuild_fingerprints(db: Session, batch_size: int = 200) -> int:
+    """Fingerprint every stored journey; returns the journey count"""
+    db.query(SimilarityBucket).delete(synchronize_session=False)
+    db.query(JourneyFingerprint).delete(synchronize_session=False)
+    count = 0
+    for row in db.query(Journey.id, Journey.nodes_data, Journey.edges_data).yield_per(batch_size):
+        index_fingerprint(db, row.id, json.loads(row.nodes_data), json.loads(row.edges_data))
+        count += 1
+    db.commit()
+    return count
+
+def similar_journeys(
+    db: Session, journey_id: str, limit: int = 10, min_similarity: float = 0.0
+) -> Optional[List[SimilarJourney]]:
+    """The ``limit`` journeys most similar to ``journey_id``; None if it does not exist.
+
+    Only journeys sharing at least one LSH bucket are scored, the ones sharing
+    the most bands first, so the cost depends on the number of near matches
+    and not on the size of the portfolio.
+    """
+    fingerprint = db.get(JourneyFingerprint, journey_id)
+    if fingerprint is None:
+        exists = db.query(Journey.id).filter(Journey.id == journey_id).first() is not None
+        return [] if exists else None
+    signature = np.frombuffer(fingerprint.signature, dtype="<u4")
+
+    mine = SimilarityBucket.__table__.alias("mine")
+    other = SimilarityBucket.__table__.alias("other")
+    shared = func.count().label("shared")
+    candidates = (
+        select(other.c.journey_id)
+        .join_from(mine, other, and_(mine.c.band == other.c.band, mine.c.bucket == other.c.bucket))
+        .where(mine.c.journey_id == journey_id, other.c.journey_id != journey_id)
+        .group_by(other.c.journey_id)
+        .order_by(shared.desc())
+        .limit(max(limit * CANDIDATES_PER_RESULT, MIN_CANDIDATES))
+        .subquery()
+    )
+    rows = db.execute(
+        select(Journey.id, Journey.name, Journey.node_count, Journey.updated_at, JourneyFingerprint.signature)
+        .join(JourneyFingerprint, JourneyFingerprint.journey_id == Journey.id)
+        .where(Journey.id.in_(select(candidates.c.journey_id)))
+    )
+    matches = []
+    for row in rows:
+        score = similarity(signature, np.frombuffer(row.signature, dtype="<u4"))
+        if score >= min_similarity:
+            matches.append(SimilarJourney(
+                id=row.id, name=row.name, node_count=row.node_count, updated_at=row.updated_at,
+                similarity=round(score, 4),
+            ))
+    matches.sort(key=lambda match: (-match.similarity, match.id))
+    return matches[:limit]
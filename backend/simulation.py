@@ -0,0 +1,306 @@
+"""Monte Carlo patient-flow simulation over journey graphs.
+
+A journey is compiled once into a ``SimulationPlan``: stages in topological
+order with their parsed duration ranges, capacities and outgoing branches.
+Patients are then simulated as NumPy arrays, one array operation per stage
+for the whole cohort, rather than one Python step per patient:
+
+* a stage starts when every branch that reaches it has arrived (NaN marks
+  patients whose route does not pass through a branch);
+* service times are sampled uniformly from the parsed ``duration`` range;
+* stages with a ``capacity`` in their data queue patients first-come
+  first-served. The c-server queue is approximated by a single server working
+  c times faster, which turns the Lindley recursion into a cumulative
+  maximum that vectorizes;
+* exclusive gateways send each patient down one branch, inclusive gateways
+  down every branch that fires (at least one), everything else down all of
+  its branches. Branch probabilities come from the request, from edge labels
+  such as "70%" or "0.7", or are uniform.
+
+Large cohorts are split into shards of ``SIMULATION_SHARD_SIZE`` patients
+with independent random streams and run on a process pool. Each shard has
+its own arrival timeline, so shards behave as independent replications of
+the same clinic.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import asyncio
+import multiprocessing
+import os
+import re
+import secrets
+import time
+
+import numpy as np
+
+from analysis import topological_order
+from durations import parse_duration
+from models import PercentileTable, SimulationRequest, SimulationResult, StageSimulation
+
+SIMULATION_WORKERS = int(os.environ.get("SIMULATION_WORKERS", str(os.cpu_count() or 1)))
+# Patients per shard; shards run on the process pool when SIMULATION_WORKERS > 1
+SIMULATION_SHARD_SIZE = int(os.environ.get("SIMULATION_SHARD_SIZE", "50000"))
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+class _Stage(NamedTuple):
+    node_id: str
+    label: Optional[str]
+    kind: str  # "exclusive", "inclusive" or "all"
+    min_minutes: float
+    max_minutes: float
+    capacity: int  # 0 means unlimited, no queue
+    incoming: Tuple[int, ...]  # edge slots
+    outgoing: Tuple[int, ...]  # edge slots
+    probabilities: Tuple[float, ...]  # per outgoing edge
+
+class SimulationPlan(NamedTuple):
+    stages: Tuple[_Stage, ...]
+    sources: Tuple[int, ...]  # stage indexes where patients enter
+    edge_count: int
+    unparsed_durations: Tuple[str, ...]
+    cycle_nodes: Tuple[str, ...]
+
+_PROBABILITY = re.compile(r"^\s*(\d+(?:[.,]\d+)?)\s*(%?)\s*$")
+
+def _label_probability(label) -> Optional[float]:
+    match = _PROBABILITY.match(label) if isinstance(label, str) else None
+    if not match:
+        return None
+    value = float(match.group(1).replace(",", "."))
+    return value / 100 if match.group(2) or value > 1 else value
+
+def _capacity(data: dict) -> int:
+    try:
+        return max(int(data.get("capacity") or 0), 0)
+    except (TypeError, ValueError):
+        return 0
+
+def compile_plan(nodes: List[dict], edges: List[dict], branch_probabilities: Dict[str, float]) -> SimulationPlan:
+    """Resolve durations, routing and branch probabilities once per journey"""
+    node_ids = list(dict.fromkeys(node["id"] for node in nodes))
+    order, _, _ = topological_order(node_ids, edges)
+    position = {node_id: i for i, node_id in enumerate(order)}
+    nodes_by_id = {node["id"]: node for node in nodes}
+
+    usable = [
+        edge for edge in edges
+        if edge.get("source") in position and edge.get("target") in position
+    ]
+    incoming: Dict[str, List[int]] = {node_id: [] for node_id in order}
+    outgoing: Dict[str, List[int]] = {node_id: [] for node_id in order}
+    for slot, edge in enumerate(usable):
+        outgoing[edge["source"]].append(slot)
+        incoming[edge["target"]].append(slot)
+
+    stages, unparsed = [], []
+    for node_id in order:
+        node = nodes_by_id[node_id]
+        data = node.get("data") or {}
+        duration = parse_duration(data.get("duration"))
+        if duration is None:
+            unparsed.append(node_id)
+        node_type = node.get("type") or "task"
+        kind = {"gateway_exclusive": "exclusive", "gateway_inclusive": "inclusive"}.get(node_type, "all")
+
+        weights = []
+        for slot in outgoing[node_id]:
+            edge = usable[slot]
+            weight = branch_probabilities.get(edge.get("id"))
+            if weight is None:
+                weight = _label_probability(edge.get("label"))
+            weights.append(weight)
+        known = [w for w in weights if w is not None]
+        # Branches without a probability share what the others leave over
+        rest = max(1.0 - sum(known), 0.0) / max(len(weights) - len(known), 1)
+        probabilities = tuple(w if w is not None else rest for w in weights)
+        if kind == "exclusive" and probabilities:
+            total = sum(probabilities)
+            probabilities = tuple(p / total if total else 1 / len(probabilities) for p in probabilities)
+
+        stages.append(_Stage(
+            node_id=node_id,
+            label=None if data.get("label") is None else str(data.get("label")),
+            kind=kind,
+            min_minutes=duration.min_minutes if duration else 0.0,
+            max_minutes=duration.max_minutes if duration else 0.0,
+            capacity=_capacity(data),
+            incoming=tuple(incoming[node_id]),
+            outgoing=tuple(outgoing[node_id]),
+            probabilities=probabilities,
+        ))
+
+    starts = [i for i, stage in enumerate(stages) if (nodes_by_id[stage.node_id].get("type") == "start_event")]
+    sources = starts or [i for i, stage in enumerate(stages) if not stage.incoming]
+    scheduled = set(order)
+    return SimulationPlan(
+        stages=tuple(stages),
+        sources=tuple(sources),
+        edge_count=len(usable),
+        unparsed_durations=tuple(unparsed),
+        cycle_nodes=tuple(node_id for node_id in node_ids if node_id not in scheduled),
+    )
+
+def _queue_wait(ready: np.ndarray, service: np.ndarray, capacity: int) -> np.ndarray:
+    """FIFO waiting time of each patient, c servers approximated as one c-times faster"""
+    order = np.argsort(ready, kind="stable")
+    arrivals = ready[order]
+    effective = service[order] / capacity
+    completed = np.cumsum(effective)
+    # Departure D_n = max(A_n, D_{n-1}) + S_n, unrolled as a running maximum
+    departures = completed + np.maximum.accumulate(arrivals - (completed - effective))
+    wait = np.empty_like(ready)
+    wait[order] = departures - effective - arrivals
+    return wait
+
+def _route(stage: _Stage, size: int, rng: np.random.Generator) -> List[np.ndarray]:
+    """Boolean mask per outgoing edge of which patients take it"""
+    branches = len(stage.outgoing)
+    if stage.kind == "exclusive" and branches > 1:
+        choice = np.searchsorted(np.cumsum(stage.probabilities), rng.random(size), side="right")
+        choice = np.minimum(choice, branches - 1)
+        return [choice == i for i in range(branches)]
+    if stage.kind == "inclusive" and branches > 1:
+        probabilities = np.asarray(stage.probabilities)
+        fired = rng.random((branches, size)) < probabilities[:, None]
+        # Every patient leaves through at least one branch
+        silent = ~fired.any(axis=0)
+        if silent.any():
+            weights = probabilities / probabilities.sum() if probabilities.sum() else np.full(branches, 1 / branches)
+            fallback = rng.choice(branches, size=int(silent.sum()), p=weights)
+            fired[fallback, np.flatnonzero(silent)] = True
+        return list(fired)
+    return [np.ones(size, dtype=bool)] * branches
+
+def _simulate_shard(plan: SimulationPlan, patients: int, seed, arrival_rate_per_hour: Optional[float]):
+    """Simulate one cohort; returns mergeable raw samples and counters"""
+    rng = np.random.default_rng(seed)
+    if arrival_rate_per_hour:
+        entry = np.cumsum(rng.exponential(60.0 / arrival_rate_per_hour, patients))
+    else:
+        entry = np.zeros(patients)
+
+    edge_times: List[Optional[np.ndarray]] = [None] * plan.edge_count
+    sources = set(plan.sources)
+    exit_time = np.full(patients, np.nan)
+    stage_stats = []
+
+    for index, stage in enumerate(plan.stages):
+        if index in sources:
+            ready = entry.copy()
+        elif stage.incoming:
+            arrivals = [edge_times[slot] for slot in stage.incoming]
+            for slot in stage.incoming:
+                edge_times[slot] = None  # consumed, free the memory
+            if len(arrivals) == 1:
+                ready = arrivals[0]
+            else:
+                stacked = np.vstack(arrivals)
+                reached = ~np.isnan(stacked).all(axis=0)
+                ready = np.full(patients, np.nan)
+                ready[reached] = np.nanmax(stacked[:, reached], axis=0)
+        else:
+            ready = np.full(patients, np.nan)  # not an entry point and never reached
+
+        visited = ~np.isnan(ready)
+        visits = int(visited.sum())
+        finish = np.full(patients, np.nan)
+        waits = None
+        service_total = 0.0
+        if visits:
+            service = rng.uniform(stage.min_minutes, stage.max_minutes, visits) if stage.max_minutes > stage.min_minutes \
+                else np.full(visits, stage.min_minutes)
+            start = ready[visited]
+            if stage.capacity:
+                waits = _queue_wait(start, service, stage.capacity)
+                start = start + waits
+            finish[visited] = start + service
+            service_total = float(service.sum())
+        stage_stats.append((visits, service_total, waits.astype(np.float32) if waits is not None else None))
+
+        if stage.outgoing:
+            masks = _route(stage, patients, rng)
+            for slot, mask in zip(stage.outgoing, masks):
+                edge_times[slot] = np.where(mask, finish, np.nan)
+        else:
+            exit_time = np.fmax(exit_time, finish)
+
+    completed = ~np.isnan(exit_time)
+    return (exit_time[completed] - entry[completed]).astype(np.float32), stage_stats
+
+def _table(samples: np.ndarray, percentiles: Tuple[float, ...]) -> PercentileTable:
+    if samples.size == 0:
+        return PercentileTable(count=0, mean=0.0, percentiles={})
+    values = np.percentile(samples, percentiles)
+    return PercentileTable(
+        count=int(samples.size),
+        mean=float(samples.mean()),
+        percentiles={f"p{p:g}": float(v) for p, v in zip(percentiles, values)},
+    )
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        # Spawned, not forked: the server process already runs DB and event-loop threads
+        _process_pool = ProcessPoolExecutor(
+            max_workers=SIMULATION_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _process_pool
+
+async def run_simulation(journey_id: str, version: int, nodes: List[dict], edges: List[dict], request: SimulationRequest) -> SimulationResult:
+    """Simulate ``request.patients`` patients, sharded over the process pool when large"""
+    started = time.perf_counter()
+    plan = compile_plan(nodes, edges, request.branch_probabilities)
+    percentiles = tuple(request.percentiles)
+
+    # Shards depend only on the cohort size, so a seed reproduces the run
+    # whatever the pool size; the pool only decides where the shards run
+    shard_count = -(-request.patients // SIMULATION_SHARD_SIZE)
+    sizes = [request.patients // shard_count + (1 if i < request.patients % shard_count else 0) for i in range(shard_count)]
+    # Drawn seeds stay below 2**53 so JavaScript clients can pass them back exactly
+    seed = request.seed if request.seed is not None else secrets.randbits(53)
+    seed_sequence = np.random.SeedSequence(seed)
+    seeds = seed_sequence.spawn(shard_count)
+
+    loop = asyncio.get_running_loop()
+    if shard_count > 1 and SIMULATION_WORKERS > 1:
+        executor = _get_process_pool()
+        shards = await asyncio.gather(*(
+            loop.run_in_executor(executor, _simulate_shard, plan, size, seed, request.arrival_rate_per_hour)
+            for size, seed in zip(sizes, seeds)
+        ))
+    else:
+        # Small runs (or a single worker) skip process start-up
+        shards = await loop.run_in_executor(None, lambda: [
+            _simulate_shard(plan, size, seed, request.arrival_rate_per_hour) for size, seed in zip(sizes, seeds)
+        ])
+
+    end_to_end = np.concatenate([times for times, _ in shards])
+    stages = []
+    for index, stage in enumerate(plan.stages):
+        visits = sum(stats[index][0] for _, stats in shards)
+        service_total = sum(stats[index][1] for _, stats in shards)
+        waits = [stats[index][2] for _, stats in shards if stats[index][2] is not None]
+        stages.append(StageSimulation(
+            node_id=stage.node_id,
+            label=stage.label,
+            visits=visits,
+            visit_rate=visits / request.patients,
+            mean_service_minutes=service_total / visits if visits else 0.0,
+            capacity=stage.capacity or None,
+            queue_wait=_table(np.concatenate(waits), percentiles) if waits else None,
+        ))
+
+    return SimulationResult(
+        journey_id=journey_id,
+        version=version,
+        patients=request.patients,
+        completed=int(end_to_end.size),
+        shards=shard_count,
+        seed=seed,  # pass back as ``seed`` to reproduce the run
+        end_to_end=_table(end_to_end, percentiles),
+        stages=stages,
+        unparsed_durations=list(plan.unparsed_durations),
+        cycle_nodes=list(plan.cycle_nodes),
+        elapsed_seconds=time.perf_counter() - started,
+    )
@@ -0,0 +1,377 @@
+"""The journey template registry.
+
+Templates come from three places, loaded once at startup: the built-in
+templates below, JSON files in ``TEMPLATES_DIR`` (one template object or a
+list of them per file) and the ``journey_templates`` table. A later source
+replaces a template with the same id. Each template is validated once; the
+registry keeps the encoded ``GET /api/templates`` body and its ETag, and the
+nodes and edges of every template as JSON text, so nothing shared is handed
+out to be mutated. Restart the server to pick up new files or rows.
+"""
+from pathlib import Path
+from types import MappingProxyType
+from typing import Dict, Iterator, List, NamedTuple, Optional
+import hashlib
+import json
+import logging
+import os
+import uuid
+
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+
+import crud
+from database import JourneyTemplate, SessionLocal
+from models import JourneyCreate, TemplateInstantiate, TemplateResponse
+from validation import validate_graph
+
+logger = logging.getLogger(__name__)
+
+TEMPLATES_DIR = Path(os.environ.get("TEMPLATES_DIR", Path(__file__).parent / "templates"))
+
+BUILTIN_TEMPLATES = [
+    {
+        "id": "template-1",
+        "name": "Journey Básico de Paciente Ambulatorio",
+        "description": "Flujo estándar para pacientes ambulatorios",
+        "nodes": [
+            {
+                "id": "start",
+                "type": "start_event",
+                "position": {"x": -150, "y": 100},
+                "data": {"label": "Inicio", "bpmn_type": "start_event"}
+            },
+            {
+                "id": "1",
+                "type": "registration",
+                "position": {"x": 100, "y": 100},
+                "data": {
+                    "label": "Registro/Admisión",
+                    "stage_type": "registration",
+                    "description": "Primera toma de contacto y registro del paciente",
+                    "duration": "15 minutos",
+                    "department": "Admisiones",
+                    "responsible": "Personal administrativo",
+                    "touchpoint": "Presencial/Online",
+                    "patient_emotion": "Ansioso, esperanzado",
+                    "pain_points": "Tiempo de espera, formularios complejos",
+                    "opportunities": "Digitalización del proceso, check-in online",
+                    "resources": "Sistema de gestión, personal capacitado"
+                }
+            },
+            {
+                "id": "2",
+                "type": "consultation",
+                "position": {"x": 400, "y": 100},
+                "data": {
+                    "label": "Consulta Médica",
+                    "stage_type": "consultation",
+                    "description": "Evaluación inicial con el médico",
+                    "duration": "30 minutos",
+                    "department": "Medicina General",
+                    "responsible": "Médico general",
+                    "touchpoint": "Presencial",
+                    "patient_emotion": "Nervioso, expectante",
+                    "pain_points": "Tiempos de espera prolongados",
+                    "opportunities": "Recordatorios automáticos, historiales digitales",
+                    "resources": "Consultorio equipado, historia clínica electrónica"
+                }
+            },
+            {
+                "id": "3",
+                "type": "diagnosis",
+                "position": {"x": 700, "y": 100},
+                "data": {
+                    "label": "Diagnóstico",
+                    "stage_type": "diagnosis",
+                    "description": "Análisis de síntomas y determinación del diagnóstico",
+                    "duration": "1-2 días",
+                    "department": "Laboratorio/Radiología",
+                    "responsible": "Especialistas",
+                    "touchpoint": "Presencial/Telefónico",
+                    "patient_emotion": "Ansioso, preocupado",
+                    "pain_points": "Incertidumbre, falta de comunicación",
+                    "opportunities": "Notificaciones de resultados, portal del paciente",
+                    "resources": "Equipamiento diagnóstico, laboratorio"
+                }
+            },
+            {
+                "id": "4",
+                "type": "treatment",
+                "position": {"x": 1000, "y": 100},
+                "data": {
+                    "label": "Tratamiento",
+                    "stage_type": "treatment",
+                    "description": "Implementación del plan de tratamiento",
+                    "duration": "Variable",
+                    "department": "Especialidad correspondiente",
+                    "responsible": "Médico tratante",
+                    "touchpoint": "Presencial/Telemedicina",
+                    "patient_emotion": "Esperanzado, comprometido",
+                    "pain_points": "Adherencia al tratamiento, efectos secundarios",
+                    "opportunities": "Seguimiento digital, educación del paciente",
+                    "resources": "Medicamentos, equipamiento médico"
+                }
+            },
+            {
+                "id": "5",
+                "type": "followup",
+                "position": {"x": 1300, "y": 100},
+                "data": {
+                    "label": "Seguimiento",
+                    "stage_type": "followup",
+                    "description": "Monitoreo post-tratamiento",
+                    "duration": "Continuo",
+                    "department": "Atención primaria",
+                    "responsible": "Médico de cabecera",
+                    "touchpoint": "Telemedicina/Presencial",
+                    "patient_emotion": "Recuperándose, optimista",
+                    "pain_points": "Falta de recordatorios, acceso limitado",
+                    "opportunities": "Monitoreo remoto, apps de salud",
+                    "resources": "Sistema de seguimiento, telemedicina"
+                }
+            },
+            {
+                "id": "end",
+                "type": "end_event",
+                "position": {"x": 1600, "y": 100},
+                "data": {"label": "Fin", "bpmn_type": "end_event"}
+            }
+        ],
+        "edges": [
+            {"id": "e-start-1", "source": "start", "target": "1", "animated": True},
+            {"id": "e1-2", "source": "1", "target": "2", "animated": True},
+            {"id": "e2-3", "source": "2", "target": "3", "animated": True},
+            {"id": "e3-4", "source": "3", "target": "4", "animated": True},
+            {"id": "e4-5", "source": "4", "target": "5", "animated": True},
+            {"id": "e5-end", "source": "5", "target": "end", "animated": True}
+        ]
+    },
+    {
+        "id": "template-2",
+        "name": "Journey de Cirugía Programada",
+        "description": "Flujo para procedimientos quirúrgicos programados",
+        "nodes": [
+            {
+                "id": "start",
+                "type": "start_event",
+                "position": {"x": -150, "y": 100},
+                "data": {"label": "Inicio", "bpmn_type": "start_event"}
+            },
+            {
+                "id": "1",
+                "type": "registration",
+                "position": {"x": 100, "y": 100},
+                "data": {
+                    "label": "Consulta Inicial",
+                    "stage_type": "consultation",
+                    "description": "Evaluación pre-quirúrgica",
+                    "duration": "45 minutos",
+                    "department": "Cirugía",
+                    "responsible": "Cirujano",
+                    "touchpoint": "Presencial",
+                    "patient_emotion": "Ansioso",
+                    "pain_points": "Desconocimiento del proceso",
+                    "opportunities": "Material educativo previo",
+                    "resources": "Consultorio especializado"
+                }
+            },
+            {
+                "id": "2",
+                "type": "diagnosis",
+                "position": {"x": 400, "y": 100},
+                "data": {
+                    "label": "Estudios Pre-operatorios",
+                    "stage_type": "diagnosis",
+                    "description": "Análisis y estudios necesarios",
+                    "duration": "1-2 semanas",
+                    "department": "Laboratorio/Cardiología",
+                    "responsible": "Especialistas",
+                    "touchpoint": "Presencial",
+                    "patient_emotion": "Preocupado",
+                    "pain_points": "Múltiples visitas",
+                    "opportunities": "Centralizar estudios",
+                    "resources": "Laboratorio completo"
+                }
+            },
+            {
+                "id": "3",
+                "type": "treatment",
+                "position": {"x": 700, "y": 100},
+                "data": {
+                    "label": "Cirugía",
+                    "stage_type": "treatment",
+                    "description": "Procedimiento quirúrgico",
+                    "duration": "2-6 horas",
+                    "department": "Quirófano",
+                    "responsible": "Equipo quirúrgico",
+                    "touchpoint": "Presencial",
+                    "patient_emotion": "Nervioso, confiado",
+                    "pain_points": "Ansiedad pre-operatoria",
+                    "opportunities": "Comunicación con familia en tiempo real",
+                    "resources": "Quirófano equipado, equipo médico"
+                }
+            },
+            {
+                "id": "4",
+                "type": "followup",
+                "position": {"x": 1000, "y": 100},
+                "data": {
+                    "label": "Recuperación Post-operatoria",
+                    "stage_type": "followup",
+                    "description": "Monitoreo inmediato post-cirugía",
+                    "duration": "1-3 días",
+                    "department": "Hospitalización",
+                    "responsible": "Equipo de enfermería",
+                    "touchpoint": "Presencial",
+                    "patient_emotion": "Vulnerable, recuperándose",
+                    "pain_points": "Dolor, incomodidad",
+                    "opportunities": "Control del dolor mejorado",
+                    "resources": "Camas hospitalarias, monitoreo"
+                }
+            },
+            {
+                "id": "5",
+                "type": "discharge",
+                "position": {"x": 1300, "y": 100},
+                "data": {
+                    "label": "Alta y Seguimiento",
+                    "stage_type": "discharge",
+                    "description": "Alta hospitalaria y plan de seguimiento",
+                    "duration": "Continuo",
+                    "department": "Atención primaria",
+                    "responsible": "Médico de cabecera",
+                    "touchpoint": "Presencial/Telemedicina",
+                    "patient_emotion": "Aliviado, expectante",
+                    "pain_points": "Instrucciones poco claras",
+                    "opportunities": "App de seguimiento post-alta",
+                    "resources": "Línea de consulta 24/7"
+                }
+            },
+            {
+                "id": "end",
+                "type": "end_event",
+                "position": {"x": 1600, "y": 100},
+                "data": {"label": "Fin", "bpmn_type": "end_event"}
+            }
+        ],
+        "edges": [
+            {"id": "e-start-1", "source": "start", "target": "1", "animated": True},
+            {"id": "e1-2", "source": "1", "target": "2", "animated": True},
+            {"id": "e2-3", "source": "2", "target": "3", "animated": True},
+            {"id": "e3-4", "source": "3", "target": "4", "animated": True},
+            {"id": "e4-5", "source": "4", "target": "5", "animated": True},
+            {"id": "e5-end", "source": "5", "target": "end", "animated": True}
+        ]
+    }
+]
+
+class TemplateError(ValueError):
+    """A template's graph cannot be stored as a journey."""
+
+class Template(NamedTuple):
+    """A registered template and its graph as JSON text, decoded afresh for every use"""
+    response: TemplateResponse
+    nodes_json: str
+    edges_json: str
+
+class TemplateRegistry:
+    """Read-only templates by id, with the GET /api/templates body encoded once"""
+
+    def __init__(self, templates: List[TemplateResponse]):
+        self._templates = MappingProxyType({
+            template.id: Template(
+                template,
+                json.dumps([node.model_dump() for node in template.nodes]),
+                json.dumps([edge.model_dump() for edge in template.edges]),
+            )
+            for template in templates
+        })
+        self.content = crud.encode_json(templates)
+        self.etag = f'"{hashlib.sha256(self.content).hexdigest()[:32]}"'
+
+    def __len__(self) -> int:
+        return len(self._templates)
+
+    def get(self, template_id: str) -> Optional[Template]:
+        return self._templates.get(template_id)
+
+def _template_files(directory: Path) -> Iterator[tuple]:
+    if not directory.is_dir():
+        return
+    for path in sorted(directory.glob("*.json")):
+        try:
+            content = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as error:
+            logger.warning("Skipping template file %s: %s", path, error)
+            continue
+        for template in content if isinstance(content, list) else [content]:
+            yield str(path), template
+
+def _template_rows(db: Session) -> Iterator[tuple]:
+    for row in db.query(JourneyTemplate).order_by(JourneyTemplate.id):
+        try:
+            nodes, edges = json.loads(row.nodes_data), json.loads(row.edges_data)
+        except ValueError as error:
+            logger.warning("Skipping template %r of journey_templates: %s", row.id, error)
+            continue
+        template = {"id": row.id, "name": row.name, "description": row.description or "", "nodes": nodes, "edges": edges}
+        yield f"journey_templates row {row.id!r}", template
+
+def _validated(source: str, template) -> Optional[TemplateResponse]:
+    try:
+        response = TemplateResponse.model_validate(template)
+    except ValidationError as error:
+        logger.warning("Skipping template from %s: %s", source, error)
+        return None
+    nodes = [node.model_dump() for node in response.nodes]
+    edges = [edge.model_dump() for edge in response.edges]
+    return response.model_copy(update={"bpmn_compliant": validate_graph(nodes, edges)["valid"]})
+
+def load_registry(db: Session, directory: Path = TEMPLATES_DIR) -> TemplateRegistry:
+    """Validate the built-in, file and table templates into a registry"""
+    sources = [("built-in templates", template) for template in BUILTIN_TEMPLATES]
+    sources.extend(_template_files(directory))
+    sources.extend(_template_rows(db))
+    templates: Dict[str, TemplateResponse] = {}
+    for source, template in sources:
+        response = _validated(source, template)
+        if response is not None:
+            templates[response.id] = response
+    return TemplateRegistry(list(templates.values()))
+
+def load_templates() -> TemplateRegistry:
+    db = SessionLocal()
+    try:
+        return load_registry(db)
+    finally:
+        db.close()
+
+def instantiate(db: Session, template: Template, options: TemplateInstantiate) -> crud.EncodedJourney:
+    """Store a new journey with the template's graph under fresh node and edge ids
+
+    Raises ``TemplateError`` when the graph has duplicate node ids, edges to
+    unknown nodes or does not validate as a ``JourneyCreate``.
+    """
+    nodes, edges = json.loads(template.nodes_json), json.loads(template.edges_json)
+    node_ids = {node["id"]: str(uuid.uuid4()) for node in nodes}
+    if len(node_ids) != len(nodes):
+        raise TemplateError(f"Template {template.response.id!r} has duplicate node ids")
+    for node in nodes:
+        node["id"] = node_ids[node["id"]]
+    for edge in edges:
+        if edge["source"] not in node_ids or edge["target"] not in node_ids:
+            raise TemplateError(f"Template {template.response.id!r} edge {edge['id']!r} connects unknown nodes")
+        edge["id"] = str(uuid.uuid4())
+        edge["source"] = node_ids[edge["source"]]
+        edge["target"] = node_ids[edge["target"]]
+    try:
+        journey = JourneyCreate.model_validate({
+            "name": options.name if options.name is not None else template.response.name,
+            "description": options.description if options.description is not None else template.response.description,
+            "nodes": nodes,
+            "edges": edges,
+        })
+    except ValidationError as error:
+        raise TemplateError(f"Template {template.response.id!r} is not a valid journey: {error}")
+    return crud.create_journey(db, journey)
@@ -0,0 +1,205 @@
+"""Structural BPMN validation of journey graphs.
+
+One pass builds the adjacency lists and degrees; reachability from the start
+events, reachability of an end event and the strongly connected components
+of the stages that cannot finish are each a single linear sweep, so the
+whole check is O(V+E). Node ``type`` values that are not BPMN events or
+gateways (``registration``, ``consultation``...) are treated as tasks.
+
+Reports are plain dicts so they can be stored as JSON next to the journey
+and spliced into responses without building a model per issue.
+"""
+from collections import defaultdict, deque
+from typing import Dict, List, Optional
+
+START_EVENT = "start_event"
+END_EVENT = "end_event"
+GATEWAYS = ("gateway_exclusive", "gateway_parallel", "gateway_inclusive")
+
+# Patch operations that can change the outcome of the validation; every other
+# edit (positions, node data, edge labels) leaves the stored report valid
+_STRUCTURAL_OPS = {"add_node", "remove_node", "add_edge", "remove_edge"}
+
+def changes_structure(operation) -> bool:
+    """Whether a patch operation touches node types or graph connectivity"""
+    if operation.op in _STRUCTURAL_OPS:
+        return True
+    if operation.op == "update_node":
+        return operation.type is not None
+    if operation.op == "update_edge":
+        return operation.source is not None or operation.target is not None
+    return False
+
+def _issue(code: str, severity: str, message: str, node_id: Optional[str] = None,
+           edge_id: Optional[str] = None, related: Optional[List[str]] = None) -> dict:
+    # Keys in ValidationIssue field order
+    return {
+        "code": code,
+        "severity": severity,
+        "message": message,
+        "node_id": node_id,
+        "edge_id": edge_id,
+        "related": related or [],
+    }
+
+def _reach(roots: List[str], adjacency: Dict[str, List[str]]) -> set:
+    seen = set(roots)
+    queue = deque(roots)
+    while queue:
+        for neighbour in adjacency[queue.popleft()]:
+            if neighbour not in seen:
+                seen.add(neighbour)
+                queue.append(neighbour)
+    return seen
+
+def _strongly_connected(node_ids: List[str], successors: Dict[str, List[str]]) -> List[List[str]]:
+    """Tarjan's algorithm, iterative so deep graphs do not hit the recursion limit"""
+    members = set(node_ids)
+    index, lowlink = {}, {}
+    stack, on_stack = [], set()
+    components = []
+    for root in node_ids:
+        if root in index:
+            continue
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(successors[root]))]
+        while work:
+            node_id, targets = work[-1]
+            advanced = False
+            for target in targets:
+                if target not in members:
+                    continue
+                if target not in index:
+                    index[target] = lowlink[target] = len(index)
+                    stack.append(target)
+                    on_stack.add(target)
+                    work.append((target, iter(successors[target])))
+                    advanced = True
+                    break
+                if target in on_stack:
+                    lowlink[node_id] = min(lowlink[node_id], index[target])
+            if advanced:
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                lowlink[parent] = min(lowlink[parent], lowlink[node_id])
+            if lowlink[node_id] == index[node_id]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == node_id:
+                        break
+                components.append(component)
+    return components
+
+def validate_graph(nodes: List[dict], edges: List[dict]) -> dict:
+    """Check a graph for the structural problems that make it invalid BPMN.
+
+    Errors: missing or multiple start events, duplicate node ids, edges whose
+    source/target is not a node, start events with incoming or end events
+    with outgoing flows, nodes unreachable from the start, dead ends that are
+    not end events and cycles with no path to an end event. Warnings:
+    gateways that neither split nor join, gateways that do both, and split
+    gateways of a kind without as many joins of that kind.
+
+    Task-only graphs, without any start or end event (the built-in templates
+    and most journeys drawn before events existed), only get warnings for
+    the missing start event and the dead ends; their nodes without outgoing
+    flows count as the ends when looking for cycles without exit.
+    """
+    issues = []
+    node_types: Dict[str, str] = {}
+    for node in nodes:
+        if node["id"] in node_types:
+            issues.append(_issue("duplicate_node_id", "error", f"Node id {node['id']!r} is used more than once", node["id"]))
+        node_types[node["id"]] = node.get("type")
+    node_ids = list(node_types)
+
+    successors: Dict[str, List[str]] = defaultdict(list)
+    predecessors: Dict[str, List[str]] = defaultdict(list)
+    for edge in edges:
+        source, target = edge.get("source"), edge.get("target")
+        if source in node_types and target in node_types:
+            successors[source].append(target)
+            predecessors[target].append(source)
+            continue
+        missing = [end for end, node_id in (("source", source), ("target", target)) if node_id not in node_types]
+        issues.append(_issue(
+            "dangling_edge", "error",
+            f"Edge {edge['id']!r} has an unknown {' and '.join(missing)}",
+            edge_id=edge["id"], related=[node_id for node_id in (source, target) if node_id in node_types],
+        ))
+
+    starts = [node_id for node_id in node_ids if node_types[node_id] == START_EVENT]
+    ends = [node_id for node_id in node_ids if node_types[node_id] == END_EVENT]
+    # Events are optional until a graph uses them; then they must be complete
+    event_severity = "error" if starts or ends else "warning"
+    if not starts and node_ids:
+        issues.append(_issue("missing_start_event", event_severity, "The journey has no start_event"))
+    elif len(starts) > 1:
+        for node_id in starts:
+            issues.append(_issue(
+                "multiple_start_events", "error", f"One of {len(starts)} start events", node_id, related=starts,
+            ))
+
+    # Without a start event every node would be reported, which says nothing new
+    reachable = _reach(starts, successors) if starts else set(node_ids)
+    exits = ends if starts or ends else [node_id for node_id in node_ids if not successors[node_id]]
+    finishing = _reach(exits, predecessors)
+
+    split_gateways: Dict[str, List[str]] = defaultdict(list)
+    join_gateways: Dict[str, List[str]] = defaultdict(list)
+    for node_id in node_ids:
+        node_type = node_types[node_id]
+        incoming, outgoing = len(predecessors[node_id]), len(successors[node_id])
+        if node_id not in reachable:
+            issues.append(_issue("unreachable_node", "error", "Not reachable from the start event", node_id))
+        if node_type == START_EVENT and incoming:
+            issues.append(_issue("start_event_has_incoming", "error", "A start event cannot have incoming flows", node_id))
+        if node_type == END_EVENT:
+            if outgoing:
+                issues.append(_issue("end_event_has_outgoing", "error", "An end event cannot have outgoing flows", node_id))
+        elif not outgoing:
+            issues.append(_issue("dead_end", event_severity, "Has no outgoing flow and is not an end_event", node_id))
+        if node_type in GATEWAYS:
+            if incoming > 1 and outgoing > 1:
+                issues.append(_issue("mixed_gateway", "warning", "Gateway both joins and splits flows", node_id))
+            elif incoming <= 1 and outgoing <= 1:
+                issues.append(_issue("gateway_without_branching", "warning", "Gateway neither splits nor joins flows", node_id))
+            if outgoing > 1:
+                split_gateways[node_type].append(node_id)
+            if incoming > 1:
+                join_gateways[node_type].append(node_id)
+
+    # Stages that cannot reach an end event are either behind a dead end
+    # (reported above) or trapped in a cycle, found among them only
+    trapped = [node_id for node_id in node_ids if node_id not in finishing]
+    for component in _strongly_connected(trapped, successors):
+        if len(component) > 1 or component[0] in successors[component[0]]:
+            component.reverse()
+            issues.append(_issue(
+                "cycle_without_exit", "error",
+                f"Cycle of {len(component)} node(s) with no path to an end_event", component[0], related=component,
+            ))
+
+    for gateway_type in GATEWAYS:
+        splits, joins = split_gateways[gateway_type], join_gateways[gateway_type]
+        if len(splits) != len(joins):
+            issues.append(_issue(
+                "unbalanced_gateways", "warning",
+                f"{len(splits)} {gateway_type} split(s) but {len(joins)} join(s)", related=splits + joins,
+            ))
+
+    error_count = sum(1 for issue in issues if issue["severity"] == "error")
+    # Keys in ValidationReport field order
+    return {
+        "valid": error_count == 0,
+        "error_count": error_count,
+        "warning_count": len(issues) - error_count,
+        "issues": issues,
+    }
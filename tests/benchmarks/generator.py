@@ -0,0 +1,363 @@
+"""Synthetic patient journeys for benchmarks.
+
+Journeys look like the built-in templates of ``GET /api/templates``: stages
+of the same types carrying the same ``data`` fields (department, duration,
+pain points...), between a start and an end event, with exclusive, parallel
+and inclusive gateway blocks splitting the flow into branches that join
+again, so the graphs are valid BPMN and every analysis, validation and
+simulation endpoint has real work to do.
+
+    python -m tests.benchmarks.generator --database bench.db --journeys 100000
+
+fills a database (``--database`` is a SQLite file, ``--database-url`` any
+``DATABASE_URL``) through the same code path as ``POST /api/journeys/import``.
+"""
+from datetime import datetime, timedelta
+from typing import Iterator, List, Optional, Sequence
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import uuid
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "backend")
+
+MIN_NODES = 10
+MAX_NODES = 10_000
+
+# Stage vocabulary of the templates: type -> data fields to draw from
+STAGES = {
+    "registration": {
+        "labels": ["Registro/Admisión", "Admisión en urgencias", "Check-in online", "Triaje"],
+        "departments": ["Admisiones", "Urgencias", "Atención al paciente"],
+        "responsibles": ["Personal administrativo", "Enfermería de triaje"],
+        "durations": ["15 minutos", "5-10 minutos", "30 minutos"],
+        "emotions": ["Ansioso, esperanzado", "Ansioso", "Confundido"],
+        "pain_points": ["Tiempo de espera", "Formularios complejos", "Falta de información"],
+        "opportunities": ["Digitalización del proceso", "Check-in online", "Señalización clara"],
+    },
+    "consultation": {
+        "labels": ["Consulta Médica", "Evaluación prequirúrgica", "Consulta de especialista", "Consulta de enfermería"],
+        "departments": ["Medicina General", "Cirugía", "Cardiología", "Endocrinología", "Atención primaria"],
+        "responsibles": ["Médico general", "Cirujano", "Especialista", "Enfermería"],
+        "durations": ["20-30 minutos", "45 minutos", "15 minutos"],
+        "emotions": ["Preocupado, expectante", "Ansioso", "Tranquilo"],
+        "pain_points": ["Tiempo limitado", "Comunicación médico-paciente", "Listas de espera"],
+        "opportunities": ["Herramientas de comunicación", "Preparación previa", "Telemedicina"],
+    },
+    "diagnosis": {
+        "labels": ["Pruebas Diagnósticas", "Analítica", "Pruebas de imagen", "Estudio preoperatorio"],
+        "departments": ["Laboratorio", "Radiología", "Laboratorio/Cardiología"],
+        "responsibles": ["Técnicos especializados", "Especialistas", "Radiólogo"],
+        "durations": ["1-3 días", "1-2 semanas", "2-4 horas"],
+        "emotions": ["Incertidumbre, nerviosismo", "Preocupado"],
+        "pain_points": ["Múltiples citas", "Espera de resultados", "Preparación incómoda"],
+        "opportunities": ["Coordinación de citas", "Resultados en portal del paciente"],
+    },
+    "treatment": {
+        "labels": ["Tratamiento", "Cirugía", "Terapia", "Administración de medicación"],
+        "departments": ["Especialidad correspondiente", "Quirófano", "Hospital de día"],
+        "responsibles": ["Médico tratante", "Equipo quirúrgico", "Enfermería"],
+        "durations": ["2-6 horas", "1 hora", "3 días"],
+        "emotions": ["Esperanzado, comprometido", "Nervioso, confiado"],
+        "pain_points": ["Efectos secundarios", "Adherencia al tratamiento", "Coste"],
+        "opportunities": ["Educación del paciente", "Recordatorios automáticos", "Cirugía mínimamente invasiva"],
+    },
+    "followup": {
+        "labels": ["Seguimiento", "Recuperación post-operatoria", "Control de resultados", "Rehabilitación"],
+        "departments": ["Atención primaria", "Hospitalización", "Rehabilitación"],
+        "responsibles": ["Médico de cabecera", "Equipo de enfermería", "Fisioterapeuta"],
+        "durations": ["1-3 días", "2 semanas", "1 mes"],
+        "emotions": ["Recuperándose, optimista", "Vulnerable, recuperándose"],
+        "pain_points": ["Falta de continuidad", "Dolor", "Instrucciones poco claras"],
+        "opportunities": ["Telemedicina", "Monitorización remota", "App de seguimiento post-alta"],
+    },
+    "discharge": {
+        "labels": ["Alta Médica", "Alta hospitalaria", "Alta y seguimiento"],
+        "departments": ["Atención primaria", "Hospitalización"],
+        "responsibles": ["Médico de cabecera", "Médico tratante"],
+        "durations": ["1 hora", "30 minutos"],
+        "emotions": ["Aliviado, expectante", "Satisfecho"],
+        "pain_points": ["Instrucciones poco claras", "Coordinación con primaria"],
+        "opportunities": ["Informe de alta digital", "Línea de consulta 24/7"],
+    },
+}
+STAGE_ORDER = list(STAGES)
+TOUCHPOINTS = ["Presencial", "Online", "Telemedicina", "Presencial/Telemedicina", "Teléfono"]
+RESOURCES = ["Sistema de gestión", "Equipos de diagnóstico", "Historia clínica electrónica", "Personal capacitado"]
+GATEWAY_TYPES = ("gateway_exclusive", "gateway_parallel", "gateway_inclusive")
+
+GAP_TYPES = ("missing_intervention", "delayed_treatment", "guideline_violation")
+SEVERITIES = ("high", "medium", "low")
+GUIDELINES = ("NICE NG28", "ESC 2023", "SEMFYC 2022", "ADA 2024", None)
+METRICS = (("time_to_diagnosis", "days"), ("waiting_time", "minutes"), ("length_of_stay", "days"),
+           ("adherence", "percentage"), ("time_to_treatment", "hours"))
+METRIC_STATUSES = ("on_track", "at_risk", "critical")
+OUTCOME_TYPES = ("mortality_rate", "readmission_rate", "time_to_treatment", "patient_satisfaction")
+TRENDS = ("improving", "stable", "declining")
+PERIODS = ("Q1 2024", "Q2 2024", "2023", "Últimos 12 meses")
+
+class _Builder:
+    def __init__(self, rng: random.Random, columns: int):
+        self.rng = rng
+        self.columns = columns  # rough journey length, so stage types progress along it
+        self.nodes: List[dict] = []
+        self.edges: List[dict] = []
+
+    def node(self, node_type: str, column: int, row: float, data: dict) -> str:
+        node_id = f"n{len(self.nodes) + 1}"
+        self.nodes.append({
+            "id": node_id,
+            "type": node_type,
+            "position": {"x": 100 + 300 * column, "y": 300 + 150 * row},
+            "data": data,
+        })
+        return node_id
+
+    def stage(self, column: int, row: float) -> str:
+        rng = self.rng
+        # Stages progress along the journey, like the templates
+        stage_type = STAGE_ORDER[min(column * len(STAGE_ORDER) // self.columns, len(STAGE_ORDER) - 1)]
+        if rng.random() < 0.2:
+            stage_type = rng.choice(STAGE_ORDER)
+        vocabulary = STAGES[stage_type]
+        data = {
+            "label": rng.choice(vocabulary["labels"]),
+            "stage_type": stage_type,
+            "description": f"{rng.choice(vocabulary['labels'])} del paciente",
+            "duration": rng.choice(vocabulary["durations"]),
+            "department": rng.choice(vocabulary["departments"]),
+            "responsible": rng.choice(vocabulary["responsibles"]),
+            "touchpoint": rng.choice(TOUCHPOINTS),
+            "patient_emotion": rng.choice(vocabulary["emotions"]),
+            "pain_points": ", ".join(rng.sample(vocabulary["pain_points"], 2)),
+            "opportunities": ", ".join(rng.sample(vocabulary["opportunities"], 2)),
+            "resources": ", ".join(rng.sample(RESOURCES, 2)),
+        }
+        if rng.random() < 0.1:
+            data["capacity"] = rng.randint(1, 20)
+        return self.node(stage_type, column, row, data)
+
+    def edge(self, source: str, target: str, label: Optional[str] = None):
+        self.edges.append({
+            "id": f"e{source}-{target}",
+            "source": source,
+            "target": target,
+            "type": "smoothstep",
+            "animated": True,
+            "label": label,
+        })
+
+def _branch_lengths(rng: random.Random, budget: int, max_branches: int) -> List[int]:
+    """Stages per branch of a gateway block using at most ``budget`` stages"""
+    branches = rng.randint(2, max(2, min(max_branches, budget)))
+    lengths = [1] * branches
+    for _ in range(rng.randint(0, budget - branches)):
+        lengths[rng.randrange(branches)] += 1
+    return lengths
+
+def _probability_labels(rng: random.Random, branches: int) -> List[str]:
+    """Percentages summing to 100, in the ``"60%"`` form the simulation reads from edge labels"""
+    cuts = sorted(rng.sample(range(1, 100), branches - 1))
+    return [f"{b - a}%" for a, b in zip([0] + cuts, cuts + [100])]
+
+def generate_graph(rng: random.Random, node_count: int, branching: float = 0.3, max_branches: int = 3):
+    """Nodes and edges of a valid BPMN journey with exactly ``node_count`` nodes.
+
+    ``branching`` is the chance that the next element after a stage is a
+    gateway block (split, one to a few stages per branch, join) rather than a
+    single stage.
+    """
+    if not MIN_NODES <= node_count <= MAX_NODES:
+        raise ValueError(f"node_count must be between {MIN_NODES} and {MAX_NODES}")
+    builder = _Builder(rng, max(node_count // (1 + int(branching * 4)), 1))
+    start = builder.node("start_event", 0, 0, {"label": "Inicio", "event_type": "start"})
+    previous, column = start, 1
+    remaining = node_count - 2  # the end event is added last
+
+    while remaining > 0:
+        # A block needs two gateways and two branches of at least one stage
+        if remaining >= 4 and rng.random() < branching:
+            stage_budget = min(remaining - 2, rng.randint(2, 2 * max_branches + 2))
+            lengths = _branch_lengths(rng, stage_budget, max_branches)
+            gateway_type = rng.choice(GATEWAY_TYPES)
+            split = builder.node(gateway_type, column, 0, {"label": "¿Ruta asistencial?", "gateway_type": gateway_type[8:]})
+            builder.edge(previous, split)
+            labels = _probability_labels(rng, len(lengths)) if gateway_type == "gateway_exclusive" else [None] * len(lengths)
+            tails = []
+            for branch, (length, label) in enumerate(zip(lengths, labels)):
+                row = branch - (len(lengths) - 1) / 2
+                tail = split
+                for step in range(length):
+                    stage = builder.stage(column + 1 + step, row)
+                    builder.edge(tail, stage, label if step == 0 else None)
+                    tail = stage
+                tails.append(tail)
+            column += 1 + max(lengths)
+            join = builder.node(gateway_type, column, 0, {"label": "Unión", "gateway_type": gateway_type[8:]})
+            for tail in tails:
+                builder.edge(tail, join)
+            previous = join
+            column += 1
+            remaining -= 2 + sum(lengths)
+        else:
+            stage = builder.stage(column, 0)
+            builder.edge(previous, stage)
+            previous = stage
+            column += 1
+            remaining -= 1
+
+    end = builder.node("end_event", column, 0, {"label": "Fin", "event_type": "end"})
+    builder.edge(previous, end)
+    return builder.nodes, builder.edges
+
+def generate_journey(
+    rng: random.Random,
+    node_count: int,
+    branching: float = 0.3,
+    max_branches: int = 3,
+    care_gaps: int = 2,
+    metrics: int = 3,
+    outcomes: int = 2,
+    journey_id: Optional[str] = None,
+    created_at: Optional[datetime] = None,
+) -> dict:
+    """A JourneyImport-shaped dict with its graph and care-gap/metric/outcome lists"""
+    nodes, edges = generate_graph(rng, node_count, branching, max_branches)
+    departments = sorted({node["data"]["department"] for node in nodes if "department" in node["data"]})
+    journey = {
+        "id": journey_id or str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+        "name": f"Journey sintético {rng.choice(departments)} #{rng.randint(1, 99999)}",
+        "description": f"Journey generado con {node_count} nodos para pruebas de rendimiento",
+        "nodes": nodes,
+        "edges": edges,
+        "care_gaps": [
+            {
+                "gap_type": rng.choice(GAP_TYPES),
+                "severity": rng.choice(SEVERITIES),
+                "description": f"Brecha detectada en {rng.choice(departments)}",
+                "guideline_reference": rng.choice(GUIDELINES),
+                "recommended_action": rng.choice(STAGES[rng.choice(STAGE_ORDER)]["opportunities"]),
+            }
+            for _ in range(care_gaps)
+        ],
+        "metrics": [
+            {
+                "metric_name": name,
+                "value": round(rng.uniform(1, 100), 1),
+                "unit": unit,
+                "target_value": round(rng.uniform(1, 100), 1),
+                "status": rng.choice(METRIC_STATUSES),
+            }
+            for name, unit in (rng.choice(METRICS) for _ in range(metrics))
+        ],
+        "clinical_outcomes": [
+            {
+                "outcome_type": rng.choice(OUTCOME_TYPES),
+                "current_value": round(rng.uniform(0, 100), 1),
+                "target_value": round(rng.uniform(0, 100), 1),
+                "trend": rng.choice(TRENDS),
+                "measurement_period": rng.choice(PERIODS),
+            }
+            for _ in range(outcomes)
+        ],
+    }
+    if created_at is not None:
+        journey["created_at"] = journey["updated_at"] = created_at.isoformat()
+    return journey
+
+def node_counts(rng: random.Random, journeys: int, min_nodes: int, max_nodes: int) -> Iterator[int]:
+    """Sizes skewed towards small journeys (log-uniform), as in a real portfolio"""
+    low, high = max(min_nodes, MIN_NODES), min(max_nodes, MAX_NODES)
+    for _ in range(journeys):
+        yield int(round(low * (high / low) ** rng.random()))
+
+def generate_journeys(
+    journeys: int,
+    seed: int = 0,
+    min_nodes: int = MIN_NODES,
+    max_nodes: int = 200,
+    days: int = 365,
+    **options,
+) -> Iterator[dict]:
+    """``journeys`` reproducible journeys, created over the last ``days`` days"""
+    rng = random.Random(seed)
+    now = datetime(2024, 12, 31)
+    for count in node_counts(random.Random(seed + 1), journeys, min_nodes, max_nodes):
+        created_at = now - timedelta(seconds=rng.randrange(days * 86400))
+        yield generate_journey(rng, count, created_at=created_at, **options)
+
+def use_database(database_url: str):
+    """Point the backend at ``database_url`` and put it on the import path.
+
+    Must run before anything imports the backend modules, which read
+    ``DATABASE_URL`` at import time.
+    """
+    os.environ["DATABASE_URL"] = database_url
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+
+def populate(journeys: Sequence[dict], batch_size: int = 500, progress=None) -> int:
+    """Store ``journeys`` with ``crud.import_journeys``, ``batch_size`` per transaction"""
+    import crud
+    import database
+
+    database.init_db()
+    stored = 0
+    batch = []
+
+    def flush():
+        nonlocal stored
+        session = database.SessionLocal()
+        try:
+            report = crud.import_journeys(session, batch)
+        finally:
+            session.close()
+        if report.failed:
+            raise RuntimeError(f"{report.failed} generated journeys were rejected: {report.errors[:3]}")
+        stored += report.created + report.updated + report.unchanged
+        if progress is not None:
+            progress(stored)
+
+    for line_number, journey in enumerate(journeys, 1):
+        batch.append((line_number, json.dumps(journey).encode()))
+        if len(batch) >= batch_size:
+            flush()
+            batch = []
+    if batch:
+        flush()
+    return stored
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fill a database with synthetic patient journeys")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--database", help="SQLite file to create or extend")
+    target.add_argument("--database-url", help="any SQLAlchemy DATABASE_URL")
+    parser.add_argument("--journeys", type=int, default=1000)
+    parser.add_argument("--min-nodes", type=int, default=MIN_NODES)
+    parser.add_argument("--max-nodes", type=int, default=200)
+    parser.add_argument("--branching", type=float, default=0.3, help="chance of a gateway block after each stage")
+    parser.add_argument("--max-branches", type=int, default=3)
+    parser.add_argument("--care-gaps", type=int, default=2)
+    parser.add_argument("--metrics", type=int, default=3)
+    parser.add_argument("--outcomes", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    if not 1 <= args.journeys <= 100_000:
+        parser.error("--journeys must be between 1 and 100000")
+
+    use_database(args.database_url or f"sqlite:///{os.path.abspath(args.database)}")
+    journeys = generate_journeys(
+        args.journeys, seed=args.seed, min_nodes=args.min_nodes, max_nodes=args.max_nodes,
+        branching=args.branching, max_branches=args.max_branches,
+        care_gaps=args.care_gaps, metrics=args.metrics, outcomes=args.outcomes,
+    )
+    started = time.perf_counter()
+    stored = populate(journeys, args.batch_size, progress=lambda n: print(f"\r{n} journeys", end="", file=sys.stderr))
+    print(f"\nStored {stored} journeys in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,459 @@
+"""Benchmark every HTTP endpoint in-process and write the results as JSON.
+
+    python -m tests.benchmarks.run --journeys 1000 --output bench.json
+    python -m tests.benchmarks.run --database bench.db --output after.json --compare before.json
+
+The app runs in this process behind ``httpx.ASGITransport``, so the numbers
+cover routing, validation, the database and serialization but no network.
+Without ``--database`` a temporary SQLite file is filled with generated
+journeys (see ``generator.py``); a given ``--seed`` always produces the same
+data. Each scenario sends its requests from ``--concurrency`` concurrent
+clients and reports throughput, p50/p95/p99 latency and the peak memory of
+the process while it ran. The output file also records the commit, Python
+version and options, and ``--compare`` prints the ratios against an earlier
+file (exit status 1 when a p95 got worse than ``--max-regression``).
+"""
+from typing import TYPE_CHECKING, Awaitable, Callable, Dict, List, NamedTuple, Optional
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from tests.benchmarks import generator
+
+if TYPE_CHECKING:
+    import httpx
+
+ROOT_DIR = os.path.dirname(generator.BACKEND_DIR)
+
+class Context:
+    """Data shared by the scenarios, prepared before the first one runs"""
+
+    def __init__(self, rng: random.Random, options):
+        self.rng = rng
+        self.options = options
+        self.ids: List[str] = []  # stored journeys the read scenarios pick from
+        self.etags: Dict[str, str] = {}
+        self.created: List[str] = []  # journeys made by the create scenario, updated and deleted later
+        self.patched: List[str] = []
+        self.large_id: Optional[str] = None
+        self.cursor: Optional[str] = None
+        self.graph: Optional[dict] = None
+        self.ndjson: bytes = b""
+
+    def pick(self) -> str:
+        return self.rng.choice(self.ids)
+
+class Scenario(NamedTuple):
+    name: str
+    send: Callable[["httpx.AsyncClient", Context, int], Awaitable["httpx.Response"]]
+    share: float = 1.0  # fraction of --requests sent, for the expensive endpoints
+    record: Optional[Callable[[Context, "httpx.Response"], None]] = None  # called outside the timing
+
+SCENARIOS: List[Scenario] = []
+
+def scenario(name: str, share: float = 1.0, record=None):
+    def register(send):
+        SCENARIOS.append(Scenario(name, send, share, record))
+        return send
+    return register
+
+# Reads of single journeys
+@scenario("GET /api/")
+def _root(client, ctx, i):
+    return client.get("/api/")
+
+@scenario("GET /api/journeys/{id}")
+def _get(client, ctx, i):
+    return client.get(f"/api/journeys/{ctx.pick()}")
+
+@scenario("GET /api/journeys/{id} (304)")
+def _get_not_modified(client, ctx, i):
+    journey_id = ctx.pick()
+    return client.get(f"/api/journeys/{journey_id}", headers={"If-None-Match": ctx.etags[journey_id]})
+
+@scenario("GET /api/journeys/{id} (large)")
+def _get_large(client, ctx, i):
+    return client.get(f"/api/journeys/{ctx.large_id}")
+
+@scenario("GET /api/journeys/{id}/analysis")
+def _analysis(client, ctx, i):
+    return client.get(f"/api/journeys/{ctx.pick()}/analysis")
+
+@scenario("GET /api/journeys/{id}/analysis (large)", share=0.25)
+def _analysis_large(client, ctx, i):
+    return client.get(f"/api/journeys/{ctx.large_id}/analysis")
+
+@scenario("GET /api/journeys/{id}/validation")
+def _validation(client, ctx, i):
+    return client.get(f"/api/journeys/{ctx.pick()}/validation")
+
+@scenario("POST /api/validate")
+def _validate(client, ctx, i):
+    return client.post("/api/validate", json=ctx.graph)
+
+@scenario("POST /api/journeys/{id}/simulate", share=0.1)
+def _simulate(client, ctx, i):
+    return client.post(f"/api/journeys/{ctx.pick()}/simulate", json={"patients": 1000, "seed": i})
+
+@scenario("GET /api/journeys/{id}/export/bpmn")
+def _bpmn(client, ctx, i):
+    return client.get(f"/api/journeys/{ctx.pick()}/export/bpmn")
+
+@scenario("GET /api/journeys/{id}/export/fhir")
+def _fhir(client, ctx, i):
+    return client.get(f"/api/journeys/{ctx.pick()}/export/fhir")
+
+@scenario("GET /api/journeys/{id}/export/bpmn (large)", share=0.25)
+def _bpmn_large(client, ctx, i):
+    return client.get(f"/api/journeys/{ctx.large_id}/export/bpmn")
+
+@scenario("GET /api/journeys/{id}/similar")
+def _similar(client, ctx, i):
+    return client.get(f"/api/journeys/{ctx.pick()}/similar")
+
+# Listings and portfolio-wide queries
+@scenario("GET /api/journeys?fields=summary")
+def _list_summary(client, ctx, i):
+    return client.get("/api/journeys", params={"fields": "summary", "limit": 100})
+
+@scenario("GET /api/journeys?limit=20")
+def _list_full(client, ctx, i):
+    return client.get("/api/journeys", params={"limit": 20})
+
+@scenario("GET /api/journeys?cursor")
+def _list_next_page(client, ctx, i):
+    return client.get("/api/journeys", params={"fields": "summary", "limit": 100, "cursor": ctx.cursor})
+
+@scenario("GET /api/nodes")
+def _nodes(client, ctx, i):
+    return client.get("/api/nodes", params={"department": "Cardiología", "limit": 50})
+
+@scenario("GET /api/search")
+def _search(client, ctx, i):
+    query = ctx.rng.choice(["consulta", "espera", "telemedicina", '"check-in online"', "rehabilita*"])
+    return client.get("/api/search", params={"q": query})
+
+@scenario("GET /api/analytics/summary")
+def _analytics(client, ctx, i):
+    return client.get("/api/analytics/summary", params={"group_by": ctx.rng.choice(["none", "week", "month"])})
+
+@scenario("GET /api/templates")
+def _templates(client, ctx, i):
+    return client.get("/api/templates")
+
+@scenario("GET /api/cache/stats")
+def _cache_stats(client, ctx, i):
+    return client.get("/api/cache/stats")
+
+@scenario("GET /api/metrics")
+def _metrics(client, ctx, i):
+    return client.get("/api/metrics")
+
+@scenario("GET /api/journeys/export", share=0.02)
+def _export(client, ctx, i):
+    return client.get("/api/journeys/export")
+
+@scenario("GET /api/journeys/export?gzip=true", share=0.02)
+def _export_gzip(client, ctx, i):
+    return client.get("/api/journeys/export", params={"gzip": "true"})
+
+@scenario("GET /api/journeys/export/fhir", share=0.02)
+def _export_fhir(client, ctx, i):
+    return client.get("/api/journeys/export/fhir")
+
+def _record_created(ctx: Context, response):
+    if response.status_code == 200:
+        ctx.created.append(response.json()["id"])
+
+# Writes, last so the reads above see the same data on every run
+@scenario("POST /api/journeys", record=_record_created)
+def _create(client, ctx, i):
+    journey = generator.generate_journey(ctx.rng, ctx.rng.randint(10, 50))
+    del journey["id"]
+    return client.post("/api/journeys", json=journey)
+
+@scenario("POST /api/templates/{id}/instantiate")
+def _instantiate(client, ctx, i):
+    return client.post(f"/api/templates/template-{i % 2 + 1}/instantiate", json={"name": f"Desde plantilla {i}"})
+
+@scenario("PUT /api/journeys/{id}")
+def _update(client, ctx, i):
+    journey_id = ctx.created[i % len(ctx.created)]
+    nodes, edges = generator.generate_graph(ctx.rng, ctx.rng.randint(10, 50))
+    return client.put(f"/api/journeys/{journey_id}", json={"name": f"Revisado {i}", "nodes": nodes, "edges": edges})
+
+@scenario("PATCH /api/journeys/{id}")
+def _patch(client, ctx, i):
+    journey_id = ctx.patched[i % len(ctx.patched)]
+    operations = [
+        {"op": "move_node", "id": f"n{ctx.rng.randint(2, 9)}", "position": {"x": ctx.rng.uniform(0, 2000), "y": ctx.rng.uniform(0, 800)}},
+        {"op": "update_node", "id": "n2", "data": {"pain_points": f"Revisión {i}"}},
+    ]
+    return client.patch(f"/api/journeys/{journey_id}", json={"operations": operations})
+
+@scenario("GET /api/journeys/{id}/revisions")
+def _revisions(client, ctx, i):
+    return client.get(f"/api/journeys/{ctx.rng.choice(ctx.patched)}/revisions")
+
+@scenario("GET /api/journeys/{id}/revisions/{revision}")
+def _revision(client, ctx, i):
+    return client.get(f"/api/journeys/{ctx.rng.choice(ctx.patched)}/revisions/{ctx.rng.randint(1, 3)}")
+
+@scenario("GET /api/journeys/{id}/revisions/{from}/diff/{to}")
+def _revision_diff(client, ctx, i):
+    return client.get(f"/api/journeys/{ctx.rng.choice(ctx.patched)}/revisions/1/diff/3")
+
+@scenario("POST /api/journeys/import", share=0.05)
+def _import(client, ctx, i):
+    return client.post("/api/journeys/import", content=ctx.ndjson, headers={"Content-Type": "application/x-ndjson"})
+
+@scenario("DELETE /api/journeys/{id}")
+def _delete(client, ctx, i):
+    return client.delete(f"/api/journeys/{ctx.created[i % len(ctx.created)]}")
+
+def _percentile(ordered: List[float], percent: float) -> float:
+    """Nearest-rank percentile of a sorted list"""
+    if not ordered:
+        return 0.0
+    rank = max(int(round(percent / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+def _reset_peak_rss() -> bool:
+    """Start a new peak resident set size measurement (Linux only)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+def _peak_rss_mb() -> Optional[float]:
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+async def _run_scenario(client, ctx: Context, spec: Scenario, requests: int, concurrency: int, trace: bool) -> dict:
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    errors = 0
+    received = 0
+    next_request = 0
+
+    async def worker():
+        nonlocal errors, received, next_request
+        while next_request < requests:
+            i = next_request
+            next_request += 1
+            started = time.perf_counter()
+            response = await spec.send(client, ctx, i)
+            latencies.append(time.perf_counter() - started)
+            if spec.record is not None:
+                spec.record(ctx, response)
+            received += len(response.content)
+            statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+            if response.status_code >= 400:
+                errors += 1
+
+    per_scenario_peak = _reset_peak_rss()
+    if trace:
+        tracemalloc.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, requests))))
+    elapsed = time.perf_counter() - started
+    result = {
+        "requests": requests,
+        "concurrency": min(concurrency, requests),
+        "seconds": round(elapsed, 4),
+        "throughput_rps": round(requests / elapsed, 2) if elapsed else None,
+        "p50_ms": round(_percentile(sorted(latencies), 50) * 1000, 3),
+        "p95_ms": round(_percentile(sorted(latencies), 95) * 1000, 3),
+        "p99_ms": round(_percentile(sorted(latencies), 99) * 1000, 3),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "max_ms": round(max(latencies) * 1000, 3),
+        "response_bytes": received // requests,
+        "statuses": statuses,
+        "errors": errors,
+        # Without /proc the peak is the process-wide high-water mark so far
+        "peak_rss_mb": round(_peak_rss_mb() or 0, 1),
+        "peak_rss_scope": "scenario" if per_scenario_peak else "process",
+    }
+    if trace:
+        result["peak_traced_mb"] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 2)
+        tracemalloc.stop()
+    return result
+
+async def _prepare(client, ctx: Context, options):
+    """Read the ids to work on and create the journeys the scenarios need"""
+    response = await client.get("/api/journeys", params={"fields": "summary", "limit": 500})
+    response.raise_for_status()
+    ctx.ids = [journey["id"] for journey in response.json()]
+    ctx.cursor = response.headers.get("X-Next-Cursor")
+    if ctx.cursor is None:
+        ctx.cursor = (await client.get("/api/journeys", params={"fields": "summary", "limit": 1})).headers.get("X-Next-Cursor")
+    for journey_id in ctx.ids:
+        ctx.etags[journey_id] = (await client.get(f"/api/journeys/{journey_id}")).headers["ETag"]
+
+    large = generator.generate_journey(ctx.rng, options.large_nodes, branching=0.3)
+    del large["id"]
+    response = await client.post("/api/journeys", json=large)
+    response.raise_for_status()
+    ctx.large_id = response.json()["id"]
+
+    nodes, edges = generator.generate_graph(ctx.rng, 200)
+    ctx.graph = {"nodes": nodes, "edges": edges}
+
+    # Journeys with a few revisions for the patch and revision scenarios
+    for _ in range(min(20, options.requests)):
+        journey = generator.generate_journey(ctx.rng, 20)
+        del journey["id"]
+        journey_id = (await client.post("/api/journeys", json=journey)).json()["id"]
+        for version in (2, 3):
+            await client.patch(f"/api/journeys/{journey_id}", json={
+                "operations": [{"op": "update_node", "id": "n2", "data": {"description": f"Versión {version}"}}],
+            })
+        ctx.patched.append(journey_id)
+
+    # Upserts of existing ids, so repeated imports do not grow the database
+    ctx.ndjson = b"".join(
+        json.dumps({**generator.generate_journey(ctx.rng, 20), "id": f"bench-import-{n}"}).encode() + b"\n"
+        for n in range(50)
+    )
+
+async def _run(options) -> dict:
+    import httpx
+    import database
+    import server
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)  # one INFO line per request otherwise
+    ctx = Context(random.Random(options.seed), options)
+    results = {}
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        await _prepare(client, ctx, options)
+        selected = [spec for spec in SCENARIOS if not options.scenarios or any(s in spec.name for s in options.scenarios)]
+        for spec in selected:
+            if spec.name == "GET /api/nodes" and not database.NORMALIZED_STORAGE:
+                continue  # 501 unless JOURNEY_STORAGE=normalized
+            if spec.name == "GET /api/search" and not database.SEARCH_ENABLED:
+                continue
+            if spec.name in ("PUT /api/journeys/{id}", "DELETE /api/journeys/{id}") and not ctx.created:
+                continue  # the create scenario was not selected
+            requests = max(int(options.requests * spec.share), 3)
+            if spec.name == "DELETE /api/journeys/{id}":
+                requests = len(ctx.created)
+            results[spec.name] = await _run_scenario(
+                client, ctx, spec, requests, options.concurrency, options.tracemalloc,
+            )
+            print(_format_row(spec.name, results[spec.name]), file=sys.stderr)
+    return results
+
+def _format_row(name: str, result: dict) -> str:
+    return (
+        f"{name:<52} {result['throughput_rps']:>9.1f} req/s  p50 {result['p50_ms']:>8.2f}  "
+        f"p95 {result['p95_ms']:>8.2f}  p99 {result['p99_ms']:>8.2f} ms  "
+        f"{result['peak_rss_mb']:>7.1f} MB  errors {result['errors']}"
+    )
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(current: dict, previous: dict, max_regression: float) -> bool:
+    """Print current/previous ratios per scenario; False if some p95 regressed beyond ``max_regression``"""
+    ok = True
+    print(f"{'scenario':<52} {'throughput':>10} {'p50':>7} {'p95':>7} {'p99':>7} {'peak MB':>8}")
+    for name, result in current["scenarios"].items():
+        before = previous.get("scenarios", {}).get(name)
+        if before is None:
+            print(f"{name:<52} {'(new)':>10}")
+            continue
+
+        def ratio(key):
+            return result[key] / before[key] if before.get(key) else float("nan")
+
+        p95 = ratio("p95_ms")
+        flag = ""
+        if p95 > max_regression:
+            ok, flag = False, "  REGRESSION"
+        print(
+            f"{name:<52} {ratio('throughput_rps'):>9.2f}x {ratio('p50_ms'):>6.2f}x {p95:>6.2f}x "
+            f"{ratio('p99_ms'):>6.2f}x {ratio('peak_rss_mb'):>7.2f}x{flag}"
+        )
+    return ok
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the API in-process")
+    parser.add_argument("--database", help="SQLite file to benchmark (e.g. filled by generator.py); default: a temporary one")
+    parser.add_argument("--journeys", type=int, default=500, help="journeys generated into the temporary database")
+    parser.add_argument("--max-nodes", type=int, default=200, help="largest generated journey")
+    parser.add_argument("--large-nodes", type=int, default=2000, help="size of the journey of the (large) scenarios")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario (scaled down for the expensive ones)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--scenario", dest="scenarios", action="append", help="run only scenarios containing this text")
+    parser.add_argument("--tracemalloc", action="store_true", help="also report the peak of Python allocations (slower)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare", help="earlier output file to compare with")
+    parser.add_argument("--max-regression", type=float, default=1.2, help="p95 ratio above which --compare fails")
+    options = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.abspath(options.database) if options.database else os.path.join(workdir, "benchmark.db")
+        generator.use_database(f"sqlite:///{path}")
+        started = time.perf_counter()
+        if not options.database:
+            generator.populate(generator.generate_journeys(options.journeys, seed=options.seed, max_nodes=options.max_nodes))
+        populate_seconds = time.perf_counter() - started
+        scenarios = asyncio.run(_run(options))
+
+    import database
+    output = {
+        "meta": {
+            "commit": _git_commit(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "journey_storage": database.JOURNEY_STORAGE,
+            "journey_compression": database.JOURNEY_COMPRESSION,
+            "options": {key: value for key, value in vars(options).items() if key not in ("output", "compare")},
+            "populate_seconds": None if options.database else round(populate_seconds, 2),
+        },
+        "scenarios": scenarios,
+    }
+    with open(options.output, "w") as out:
+        json.dump(output, out, indent=2)
+    print(f"Results written to {options.output}", file=sys.stderr)
+
+    if options.compare:
+        with open(options.compare) as previous:
+            if not compare(output, json.load(previous), options.max_regression):
+                sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""Run the backend against a throwaway SQLite database.
+
+The backend modules read ``DATABASE_URL`` when they are imported, so it is set
+here, before any test module imports them.
+"""
+import os
+import tempfile
+
+import pytest
+
+from tests.benchmarks import generator
+
+_database_dir = tempfile.mkdtemp(prefix="journeys-tests-")
+generator.use_database(f"sqlite:///{os.path.join(_database_dir, 'journeys.db')}")
+
+def make_journey(node_count: int = 3, **fields) -> dict:
+    """JourneyCreate body of a chain of ``node_count`` tasks"""
+    nodes = [
+        {"id": f"n{i}", "type": "task", "position": {"x": 100.0 * i, "y": 0.0}, "data": {"label": f"Paso {i}"}}
+        for i in range(node_count)
+    ]
+    edges = [{"id": f"e{i}", "source": f"n{i}", "target": f"n{i + 1}"} for i in range(node_count - 1)]
+    return {"name": "Journey de prueba", "nodes": nodes, "edges": edges, **fields}
+
+@pytest.fixture(scope="session")
+def client():
+    """One TestClient for the session: its portal runs every request and
+    WebSocket on the same event loop, which the collaboration rooms need"""
+    from fastapi.testclient import TestClient
+    import server
+
+    with TestClient(server.app) as client:
+        yield client
+
+@pytest.fixture
+def db(client):
+    """Session on the test database (created by starting the app), rolled back afterwards"""
+    import database
+
+    session = database.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.rollback()
+        session.close()
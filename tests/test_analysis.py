@@ -0,0 +1,35 @@
+from analysis import analyze_journey
+
+def _node(node_id: str, node_type: str = "task", duration=None) -> dict:
+    data = {"label": node_id}
+    if duration is not None:
+        data["duration"] = duration
+    return {"id": node_id, "type": node_type, "position": {"x": 0, "y": 0}, "data": data}
+
+def _edges(*pairs) -> list:
+    return [{"id": f"{source}-{target}", "source": source, "target": target} for source, target in pairs]
+
+def test_critical_path_starts_at_zero_length_start_event():
+    nodes = [
+        _node("start", "start_event"),
+        _node("decision", "gateway_exclusive"),
+        _node("short", duration="10 minutos"),
+        _node("long", duration="1 hora"),
+        _node("end", "end_event"),
+    ]
+    edges = _edges(("start", "decision"), ("decision", "short"), ("decision", "long"), ("short", "end"), ("long", "end"))
+
+    analysis = analyze_journey("j", 1, nodes, edges)
+
+    assert analysis.critical_path == ["start", "decision", "long", "end"]
+    assert analysis.total_duration.expected_minutes == 60.0
+    stages = {stage.node_id: stage for stage in analysis.stages}
+    assert stages["short"].slack == 50.0 and not stages["short"].critical
+
+def test_compound_durations_are_summed_on_the_path():
+    nodes = [_node("a", duration="1 hora 30 minutos"), _node("b", duration="1-2 horas")]
+    analysis = analyze_journey("j", 1, nodes, _edges(("a", "b")))
+
+    assert analysis.critical_path == ["a", "b"]
+    assert analysis.total_duration.min_minutes == 150.0
+    assert analysis.total_duration.max_minutes == 210.0
@@ -0,0 +1,92 @@
+import threading
+
+from cache import ResponseCache, response_cache
+from tests.conftest import make_journey
+
+def _counts(cache: ResponseCache) -> tuple:
+    stats = cache.stats()
+    return stats["hits"], stats["misses"], stats["evictions"], stats["invalidations"]
+
+def test_least_recently_used_entry_is_evicted_first():
+    cache = ResponseCache(max_bytes=1000, max_entries=3)
+    for name in ("a", "b", "c"):
+        cache.put((name, 1), name.encode())
+    assert cache.get(("a", 1)) == b"a"  # b is now the least recently used
+
+    cache.put(("d", 1), b"d")
+    assert cache.get(("b", 1)) is None
+    assert [cache.get((name, 1)) for name in ("a", "c", "d")] == [b"a", b"c", b"d"]
+    cache.put(("e", 1), b"e")
+    assert cache.get(("a", 1)) is None
+    assert _counts(cache) == (4, 2, 2, 0)
+
+def test_byte_bound_evicts_and_oversized_bodies_are_not_cached():
+    cache = ResponseCache(max_bytes=10, max_entries=100)
+    cache.put(("a", 1), b"12345")
+    cache.put(("b", 1), b"12345")
+    cache.put(("a", 1), b"1234")  # replacing an entry does not count it twice
+    assert cache.stats()["bytes"] == 9
+    cache.put(("c", 1), b"123")
+    assert (cache.get(("b", 1)), cache.get(("a", 1)), cache.get(("c", 1))) == (None, b"1234", b"123")
+    cache.put(("big", 1), b"x" * 11)
+    assert cache.get(("big", 1)) is None
+    assert cache.stats()["bytes"] == 7 and cache.stats()["entries"] == 2
+    assert _counts(cache)[2] == 1
+
+def test_invalidate_drops_every_version_of_the_owner():
+    cache = ResponseCache(max_bytes=1000, max_entries=100)
+    cache.put(("a", 1), b"one")
+    cache.put(("a", 2), b"two")
+    cache.put(("b", 1), b"other")
+    cache.invalidate("a")
+    cache.invalidate("missing")
+
+    assert cache.get(("a", 1)) is None and cache.get(("a", 2)) is None
+    assert cache.get(("b", 1)) == b"other"
+    assert cache.stats()["bytes"] == 5
+    assert _counts(cache) == (1, 2, 0, 2)
+
+def test_concurrent_misses_build_once():
+    cache = ResponseCache(max_bytes=1000, max_entries=100)
+    builds = []
+    release = threading.Event()
+
+    def build():
+        builds.append(1)
+        release.wait(5)
+        return b"body"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_build(("a", 1), build))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == [b"body"] * 4
+    assert len(builds) == 1
+
+def test_if_none_match_and_stale_etag_after_patch(client):
+    journey = client.post("/api/journeys", json=make_journey()).json()
+    url = f"/api/journeys/{journey['id']}"
+    first = client.get(url)
+    etag = first.headers["ETag"]
+    assert etag == f'"{journey["version"]}"'
+
+    hits = response_cache.stats()["hits"]
+    cached = client.get(url)
+    assert cached.content == first.content
+    assert response_cache.stats()["hits"] == hits + 1
+
+    not_modified = client.get(url, headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304 and not_modified.content == b""
+    assert not_modified.headers["ETag"] == etag
+    assert client.get(url, headers={"If-None-Match": f'"999", W/{etag}'}).status_code == 304
+
+    response = client.patch(url, json={"name": "Renombrado", "operations": []}, headers={"If-Match": etag})
+    assert response.status_code == 200, response.text
+    fresh = client.get(url, headers={"If-None-Match": etag})
+    assert fresh.status_code == 200
+    assert fresh.json()["name"] == "Renombrado"
+    assert fresh.headers["ETag"] == f'"{journey["version"] + 1}"' != etag
+    assert response_cache.get((journey["id"], journey["version"])) is None
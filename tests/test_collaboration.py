@@ -0,0 +1,120 @@
+from fastapi.testclient import TestClient
+import pytest
+
+import collaboration
+import crud
+import server
+from tests.conftest import make_journey
+
+@pytest.fixture
+def journey(client) -> dict:
+    return client.post("/api/journeys", json=make_journey()).json()
+
+@pytest.fixture(autouse=True)
+def slow_flushes(monkeypatch):
+    # Wide enough to send several messages, or a REST write, before the flush
+    monkeypatch.setattr(collaboration, "COLLAB_FLUSH_INTERVAL", 0.5)
+
+def _live(client, journey: dict):
+    return client.websocket_connect(f"/api/journeys/{journey['id']}/live")
+
+def _move(node_id: str, x: float, ref=None) -> dict:
+    return {"type": "operations", "ref": ref, "operations": [{"op": "move_node", "id": node_id, "position": {"x": x, "y": 0.0}}]}
+
+def test_join_sends_snapshot(client, journey):
+    with _live(client, journey) as socket:
+        snapshot = socket.receive_json()
+    assert snapshot["type"] == "snapshot"
+    assert snapshot["version"] == journey["version"]
+    assert [node["id"] for node in snapshot["journey"]["nodes"]] == ["n0", "n1", "n2"]
+
+def test_unknown_journey_is_closed(client):
+    with client.websocket_connect("/api/journeys/missing/live") as socket:
+        message = socket.receive()
+    assert message["type"] == "websocket.close"
+    assert message["code"] == collaboration.CLOSE_NOT_FOUND
+
+def test_operations_are_broadcast_and_coalesced_into_one_version(client, journey):
+    with _live(client, journey) as first, _live(client, journey) as second:
+        first.receive_json()
+        second.receive_json()
+        for i in range(5):
+            first.send_json(_move("n0", 10.0 * (i + 1), ref=i))
+            assert first.receive_json() == {"type": "ack", "ref": i}
+            shared = second.receive_json()
+            assert shared["type"] == "operations"
+            assert shared["operations"][0]["position"]["x"] == 10.0 * (i + 1)
+
+        saved = [first.receive_json(), second.receive_json()]
+    assert saved[0] == saved[1] == {"type": "saved", "version": journey["version"] + 1, "operations": 1}
+
+    stored = client.get(f"/api/journeys/{journey['id']}").json()
+    assert stored["version"] == journey["version"] + 1
+    assert stored["nodes"][0]["position"]["x"] == 50.0
+
+@pytest.fixture
+def patches(monkeypatch) -> list:
+    """(expected_version, exception type or None) of every patch_journey call"""
+    calls = []
+    patch_journey = crud.patch_journey
+
+    def recording(db, journey_id, patch, expected_version=None):
+        try:
+            result = patch_journey(db, journey_id, patch, expected_version)
+        except Exception as error:
+            calls.append((expected_version, type(error)))
+            raise
+        calls.append((expected_version, None))
+        return result
+
+    monkeypatch.setattr(crud, "patch_journey", recording)
+    return calls
+
+def test_live_edits_are_rebased_on_concurrent_rest_write(client, journey, patches):
+    with _live(client, journey) as first, _live(client, journey) as second:
+        first.receive_json()
+        second.receive_json()
+        first.send_json(_move("n0", 99.0))
+        first.receive_json()
+        second.receive_json()
+        # Saved through the REST API before the room flushes
+        rest = client.put(f"/api/journeys/{journey['id']}", json={"name": "Renombrado"}).json()
+
+        snapshots = [first.receive_json(), second.receive_json()]
+
+    for snapshot in snapshots:
+        assert snapshot["type"] == "snapshot"
+        assert snapshot["version"] == rest["version"] + 1
+        assert snapshot["journey"]["name"] == "Renombrado"
+        assert snapshot["journey"]["nodes"][0]["position"]["x"] == 99.0
+    stored = client.get(f"/api/journeys/{journey['id']}").json()
+    assert stored["version"] == rest["version"] + 1
+    assert (stored["name"], stored["nodes"][0]["position"]["x"]) == ("Renombrado", 99.0)
+    # Refused before applying anything, then written on top of the REST version
+    assert patches == [(journey["version"], crud.VersionConflict), (rest["version"], None)]
+
+def test_live_edits_that_no_longer_apply_are_dropped(client, journey, patches):
+    with _live(client, journey) as socket:
+        socket.receive_json()
+        socket.send_json(_move("n2", 42.0))
+        socket.receive_json()
+        nodes = [node for node in journey["nodes"] if node["id"] != "n2"]
+        rest = client.put(f"/api/journeys/{journey['id']}", json={"nodes": nodes, "edges": journey["edges"][:1]}).json()
+
+        snapshot = socket.receive_json()
+
+    assert snapshot["type"] == "snapshot"
+    assert snapshot["version"] == rest["version"]
+    assert [node["id"] for node in snapshot["journey"]["nodes"]] == ["n0", "n1"]
+    assert client.get(f"/api/journeys/{journey['id']}").json()["version"] == rest["version"]
+    assert patches == [(journey["version"], crud.VersionConflict)]
+
+def test_sessions_on_separate_event_loops_are_refused(client, journey):
+    # Without ``with``, TestClient starts a new event loop for every session;
+    # rooms are bound to one loop, so the second session must fail loudly
+    bare = TestClient(server.app)
+    with bare.websocket_connect(f"/api/journeys/{journey['id']}/live") as first:
+        first.receive_json()
+        with pytest.raises(RuntimeError, match="another event loop"):
+            with bare.websocket_connect(f"/api/journeys/{journey['id']}/live"):
+                pass
@@ -0,0 +1,178 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import contextvars
+import json
+import time
+import uuid
+
+import pytest
+
+from cache import response_cache
+import database
+from database import JourneyTemplate
+import metrics
+from tests.conftest import make_journey
+
+def _add_template(template_id: str, fail: bool = False):
+    def job(session):
+        session.add(JourneyTemplate(id=template_id, name=template_id, nodes_data="[]", edges_data="[]"))
+        session.flush()
+        if fail:
+            raise ValueError(f"job {template_id} failed")
+        return template_id
+    return job
+
+def _stored(db, ids) -> set:
+    db.rollback()
+    return {row.id for row in db.query(JourneyTemplate.id).filter(JourneyTemplate.id.in_(ids))}
+
+@pytest.fixture
+def template_ids(db):
+    """Ids for scratch journey_templates rows, deleted afterwards"""
+    ids = [f"write-queue-{uuid.uuid4()}" for _ in range(3)]
+    yield ids
+    db.rollback()
+    db.query(JourneyTemplate).filter(JourneyTemplate.id.in_(ids)).delete(synchronize_session=False)
+    db.commit()
+
+def test_failing_job_rolls_back_only_its_savepoint(db, template_ids):
+    first, failing, last = template_ids
+    jobs = [_add_template(first), _add_template(failing, fail=True), _add_template(last)]
+    group = [(Future(), contextvars.copy_context(), job, (), {}) for job in jobs]
+    groups, job_count = database.write_queue.groups, database.write_queue.jobs
+
+    database.write_queue._commit_group(group)
+
+    futures = [entry[0] for entry in group]
+    assert futures[0].result() == first and futures[2].result() == last
+    with pytest.raises(ValueError, match="failed"):
+        futures[1].result()
+    assert _stored(db, template_ids) == {first, last}
+    # The failed job still counts: it ran in the group
+    assert (database.write_queue.groups, database.write_queue.jobs) == (groups + 1, job_count + 3)
+
+def test_counters_advance_per_group_and_job(db, template_ids):
+    write_queue = database.WriteQueue(max_batch=8)
+    futures = [write_queue.submit(_add_template(template_id)) for template_id in template_ids]
+
+    assert [future.result(timeout=10) for future in futures] == template_ids
+    assert 1 <= write_queue.groups <= len(template_ids)
+    assert write_queue.jobs == len(template_ids)
+    assert _stored(db, template_ids) == set(template_ids)
+
+def _raw_graph(journey_id: str) -> tuple:
+    """nodes_data/edges_data exactly as SQLite stores them: BLOB (bytes) or TEXT (str)"""
+    with database.engine.connect() as conn:
+        return tuple(conn.exec_driver_sql(
+            "SELECT nodes_data, edges_data FROM journeys WHERE id = ?", (journey_id,)
+        ).one())
+
+def _served(client, journey_id: str) -> dict:
+    # Decode from the table, not from the response cache
+    response_cache.clear()
+    return client.get(f"/api/journeys/{journey_id}").json()
+
+def _compressed(value) -> bool:
+    return isinstance(value, bytes) and value.startswith(database._COMPRESSED_MAGIC)
+
+@pytest.fixture
+def compression(monkeypatch):
+    """Switch JOURNEY_COMPRESSION for the running app"""
+    return lambda codec: monkeypatch.setattr(database, "JOURNEY_COMPRESSION", codec)
+
+def test_compressed_graph_round_trips(client, compression):
+    compression("zlib")
+    journey = client.post("/api/journeys", json=make_journey(8, name="Consulta de cardiología")).json()
+
+    nodes, edges = _raw_graph(journey["id"])
+    assert _compressed(nodes) and _compressed(edges)
+    assert json.loads(database.decompress_json(nodes)) == journey["nodes"]
+    served = _served(client, journey["id"])
+    assert (served["nodes"], served["edges"]) == (journey["nodes"], journey["edges"])
+
+def test_plain_rows_are_read_and_rewritten_with_compression_on(client, compression):
+    compression("none")
+    journey = client.post("/api/journeys", json=make_journey(8)).json()
+    assert all(isinstance(value, str) for value in _raw_graph(journey["id"]))
+
+    compression("zlib")
+    assert _served(client, journey["id"])["nodes"] == journey["nodes"]
+    response = client.patch(f"/api/journeys/{journey['id']}", json={
+        "operations": [{"op": "update_node", "id": "n0", "data": {"label": "Recepción"}}],
+    })
+    assert response.status_code == 200, response.text
+    assert _compressed(_raw_graph(journey["id"])[0])
+    assert _served(client, journey["id"])["nodes"][0]["data"]["label"] == "Recepción"
+
+def test_recompress_converts_existing_rows_both_ways(client, db, compression):
+    compression("none")
+    journey = client.post("/api/journeys", json=make_journey(8)).json()
+    db.rollback()
+
+    compression("zlib")
+    assert database.recompress_journeys(batch_size=2) >= 1
+    assert all(_compressed(value) for value in _raw_graph(journey["id"]))
+    served = _served(client, journey["id"])
+    assert (served["nodes"], served["edges"]) == (journey["nodes"], journey["edges"])
+    # Same content, so neither the version nor updated_at moves
+    assert (served["version"], served["updated_at"]) == (journey["version"], journey["updated_at"])
+
+    compression("none")
+    database.recompress_journeys()
+    nodes, edges = _raw_graph(journey["id"])
+    assert isinstance(nodes, str) and isinstance(edges, str)
+    assert (json.loads(nodes), json.loads(edges)) == (journey["nodes"], journey["edges"])
+
+def test_benchmark_compares_codecs_on_stored_rows(client):
+    client.post("/api/journeys", json=make_journey(8))
+    results = {result["codec"]: result for result in database.benchmark_compression(limit=50)}
+
+    assert set(results) == {"none", "zlib", "zlib+dictionary"}
+    assert results["none"]["ratio"] == 1.0
+    assert results["zlib+dictionary"]["bytes"] < results["zlib"]["bytes"] < results["none"]["bytes"]
+    assert all(result["pages_per_journey"] >= 1 for result in results.values())
+
+def _open_sessions() -> int:
+    return metrics.SESSIONS_OPENED.value - metrics.SESSIONS_CLOSED.value
+
+def _wait_for_sessions_closed(expected: int):
+    # Dependencies with yield are closed after the response is sent
+    deadline = time.monotonic() + 5
+    while _open_sessions() != expected and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert _open_sessions() == expected
+
+def test_concurrent_requests_close_every_session(client, monkeypatch):
+    import revisions
+
+    journey = client.post("/api/journeys", json=make_journey()).json()
+    url = f"/api/journeys/{journey['id']}"
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("handler failed")
+
+    monkeypatch.setattr(revisions, "list_revisions", fail)
+    requests = [
+        lambda: client.get(url),
+        lambda: client.get("/api/journeys", params={"limit": 5}),
+        lambda: client.post("/api/journeys", json=make_journey(2)),
+        # Stale If-Match: 409 raised after the session was used
+        lambda: client.patch(url, json={"operations": []}, headers={"If-Match": '"999"'}),
+        lambda: client.get(f"/api/journeys/{uuid.uuid4()}"),
+        lambda: client.get("/api/journeys/export"),
+        lambda: client.get(f"{url}/analysis"),
+    ]
+    opened, open_before = metrics.SESSIONS_OPENED.value, _open_sessions()
+
+    def send(index):
+        if index % 8 == 7:
+            with pytest.raises(RuntimeError, match="handler failed"):
+                client.get(f"{url}/revisions")
+            return 500
+        return requests[index % len(requests)]().status_code
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        statuses = list(pool.map(send, range(64)))
+
+    assert set(statuses) == {200, 404, 409, 500}
+    assert metrics.SESSIONS_OPENED.value > opened + 32
+    _wait_for_sessions_closed(open_before)
@@ -0,0 +1,33 @@
+import pytest
+
+from durations import DurationRange, parse_duration
+
+@pytest.mark.parametrize("text, expected", [
+    # Single quantities
+    ("15 minutos", (15, 15)),
+    ("1,5 horas", (90, 90)),
+    ("2 semanas", (20160, 20160)),
+    ("< 24 h", (0, 1440)),
+    ("hasta 2 días", (0, 2880)),
+    # Ranges
+    ("1-2 días", (1440, 2880)),
+    ("2-6 horas", (120, 360)),
+    ("30 min - 1 hora", (30, 60)),
+    ("1 a 2 días", (1440, 2880)),
+    ("entre 1 y 2 horas", (60, 120)),
+    ("between 1 and 2 hours", (60, 120)),
+    # Compound durations add up
+    ("1 hora 30 minutos", (90, 90)),
+    ("1h 30min", (90, 90)),
+    ("1h30min", (90, 90)),
+    ("1 hora y 30 minutos", (90, 90)),
+    ("2 días 12 horas", (3600, 3600)),
+    # Ranges of compound durations
+    ("1h 30min - 2h", (90, 120)),
+])
+def test_parse_duration(text, expected):
+    assert parse_duration(text) == DurationRange(*map(float, expected))
+
+@pytest.mark.parametrize("text", ["Continuo", "Variable", "", "1 y 2 horas", "3 pasos", None])
+def test_parse_duration_rejects(text):
+    assert parse_duration(text) is None
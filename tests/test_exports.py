@@ -0,0 +1,30 @@
+from collections import Counter
+import xml.etree.ElementTree as ET
+
+BPMN = "{http://www.omg.org/spec/BPMN/20100524/MODEL}"
+
+def _node(node_id: str, label: str) -> dict:
+    return {"id": node_id, "type": "task", "position": {"x": 0, "y": 0}, "data": {"label": label}}
+
+def test_bpmn_ids_stay_distinct_after_sanitising(client):
+    journey = client.post("/api/journeys", json={
+        "name": "Ids parecidos",
+        "nodes": [_node("a b", "Espacio"), _node("a_b", "Guion bajo"), _node("a_b_2", "Sufijo"), _node("a_b_di", "Forma")],
+        "edges": [
+            {"id": "x y", "source": "a b", "target": "a_b"},
+            {"id": "x_y", "source": "a_b", "target": "a_b_2"},
+            {"id": "x_y_2", "source": "a_b_2", "target": "a_b_di"},
+        ],
+    }).json()
+    response = client.get(f"/api/journeys/{journey['id']}/export/bpmn")
+    root = ET.fromstring(response.content)
+
+    ids = Counter(element.get("id") for element in root.iter() if element.get("id"))
+    assert [element_id for element_id, count in ids.items() if count > 1] == []
+
+    names = {task.get("id"): task.get("name") for task in root.iter(f"{BPMN}task")}
+    flows = [(names[flow.get("sourceRef")], names[flow.get("targetRef")]) for flow in root.iter(f"{BPMN}sequenceFlow")]
+    assert flows == [("Espacio", "Guion bajo"), ("Guion bajo", "Sufijo"), ("Sufijo", "Forma")]
+    # Every diagram shape and edge refers to an element that exists
+    refs = [element.get("bpmnElement") for element in root.iter() if element.get("bpmnElement")]
+    assert all(ref in ids for ref in refs)
@@ -0,0 +1,234 @@
+from datetime import datetime
+import base64
+import json
+import uuid
+
+import pytest
+
+import crud
+from database import Journey
+from models import JourneyResponse
+from tests.conftest import make_journey
+
+def test_patch_reports_updated_at_like_get(client):
+    journey = client.post("/api/journeys", json=make_journey()).json()
+    patched = client.patch(f"/api/journeys/{journey['id']}", json={
+        "operations": [{"op": "move_node", "id": "n0", "position": {"x": 5.0, "y": 5.0}}],
+    }).json()
+    stored = client.get(f"/api/journeys/{journey['id']}").json()
+
+    assert patched["version"] == stored["version"] == journey["version"] + 1
+    assert patched["updated_at"] == stored["updated_at"]
+    assert not patched["updated_at"].endswith(("Z", "+00:00"))
+
+def _import(client, journeys) -> dict:
+    body = "\n".join(json.dumps(journey) for journey in journeys)
+    response = client.post("/api/journeys/import", content=body, headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def test_import_stores_offsets_as_naive_utc(client):
+    journey = make_journey(id=str(uuid.uuid4()), created_at="2024-03-01T10:00:00+02:00", updated_at="2024-03-02T01:30:00+02:00")
+    assert _import(client, [journey])["created"] == 1
+
+    stored = client.get(f"/api/journeys/{journey['id']}").json()
+    assert stored["created_at"] == "2024-03-01T08:00:00"
+    assert stored["updated_at"] == "2024-03-01T23:30:00"
+
+def test_import_counts_identical_rows_as_unchanged(client):
+    journey = make_journey(id=str(uuid.uuid4()), updated_at="2024-03-01T12:00:00Z")
+    _import(client, [journey])
+    version = client.get(f"/api/journeys/{journey['id']}").json()["version"]
+
+    report = _import(client, [journey, {**journey, "name": "Renombrado"}])
+    assert (report["created"], report["updated"], report["unchanged"]) == (0, 1, 1)
+    assert client.get(f"/api/journeys/{journey['id']}").json()["version"] == version + 1
+
+_SNAPSHOT_FIELDS = ("name", "description", "nodes", "edges", "care_gaps", "metrics", "clinical_outcomes", "fhir_plan_definition_id")
+
+def _snapshot(journey: dict) -> dict:
+    return {field: journey[field] for field in _SNAPSHOT_FIELDS}
+
+def _edit(client, journey_id: str, step: int):
+    """One PATCH or PUT per step: data edits, additions, deletions and reorderings"""
+    current = client.get(f"/api/journeys/{journey_id}").json()
+    nodes, edges = current["nodes"], current["edges"]
+    if step % 3 == 0:
+        operations = [
+            {"op": "update_node", "id": nodes[0]["id"], "data": {"label": f"Paso editado {step}"}},
+            {"op": "add_node", "node": {"id": f"s{step}", "position": {"x": 10.0 * step, "y": 50.0}, "data": {"label": f"Nuevo {step}"}}},
+            {"op": "add_edge", "edge": {"id": f"es{step}", "source": nodes[-1]["id"], "target": f"s{step}"}},
+        ]
+        response = client.patch(f"/api/journeys/{journey_id}", json={"name": f"Journey {step}", "operations": operations})
+    elif step % 3 == 1:
+        # Reverse the nodes and drop the first one with its edges
+        removed = nodes[0]["id"]
+        nodes = list(reversed(nodes[1:]))
+        edges = [edge for edge in edges if removed not in (edge["source"], edge["target"])]
+        care_gaps = [{"gap_type": "delayed_treatment", "severity": "low", "description": f"Paso {step}", "recommended_action": "Revisar"}]
+        response = client.put(f"/api/journeys/{journey_id}", json={"nodes": nodes, "edges": edges[::-1], "care_gaps": care_gaps})
+    else:
+        operations = [{"op": "move_node", "id": nodes[-1]["id"], "position": {"x": float(step), "y": float(step)}}]
+        if edges:
+            operations.append({"op": "remove_edge", "id": edges[0]["id"]})
+        response = client.patch(f"/api/journeys/{journey_id}", json={"description": f"Descripción {step}", "operations": operations})
+    assert response.status_code == 200, response.text
+
+def test_revisions_rebuild_every_snapshot_across_keyframes(client, db):
+    import revisions
+    from database import JourneyRevision
+
+    journey = client.post("/api/journeys", json=make_journey(6, description="Inicial")).json()
+    snapshots = {journey["version"]: _snapshot(journey)}
+    for step in range(revisions.KEYFRAME_INTERVAL + 5):
+        _edit(client, journey["id"], step)
+        current = client.get(f"/api/journeys/{journey['id']}").json()
+        snapshots[current["version"]] = _snapshot(current)
+
+    history = client.get(f"/api/journeys/{journey['id']}/revisions", params={"limit": 1000}).json()
+    assert [entry["revision"] for entry in history] == sorted(snapshots, reverse=True)
+    assert sum(entry["keyframe"] for entry in history) == 2
+    deltas = [json.loads(row.data) for row in db.query(JourneyRevision).filter_by(journey_id=journey["id"], keyframe=False)]
+    assert any("order" in delta.get("nodes", {}) for delta in deltas)
+    assert any(delta.get("nodes", {}).get("remove") for delta in deltas)
+    for revision, snapshot in snapshots.items():
+        stored = client.get(f"/api/journeys/{journey['id']}/revisions/{revision}").json()
+        assert _snapshot(stored) == snapshot, f"revision {revision}"
+
+def test_diff_between_non_adjacent_revisions(client):
+    journey = client.post("/api/journeys", json=make_journey(4)).json()
+    for step in range(4):
+        _edit(client, journey["id"], step)
+    first = client.get(f"/api/journeys/{journey['id']}/revisions/1").json()
+    last = client.get(f"/api/journeys/{journey['id']}").json()
+
+    diff = client.get(f"/api/journeys/{journey['id']}/revisions/1/diff/{last['version']}").json()
+    old_nodes = {node["id"]: node for node in first["nodes"]}
+    new_nodes = {node["id"]: node for node in last["nodes"]}
+    assert diff["from_revision"] == 1 and diff["to_revision"] == last["version"]
+    assert {change["field"] for change in diff["fields"]} == {"name", "description", "care_gaps"}
+    assert sorted(diff["nodes"]["added"]) == sorted(new_nodes.keys() - old_nodes.keys())
+    assert sorted(diff["nodes"]["removed"]) == sorted(old_nodes.keys() - new_nodes.keys())
+    assert sorted(diff["nodes"]["changed"]) == sorted(
+        node_id for node_id in new_nodes.keys() & old_nodes.keys() if new_nodes[node_id] != old_nodes[node_id]
+    )
+    assert diff["nodes"]["added"] and diff["nodes"]["removed"] and diff["nodes"]["changed"]
+    old_edges = {edge["id"] for edge in first["edges"]}
+    new_edges = {edge["id"] for edge in last["edges"]}
+    assert sorted(diff["edges"]["added"]) == sorted(new_edges - old_edges)
+    assert sorted(diff["edges"]["removed"]) == sorted(old_edges - new_edges)
+    assert client.get(f"/api/journeys/{journey['id']}/revisions/1/diff/999").status_code == 404
+
+@pytest.fixture(scope="module")
+def listed(client):
+    """Imported journeys under one name token, most of them sharing an updated_at"""
+    token = uuid.uuid4().hex[:8]
+    stamps = ["2030-01-03T09:00:00"] * 5 + ["2030-01-02T09:00:00", "2030-01-01T09:00:00"] + ["2030-01-02T09:00:00"] * 2
+    journeys = [
+        make_journey(2, id=str(uuid.uuid4()), name=f"Listado {token} {i}", updated_at=stamp)
+        for i, stamp in enumerate(stamps)
+    ]
+    _import(client, journeys)
+    return token, journeys
+
+def _expected(journeys, updated_since=None):
+    kept = [journey for journey in journeys if updated_since is None or journey["updated_at"] >= updated_since]
+    return [journey["id"] for journey in sorted(kept, key=lambda j: (j["updated_at"], j["id"]), reverse=True)]
+
+def _pages(client, limit: int, **params) -> list:
+    """Ids of every page, following X-Next-Cursor"""
+    ids, cursor = [], None
+    while True:
+        response = client.get("/api/journeys", params={**params, "limit": limit, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200, response.text
+        page = response.json()
+        assert len(page) <= limit
+        ids.extend(journey["id"] for journey in page)
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            assert "Link" not in response.headers
+            return ids
+        assert response.headers["Link"].endswith('>; rel="next"') and f"cursor={cursor}" in response.headers["Link"]
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 5, 9])
+def test_pages_cover_ties_without_duplicates_or_gaps(client, listed, limit):
+    token, journeys = listed
+    assert _pages(client, limit, name=token) == _expected(journeys)
+
+@pytest.mark.parametrize("params", [
+    {"fields": "summary"},
+    {"updated_since": "2030-01-02T09:00:00"},
+    {"updated_since": "2030-01-02T10:00:00+01:00", "fields": "summary"},
+])
+def test_filters_hold_across_pages(client, listed, params):
+    token, journeys = listed
+    since = params.get("updated_since")
+    if since is not None:
+        since = crud.naive_utc(datetime.fromisoformat(since)).isoformat()
+    assert _pages(client, 2, name=token, **params) == _expected(journeys, since)
+
+def test_summary_pages_carry_counts_only(client, listed):
+    token, _ = listed
+    page = client.get("/api/journeys", params={"name": token, "fields": "summary", "limit": 2}).json()
+    assert all(set(journey) >= {"node_count", "edge_count"} and "nodes" not in journey for journey in page)
+
+def test_name_filter_matches_wildcards_literally(client, listed):
+    token, _ = listed
+    assert client.get("/api/journeys", params={"name": f"Listado {token[:4]}%"}).json() == []
+    assert client.get("/api/journeys", params={"name": f"Listado_{token}"}).json() == []
+
+@pytest.mark.parametrize("cursor", [
+    "not a cursor", "!!!!", base64.urlsafe_b64encode(b"[1]").decode(),
+    base64.urlsafe_b64encode(b'["yesterday", "x"]').decode(), base64.urlsafe_b64encode(b"{}").decode(),
+])
+def test_malformed_cursor_is_rejected(client, cursor):
+    response = client.get("/api/journeys", params={"limit": 2, "cursor": cursor})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+def _validated_body(row) -> bytes:
+    """The JourneyResponse body as the validating path encodes it"""
+    return JourneyResponse(
+        id=row.id, name=row.name, description=row.description,
+        nodes=json.loads(row.nodes_data), edges=json.loads(row.edges_data),
+        care_gaps=json.loads(row.care_gaps_data or "[]"), metrics=json.loads(row.metrics_data or "[]"),
+        clinical_outcomes=json.loads(row.outcomes_data or "[]"),
+        bpmn_version=row.bpmn_version, fhir_version=row.fhir_version,
+        fhir_plan_definition_id=row.fhir_plan_definition_id,
+        version=row.version, created_at=row.created_at, updated_at=row.updated_at,
+    ).model_dump_json().encode()
+
+def _canonical(body: bytes) -> str:
+    # Same values, key order and int/float types; only whitespace and escaping may differ
+    return json.dumps(json.loads(body))
+
+_UNICODE = 'Niño 👶 "urgente" \\ línea\nnueva – 診察'
+
+@pytest.mark.parametrize("body", [
+    make_journey(3, name=_UNICODE, description=_UNICODE),
+    {"name": "Vacío", "nodes": [], "edges": [], "care_gaps": [], "metrics": [], "clinical_outcomes": []},
+    {"name": "Sin descripción", "description": None, "fhir_plan_definition_id": None, **{
+        key: value for key, value in make_journey(2).items() if key != "name"
+    }},
+    make_journey(
+        2, name="Completo", fhir_plan_definition_id="PlanDefinition/ñ-1",
+        care_gaps=[{"gap_type": "delayed_treatment", "severity": "high", "description": _UNICODE, "recommended_action": "Llamar"}],
+        metrics=[{"metric_name": "espera", "value": 12, "unit": "minutes", "status": "on_track"}],
+        clinical_outcomes=[{"outcome_type": "readmission_rate", "current_value": 0.1, "target_value": 1e-3,
+                            "trend": "improving", "measurement_period": "2024"}],
+    ),
+])
+def test_spliced_body_matches_validated_encoding(client, db, body):
+    if body["nodes"]:
+        body["nodes"][0]["data"].update(label=_UNICODE, duration=None, tags=["uno", "dós"], weight=1.5)
+        body["edges"][0]["label"] = None
+    created = client.post("/api/journeys", json=body)
+    assert created.status_code == 200, created.text
+    row = db.query(Journey).filter_by(id=created.json()["id"]).one()
+
+    expected = _canonical(_validated_body(row))
+    assert _canonical(crud._encode_journey(row).content) == expected
+    graph = (json.loads(row.nodes_data), json.loads(row.edges_data))
+    assert _canonical(crud._encode_journey(row, graph).content) == expected
+    assert _canonical(created.content) == expected
+    assert _canonical(client.get(f"/api/journeys/{row.id}").content) == expected
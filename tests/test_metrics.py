@@ -0,0 +1,44 @@
+import subprocess
+import sys
+
+from tests.benchmarks.generator import BACKEND_DIR
+from tests.conftest import make_journey
+
+def _phases(response) -> dict:
+    phases = {}
+    for entry in response.headers["Server-Timing"].split(","):
+        name, _, duration = entry.strip().partition(";dur=")
+        phases[name] = float(duration)
+    return phases
+
+def test_request_validation_is_a_phase(client):
+    response = client.post("/api/journeys", json=make_journey(200))
+    assert response.status_code == 200
+    phases = _phases(response)
+    assert phases["validation"] > 0
+    assert "db" in phases
+
+def test_schema_and_simulation_modules_load_without_instrumentation():
+    # The simulation worker processes import these
+    code = "import sys, models, simulation; assert 'metrics' not in sys.modules, 'metrics imported'"
+    result = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+def _types(exposition: str) -> dict:
+    return dict(line.split()[2:4] for line in exposition.splitlines() if line.startswith("# TYPE "))
+
+def test_monotonic_values_are_exposed_as_counters(client):
+    client.post("/api/journeys", json=make_journey())
+    types = _types(client.get("/api/metrics").text)
+
+    for name in (
+        "db_write_groups_total", "db_write_jobs_total", "response_cache_hits_total",
+        "response_cache_misses_total", "response_cache_evictions_total", "response_cache_invalidations_total",
+    ):
+        assert types[name] == "counter", name
+    for name in (
+        "db_pool_connections_checked_out", "db_pool_connections_idle", "db_sessions_open",
+        "db_write_queue_depth", "response_cache_entries", "response_cache_bytes",
+    ):
+        assert types[name] == "gauge", name
+    assert "db_write_groups" not in types and "response_cache_hits" not in types
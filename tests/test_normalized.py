@@ -0,0 +1,105 @@
+"""JOURNEY_STORAGE=normalized: the journey_nodes/journey_edges rows follow every write.
+
+The flag is read on every call, so the tests switch it on for the running app.
+"""
+import json
+import uuid
+
+import pytest
+
+import database
+from database import Journey, JourneyEdge, JourneyNode
+from tests.conftest import make_journey
+
+@pytest.fixture
+def normalized(monkeypatch):
+    monkeypatch.setattr(database, "NORMALIZED_STORAGE", True)
+
+def _rows(db, journey_id: str):
+    """Node and edge rows in ordinal order; a PATCH may leave gaps in the ordinals"""
+    db.rollback()
+    nodes = [
+        (row.node_id, row.type, row.stage_type, row.department, row.label, row.position_x, json.loads(row.data))
+        for row in db.query(JourneyNode).filter_by(journey_id=journey_id).order_by(JourneyNode.ordinal)
+    ]
+    edges = [
+        (row.edge_id, row.source, row.target)
+        for row in db.query(JourneyEdge).filter_by(journey_id=journey_id).order_by(JourneyEdge.ordinal)
+    ]
+    return nodes, edges
+
+def _expected(journey: dict):
+    nodes = [
+        (node["id"], node["type"], node["data"].get("stage_type"), node["data"].get("department"),
+         node["data"].get("label"), node["position"]["x"], node["data"])
+        for node in journey["nodes"]
+    ]
+    edges = [(edge["id"], edge["source"], edge["target"]) for edge in journey["edges"]]
+    return nodes, edges
+
+def _assert_synced(client, db, journey_id: str):
+    """The normalized rows, the blob columns and GET all describe the same graph"""
+    served = client.get(f"/api/journeys/{journey_id}").json()
+    db.rollback()
+    stored = db.query(Journey).filter_by(id=journey_id).one()
+    assert served["nodes"] == json.loads(stored.nodes_data)
+    assert served["edges"] == json.loads(stored.edges_data)
+    assert _rows(db, journey_id) == _expected(served)
+    return served
+
+def _nodes(client, **filters):
+    response = client.get("/api/nodes", params=filters)
+    assert response.status_code == 200, response.text
+    return [(match["journey_id"], match["node_id"]) for match in response.json()]
+
+def test_rows_follow_create_put_patch_and_delete(client, db, normalized):
+    department = f"Cardiología {uuid.uuid4()}"
+    body = make_journey(4)
+    for node in body["nodes"]:
+        node["data"].update(department=department, stage_type="diagnosis")
+    journey = client.post("/api/journeys", json=body).json()
+    journey_id = journey["id"]
+    _assert_synced(client, db, journey_id)
+
+    # PUT: reorder, drop n0 and move n3 to another department
+    nodes = journey["nodes"][:0:-1]
+    nodes[0]["data"]["department"] = "Urgencias"
+    edges = [edge for edge in journey["edges"] if edge["source"] != "n0"]
+    assert client.put(f"/api/journeys/{journey_id}", json={"nodes": nodes, "edges": edges}).status_code == 200
+    _assert_synced(client, db, journey_id)
+    assert _nodes(client, department=department) == [(journey_id, "n2"), (journey_id, "n1")]
+
+    response = client.patch(f"/api/journeys/{journey_id}", json={"operations": [
+        {"op": "update_node", "id": "n2", "data": {"label": "Consulta"}},
+        {"op": "add_node", "node": {"id": "n9", "type": "end_event", "position": {"x": 9.0, "y": 0.0},
+                                    "data": {"label": "Fin", "department": department}}},
+        {"op": "add_edge", "edge": {"id": "e9", "source": "n3", "target": "n9"}},
+        {"op": "remove_node", "id": "n1"},
+    ]})
+    assert response.status_code == 200, response.text
+    served = _assert_synced(client, db, journey_id)
+    assert [node["id"] for node in served["nodes"]] == ["n3", "n2", "n9"]
+    assert _nodes(client, department=department) == [(journey_id, "n2"), (journey_id, "n9")]
+    assert _nodes(client, department=department, type="end_event") == [(journey_id, "n9")]
+    assert _nodes(client, department=department, stage_type="diagnosis") == [(journey_id, "n2")]
+    assert _nodes(client, department=department, limit=1, offset=1) == [(journey_id, "n9")]
+
+    assert client.delete(f"/api/journeys/{journey_id}").status_code == 200
+    assert _rows(db, journey_id) == ([], [])
+    assert _nodes(client, department=department) == []
+
+def test_node_lookup_spans_journeys(client, normalized):
+    department = f"Oncología {uuid.uuid4()}"
+    ids = []
+    for name in ("Primero", "Segundo"):
+        body = make_journey(2, name=name)
+        body["nodes"][1]["data"]["department"] = department
+        ids.append(client.post("/api/journeys", json=body).json()["id"])
+
+    matches = client.get("/api/nodes", params={"department": department}).json()
+    assert sorted((match["journey_id"], match["journey_name"], match["node_id"]) for match in matches) == sorted(
+        [(ids[0], "Primero", "n1"), (ids[1], "Segundo", "n1")]
+    )
+
+def test_node_lookup_requires_normalized_storage(client):
+    assert client.get("/api/nodes").status_code == 501
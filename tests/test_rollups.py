@@ -0,0 +1,77 @@
+from datetime import date, datetime
+import os
+import subprocess
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+import database
+import rollups
+from database import AnalyticsRollup
+from tests.benchmarks.generator import BACKEND_DIR
+
+# Far from the dates of the other tests' journeys
+DAYS = [date(2031, 1, 6), date(2031, 1, 8), date(2031, 1, 13), date(2031, 2, 2)]
+
+def _journey(day: date):
+    """Stand-in row with the columns journey_rollups reads"""
+    class Row:
+        created_at = datetime.combine(day, datetime.min.time())
+        care_gaps_data = '[{"gap_type": "delayed_treatment", "severity": "high"}]'
+        metrics_data = outcomes_data = "[]"
+    return Row
+
+def _summary(db: Session, group_by: str) -> dict:
+    summary = rollups.summarize(db, since=DAYS[0], until=DAYS[-1], group_by=group_by)
+    return {period.period: period.journeys for period in summary.periods}
+
+def _check_periods(db: Session):
+    for day in DAYS:
+        rollups.apply_rollups(db, {}, rollups.journey_rollups(_journey(day)))
+    db.flush()
+    assert _summary(db, "day") == {"2031-01-06": 1, "2031-01-08": 1, "2031-01-13": 1, "2031-02-02": 1}
+    # 2031-01-06 and 2031-01-13 are Mondays; 2031-02-02 is a Sunday
+    assert _summary(db, "week") == {"2031-01-06": 2, "2031-01-13": 1, "2031-01-27": 1}
+    assert _summary(db, "month") == {"2031-01": 3, "2031-02": 1}
+    assert _summary(db, "none") == {None: 4}
+
+def _sql(group_by: str, dialect) -> str:
+    expression = rollups._period(group_by, dialect.name)
+    return str(expression.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+
+def test_periods_on_sqlite(db):
+    _check_periods(db)
+
+@pytest.mark.skipif(not os.environ.get("TEST_POSTGRESQL_URL"), reason="set TEST_POSTGRESQL_URL to run against PostgreSQL")
+def test_periods_on_postgresql():
+    engine = create_engine(os.environ["TEST_POSTGRESQL_URL"])
+    AnalyticsRollup.__table__.create(engine, checkfirst=True)
+    with Session(engine) as db:
+        try:
+            _check_periods(db)
+        finally:
+            db.rollback()
+
+def test_period_sql_per_dialect():
+    assert _sql("week", postgresql.dialect()) == "to_char(date_trunc('week', analytics_rollups.day), 'YYYY-MM-DD')"
+    assert _sql("month", postgresql.dialect()) == "to_char(analytics_rollups.day, 'YYYY-MM')"
+    assert _sql("week", sqlite.dialect()) == "date(analytics_rollups.day, '-6 days', 'weekday 1')"
+    assert _sql("month", sqlite.dialect()) == "strftime('%Y-%m', analytics_rollups.day)"
+
+def test_compression_is_refused_on_server_databases():
+    environment = {**os.environ, "DATABASE_URL": "postgresql://journeys@localhost/journeys", "JOURNEY_COMPRESSION": "zlib"}
+    result = subprocess.run(
+        [sys.executable, "-c", "import database"], cwd=BACKEND_DIR, env=environment, capture_output=True, text=True,
+    )
+    assert result.returncode != 0
+    assert "JOURNEY_COMPRESSION=zlib requires a SQLite DATABASE_URL" in result.stderr
+
+def test_compressed_values_are_only_bound_for_sqlite(monkeypatch):
+    monkeypatch.setattr(database, "JOURNEY_COMPRESSION", "zlib")
+    text = '{"label": "Consulta"}' * 100
+    column = database.CompressedJSON()
+    assert isinstance(column.process_bind_param(text, sqlite.dialect()), bytes)
+    assert column.process_bind_param(text, postgresql.dialect()) == text
@@ -0,0 +1,80 @@
+import uuid
+
+import pytest
+
+import database
+from tests.conftest import make_journey
+
+pytestmark = pytest.mark.skipif(not database.SEARCH_ENABLED, reason="SQLite without FTS5")
+
+def _hits(client, q: str, **params) -> list:
+    response = client.get("/api/search", params={"q": q, "limit": 200, **params})
+    assert response.status_code == 200, response.text
+    return [(hit["journey_id"], hit["node_id"]) for hit in response.json()]
+
+def _word() -> str:
+    # Letters only, so the tokenizer keeps it as one term
+    return "zq" + "".join(chr(ord("a") + int(c, 16)) for c in uuid.uuid4().hex[:12])
+
+@pytest.fixture
+def journey(client):
+    """A journey whose n1 label contains a word no other node has"""
+    word = _word()
+    body = make_journey()
+    body["nodes"][1]["data"].update(label=f"Consulta {word}", department="Cardiología")
+    return client.post("/api/journeys", json=body).json(), word
+
+def test_new_nodes_are_found(client, journey):
+    journey, word = journey
+    assert _hits(client, word) == [(journey["id"], "n1")]
+    assert _hits(client, f"{word[:8]}*") == [(journey["id"], "n1")]
+    assert _hits(client, f'"consulta {word}"') == [(journey["id"], "n1")]
+    assert _hits(client, f"{word} cardiologia") == [(journey["id"], "n1")]
+    assert _hits(client, word, field="label") == [(journey["id"], "n1")]
+    assert _hits(client, word, field="department") == []
+
+def test_put_replacing_the_text_leaves_no_stale_match(client, journey):
+    journey, word = journey
+    nodes = journey["nodes"]
+    nodes[1]["data"]["label"] = "Consulta"
+    assert client.put(f"/api/journeys/{journey['id']}", json={"nodes": nodes}).status_code == 200
+
+    assert _hits(client, word) == []
+    assert (journey["id"], "n1") in _hits(client, "consulta", field="label")
+
+def test_patch_replacing_or_removing_the_text_leaves_no_stale_match(client, journey):
+    journey, word = journey
+    replacement = _word()
+    response = client.patch(f"/api/journeys/{journey['id']}", json={"operations": [
+        {"op": "update_node", "id": "n1", "data": {"label": replacement}},
+    ]})
+    assert response.status_code == 200, response.text
+    assert _hits(client, word) == []
+    assert _hits(client, replacement) == [(journey["id"], "n1")]
+
+    response = client.patch(f"/api/journeys/{journey['id']}", json={"operations": [{"op": "remove_node", "id": "n1"}]})
+    assert response.status_code == 200, response.text
+    assert _hits(client, replacement) == []
+
+def test_deleted_journey_is_not_found(client, journey):
+    journey, word = journey
+    assert client.delete(f"/api/journeys/{journey['id']}").status_code == 200
+    assert _hits(client, word) == []
+
+@pytest.mark.parametrize("template", [
+    '"', '""', '"{word}', '{word}"', "*", "* *", "{word}*", "-", "-{word}", "{word} -x", "NEAR",
+    "NEAR({word} consulta)", "{word} NEAR consulta", "{word} OR", "AND {word}", "NOT", "(", ")",
+    "label:{word}", "^{word}", "{word} + consulta", "{{", "'", "\\",
+])
+def test_fts_syntax_in_the_query_never_fails(client, journey, template):
+    journey, word = journey
+    response = client.get("/api/search", params={"q": template.format(word=word)})
+    assert response.status_code in (200, 400), response.text
+    if response.status_code == 200:
+        assert isinstance(response.json(), list)
+
+def test_operators_are_matched_as_words(client, journey):
+    journey, word = journey
+    assert _hits(client, f"NEAR {word}") == []  # "near" is not in the label
+    assert _hits(client, f'consulta "{word}') == [(journey["id"], "n1")]
+    assert _hits(client, f"{word} -") == [(journey["id"], "n1")]
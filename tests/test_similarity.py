@@ -0,0 +1,86 @@
+import uuid
+
+import pytest
+
+import similarity
+from database import JourneyFingerprint, SimilarityBucket
+
+def _journey(words: list, stage_types: list, department: str, name: str = "Journey") -> dict:
+    """A chain of nodes labelled with ``words`` pairs, one stage type per node"""
+    nodes = [
+        {"id": f"n{i}", "type": "task", "position": {"x": 100.0 * i, "y": 0.0}, "data": {
+            "label": f"{words[i]} {words[i + 1]}", "stage_type": stage, "department": department,
+            "description": f"{words[i]} revisado por {department}",
+        }}
+        for i, stage in enumerate(stage_types)
+    ]
+    edges = [{"id": f"e{i}", "source": f"n{i}", "target": f"n{i + 1}"} for i in range(len(nodes) - 1)]
+    return {"name": name, "nodes": nodes, "edges": edges}
+
+def _words(count: int) -> list:
+    return [uuid.uuid4().hex for _ in range(count)]
+
+STAGES = ["registration", "consultation", "diagnosis", "treatment", "followup", "treatment", "followup", "discharge"]
+
+def _similar(client, journey_id: str) -> dict:
+    response = client.get(f"/api/journeys/{journey_id}/similar", params={"limit": 100})
+    assert response.status_code == 200, response.text
+    return {match["id"]: match["similarity"] for match in response.json()}
+
+def _buckets(db, journey_id: str) -> set:
+    db.rollback()
+    return {(row.band, row.bucket) for row in db.query(SimilarityBucket).filter_by(journey_id=journey_id)}
+
+@pytest.fixture
+def pair(client):
+    """A journey and a near duplicate with one stage relabelled"""
+    words = _words(len(STAGES) + 1)
+    original = client.post("/api/journeys", json=_journey(words, STAGES, "Cardiología")).json()
+    body = _journey(words, STAGES, "Cardiología", name="Copia")
+    body["nodes"][3]["data"]["label"] = "Tratamiento ajustado"
+    copy = client.post("/api/journeys", json=body).json()
+    return original, copy
+
+def test_signature_estimates_jaccard_similarity():
+    shared = {f"f{i}" for i in range(300)}
+    a = shared | {f"a{i}" for i in range(100)}
+    b = shared | {f"b{i}" for i in range(100)}
+    estimate = similarity.similarity(similarity.minhash(a), similarity.minhash(b))
+    assert estimate == pytest.approx(300 / 500, abs=0.12)
+    assert similarity.similarity(similarity.minhash(a), similarity.minhash(set(a))) == 1.0
+    assert similarity.minhash([]) is None
+
+def test_near_duplicate_is_found_and_unrelated_is_not(client, pair):
+    original, copy = pair
+    unrelated = client.post("/api/journeys", json=_journey(
+        _words(5), ["start_event", "administrative", "laboratory", "imaging"], "Radiología",
+    )).json()
+
+    matches = _similar(client, original["id"])
+    assert matches[copy["id"]] > 0.5
+    assert unrelated["id"] not in matches
+    assert original["id"] not in _similar(client, unrelated["id"])
+    assert client.get(f"/api/journeys/{uuid.uuid4()}/similar").status_code == 404
+
+def test_edited_journey_moves_to_its_new_buckets(client, db, pair):
+    original, copy = pair
+    old_buckets = _buckets(db, copy["id"])
+    assert len(old_buckets) == similarity.LSH_BANDS
+
+    replacement = _journey(_words(5), ["start_event", "administrative", "laboratory", "imaging"], "Radiología")
+    response = client.put(f"/api/journeys/{copy['id']}", json={"nodes": replacement["nodes"], "edges": replacement["edges"]})
+    assert response.status_code == 200, response.text
+
+    new_signature = similarity.minhash(similarity.shingles(replacement["nodes"], replacement["edges"]))
+    new_buckets = set(enumerate(similarity._buckets(new_signature)))
+    assert _buckets(db, copy["id"]) == new_buckets
+    assert not old_buckets & new_buckets
+    assert copy["id"] not in _similar(client, original["id"])
+
+def test_deleted_journey_leaves_the_index(client, db, pair):
+    original, copy = pair
+    assert client.delete(f"/api/journeys/{copy['id']}").status_code == 200
+
+    assert copy["id"] not in _similar(client, original["id"])
+    assert _buckets(db, copy["id"]) == set()
+    assert db.get(JourneyFingerprint, copy["id"]) is None
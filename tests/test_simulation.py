@@ -0,0 +1,47 @@
+import pytest
+
+import simulation
+from tests.conftest import make_journey
+
+def test_default_seed_round_trips_through_json_numbers(client):
+    journey = client.post("/api/journeys", json=make_journey()).json()
+    for node in journey["nodes"]:
+        node["data"]["duration"] = "10-20 minutos"
+    client.put(f"/api/journeys/{journey['id']}", json={"nodes": journey["nodes"]})
+
+    first = client.post(f"/api/journeys/{journey['id']}/simulate", json={"patients": 200}).json()
+    # Exact in an IEEE double, the only number type of JavaScript
+    assert 0 <= first["seed"] < 2**53
+
+    again = client.post(f"/api/journeys/{journey['id']}/simulate", json={"patients": 200, "seed": first["seed"]}).json()
+    assert again["seed"] == first["seed"]
+    assert again["end_to_end"] == first["end_to_end"]
+
+@pytest.fixture
+def small_shards(monkeypatch):
+    """Shards of 100 patients and a fresh process pool, shut down afterwards"""
+    monkeypatch.setattr(simulation, "SIMULATION_SHARD_SIZE", 100)
+    monkeypatch.setattr(simulation, "_process_pool", None)
+    yield
+    if simulation._process_pool is not None:
+        simulation._process_pool.shutdown()
+
+def test_seed_reproduces_the_run_for_any_worker_count(client, monkeypatch, small_shards):
+    journey = client.post("/api/journeys", json=make_journey()).json()
+    for node in journey["nodes"]:
+        node["data"].update(duration="10-20 minutos", capacity=2)
+    client.put(f"/api/journeys/{journey['id']}", json={"nodes": journey["nodes"]})
+
+    results = []
+    for workers in (1, 3):
+        monkeypatch.setattr(simulation, "SIMULATION_WORKERS", workers)
+        response = client.post(f"/api/journeys/{journey['id']}/simulate", json={
+            "patients": 450, "seed": 1234, "arrival_rate_per_hour": 30,
+        })
+        assert response.status_code == 200, response.text
+        result = response.json()
+        del result["elapsed_seconds"]
+        results.append(result)
+
+    assert results[0]["shards"] == 5
+    assert results[0] == results[1]
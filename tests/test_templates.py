@@ -0,0 +1,48 @@
+import pytest
+
+from tests.conftest import make_journey
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Serve the given template dicts instead of the loaded registry"""
+    import server
+    import templates
+    from models import TemplateResponse
+
+    def install(*bodies):
+        registry = templates.TemplateRegistry([TemplateResponse.model_validate(body) for body in bodies])
+        monkeypatch.setattr(server, "template_registry", registry)
+
+    return install
+
+def _template(template_id: str, **graph) -> dict:
+    journey = make_journey()
+    return {"id": template_id, "name": "Plantilla", "description": "", "nodes": journey["nodes"], "edges": journey["edges"], **graph}
+
+def _journey_count(db) -> int:
+    from database import Journey
+
+    db.rollback()
+    return db.query(Journey).count()
+
+def test_instantiate_maps_ids_consistently(client, registry):
+    registry(_template("ok"))
+    journey = client.post("/api/templates/ok/instantiate", json={"name": "Copia"}).json()
+
+    node_ids = {node["id"] for node in journey["nodes"]}
+    assert journey["name"] == "Copia"
+    assert len(node_ids) == 3 and not node_ids & {"n0", "n1", "n2"}
+    assert all(edge["source"] in node_ids and edge["target"] in node_ids for edge in journey["edges"])
+
+@pytest.mark.parametrize("graph", [
+    {"nodes": make_journey()["nodes"] + make_journey(1)["nodes"]},
+    {"edges": make_journey()["edges"] + [{"id": "e-lost", "source": "n2", "target": "missing"}]},
+])
+def test_malformed_template_is_rejected(client, db, registry, graph):
+    registry(_template("broken", **graph))
+    before = _journey_count(db)
+
+    response = client.post("/api/templates/broken/instantiate")
+    assert response.status_code == 422
+    assert "broken" in response.json()["detail"]
+    assert _journey_count(db) == before
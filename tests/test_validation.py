@@ -0,0 +1,43 @@
+import pytest
+
+from templates import BUILTIN_TEMPLATES
+from validation import validate_graph
+
+def _node(node_id: str, node_type: str = "task") -> dict:
+    return {"id": node_id, "type": node_type, "position": {"x": 0, "y": 0}, "data": {"label": node_id}}
+
+def _edges(*pairs) -> list:
+    return [{"id": f"{source}-{target}", "source": source, "target": target} for source, target in pairs]
+
+def _codes(report: dict, severity: str) -> list:
+    return sorted(issue["code"] for issue in report["issues"] if issue["severity"] == severity)
+
+@pytest.mark.parametrize("template", BUILTIN_TEMPLATES, ids=lambda template: template["id"])
+def test_builtin_templates_validate_cleanly(template):
+    report = validate_graph(template["nodes"], template["edges"])
+    assert report["issues"] == []
+    assert report["valid"]
+
+def test_templates_endpoint_reports_builtins_as_compliant(client):
+    templates = {template["id"]: template for template in client.get("/api/templates").json()}
+    for template in BUILTIN_TEMPLATES:
+        assert templates[template["id"]]["bpmn_compliant"]
+
+def test_task_only_graph_gets_warnings_for_missing_events():
+    report = validate_graph([_node("a"), _node("b")], _edges(("a", "b")))
+    assert report["valid"]
+    assert _codes(report, "warning") == ["dead_end", "missing_start_event"]
+
+def test_task_only_cycle_with_an_exit_is_valid():
+    nodes = [_node("a"), _node("review"), _node("done")]
+    report = validate_graph(nodes, _edges(("a", "review"), ("review", "a"), ("review", "done")))
+    assert report["valid"]
+
+def test_graph_with_events_requires_them_everywhere():
+    nodes = [_node("start", "start_event"), _node("a"), _node("b"), _node("end", "end_event")]
+    report = validate_graph(nodes, _edges(("start", "a"), ("a", "end"), ("start", "b")))
+    assert not report["valid"]
+    assert _codes(report, "error") == ["dead_end"]
+
+    report = validate_graph([_node("a"), _node("end", "end_event")], _edges(("a", "end")))
+    assert _codes(report, "error") == ["missing_start_event"]